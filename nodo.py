@@ -142,6 +142,7 @@ if __name__ == '__main__':
             "\n- serve"
             "\n- migrate"
             "\n- storage:prune_blocks"
+            "\n- storage:stats"
             "\n- test <test name>"
             "\n- rundev <repository path>"
             "\n- submit_reputation"
@@ -272,6 +273,10 @@ if __name__ == '__main__':
                 from src.commands.storage import prune_blocks
                 prune_blocks()
 
+            case 'storage:stats':
+                from src.commands.storage import block_stats
+                block_stats()
+
             case 'test':
                 _t = sys.argv[2]
                 getattr(__import__(f"tests.{_t}", fromlist=[_t]), _t)()  # Import the test passed on param.
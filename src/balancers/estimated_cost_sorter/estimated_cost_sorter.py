@@ -1,59 +1,70 @@
-from typing import Dict, Tuple, Generator
+from typing import Dict, List, Tuple, Generator
 
 from protos import gateway_pb2
-from src.reputation_system.interface import compute_reputation
-from src.utils.cost_functions.general_cost_functions import normalized_maintain_cost
-from src.utils.cost_functions.variance_cost_normalization import variance_cost_normalization
+from src.manager.peer_performance import PeerPerformance
+from src.reputation_system.interface import compute_reputations
 from src.utils.env import EnvManager
-from src.utils.utils import from_gas_amount
 
 env_manager = EnvManager()
 SOCIALIZATION_FACTOR = env_manager.get_env("SOCIALIZATION_FACTOR")
 WEIGHT_CONFIGURATION_FACTOR = env_manager.get_env("WEIGHT_CONFIGURATION_FACTOR")
 INIT_COST_CONFIGURATION_FACTOR = env_manager.get_env("INIT_COST_CONFIGURATION_FACTOR")
 MAINTENANCE_COST_CONFIGURATION_FACTOR = env_manager.get_env("MAINTENANCE_COST_CONFIGURATION_FACTOR")
+COST_AVERAGE_VARIATION = env_manager.get_env("COST_AVERAGE_VARIATION")
+
+
+def peer_weights(peer_ids: List[str]) -> Dict[str, float]:
+    """
+    Weight of each peer on the scores: its reputation, weighted by its observed success rate and latency.
+    """
+    reputations: Dict[str, float] = compute_reputations(peer_ids=peer_ids) if peer_ids else {}
+    performances: Dict[str, float] = PeerPerformance().factors(peer_ids=peer_ids)
+    return {_id: (SOCIALIZATION_FACTOR + reputations[_id]) * performances[_id] for _id in peer_ids}
+
+
+def __scores(
+        peer_ids: List[str],
+        estimated_costs: List[gateway_pb2.EstimatedCost],
+        weight_clauses: Dict[int, int],
+        local: bool
+) -> List[float]:
+    """
+    Scores all the candidates in one pass, with the same formula as variance_cost_normalization
+    and normalized_maintain_cost (gas amounts are integers on the n field).
+    """
+    weights: Dict[str, float] = {} if local else \
+        peer_weights(peer_ids=[_id for _id in peer_ids if _id != 'local'])
+
+    # If the combinational resource clause don't have a cost_weight, it's like equal to 1 cost weight.
+    priorities = [WEIGHT_CONFIGURATION_FACTOR * max(1, weight_clauses[e.comb_resource_selected]) for e in estimated_costs]
+    variations = [1 + e.variance * COST_AVERAGE_VARIATION for e in estimated_costs]
+    costs = [
+        int(int(e.cost.n) * variation) * INIT_COST_CONFIGURATION_FACTOR +
+        int((
+                int(int(e.min_maintenance_cost.n) * e.maintenance_seconds_loop * variation) +
+                int(int(e.max_maintenance_cost.n) * e.maintenance_seconds_loop * variation)
+        ) / 2) * MAINTENANCE_COST_CONFIGURATION_FACTOR
+        for e, variation in zip(estimated_costs, variations)
+    ]
+    _reputations = [1 if local or _id == 'local' else weights[_id] for _id in peer_ids]
+
+    # A free estimation is scored as the cheapest possible one.
+    return [
+        priority * reputation / max(cost, 1)
+        for priority, reputation, cost in zip(priorities, _reputations, costs)
+    ]
+
 
 def estimated_cost_sorter(
         estimated_costs: Dict[str, gateway_pb2.EstimatedCost],
-        weight_clauses: Dict[int, int]
+        weight_clauses: Dict[int, int],
+        local: bool = False  # All the candidates are clauses of this node.
 ) -> Generator[Tuple[str, gateway_pb2.EstimatedCost], None, None]:
-    def __compute_score(peer_id: str, estimated_cost: gateway_pb2.EstimatedCost) -> float:
-        priority: int = WEIGHT_CONFIGURATION_FACTOR * max(1, weight_clauses[estimated_cost.comb_resource_selected])  # If the combinational resource clause don't have a cost_weight, it's like equal to 1 cost weight.
-        cost: int = sum([
-            variance_cost_normalization(
-                from_gas_amount(estimated_cost.cost),
-                estimated_cost.variance
-            ) * INIT_COST_CONFIGURATION_FACTOR,
-            int(
-                sum([
-                    variance_cost_normalization(
-                        normalized_maintain_cost(
-                            from_gas_amount(estimated_cost.min_maintenance_cost),
-                            estimated_cost.maintenance_seconds_loop
-                        ),
-                        estimated_cost.variance
-                    ),
-                    variance_cost_normalization(
-                        normalized_maintain_cost(
-                            from_gas_amount(estimated_cost.max_maintenance_cost),
-                            estimated_cost.maintenance_seconds_loop
-                        ),
-                        estimated_cost.variance
-                    )
-                ]) / 2
-            ) * MAINTENANCE_COST_CONFIGURATION_FACTOR
-        ])
-        reputation: float = 1 if peer_id == 'local' else SOCIALIZATION_FACTOR + compute_reputation(peer_id=peer_id)
-
-        print(f"\nDebug: For peer {peer_id}: priority {priority}, reputation {reputation}, cost {cost} => score {priority * reputation / cost}\n", flush=True)
-
-        return priority * reputation / cost
+    peer_ids: List[str] = list(estimated_costs.keys())
+    costs: List[gateway_pb2.EstimatedCost] = list(estimated_costs.values())
+    scores: List[float] = __scores(peer_ids=peer_ids, estimated_costs=costs, weight_clauses=weight_clauses, local=local)
 
     return (
-        (_id, estimated_cost) for _id, estimated_cost in
-        sorted(
-            estimated_costs.items(),
-            key=lambda item: __compute_score(item[0], item[1]),
-            reverse=True
-        )
+        (peer_ids[i], costs[i]) for i in
+        sorted(range(len(peer_ids)), key=scores.__getitem__, reverse=True)
     )
@@ -1,24 +1,44 @@
-from typing import Optional, Dict, Generator
+import random
+from typing import Optional, Dict, Generator, List
 
-import grpc
 from bee_rpc import client as bee
 
 import protos.celaut_pb2 as celaut
 from protos import gateway_pb2, gateway_pb2_grpc
 from protos.gateway_pb2_bee import StartService_input_indices
-from src.balancers.estimated_cost_sorter.estimated_cost_sorter import estimated_cost_sorter
+from src.balancers.estimated_cost_sorter.estimated_cost_sorter import estimated_cost_sorter, peer_weights
+from src.database.access_functions.peers import get_peer_ids
 from src.virtualizers.docker import build
 from src.manager.manager import default_initial_cost, get_client_id_on_other_peer
+from src.manager.peer_performance import PeerPerformance, peer_channel
 from src.utils import logger as log
 from src.utils.cost_functions.generate_estimated_cost import generate_estimated_cost
-from src.utils.utils import from_gas_amount, service_extended, peers_id_iterator, \
-    generate_uris_by_peer_id
+from src.utils.utils import from_gas_amount, service_extended, peers_id_iterator
 from src.utils.env import EnvManager
 
 env_manager = EnvManager()
 
 SEND_ONLY_HASHES_ASKING_COST = env_manager.get_env("SEND_ONLY_HASHES_ASKING_COST")
 EXTERNAL_COST_TIMEOUT = env_manager.get_env("EXTERNAL_COST_TIMEOUT")
+SERVICE_BALANCER_SAMPLE_SIZE = env_manager.get_env("SERVICE_BALANCER_SAMPLE_SIZE")
+SERVICE_BALANCER_EXPLORATION = env_manager.get_env("SERVICE_BALANCER_EXPLORATION")
+SERVICE_BALANCER_MIN_CANDIDATES = env_manager.get_env("SERVICE_BALANCER_MIN_CANDIDATES")
+
+
+def __peers_to_ask() -> List[str]:
+    """
+    Peers in the order they are asked: the best ranked ones, some random ones to explore the network,
+    and then the rest by rank.
+    """
+    peer_ids: List[str] = list(get_peer_ids())
+    if not SERVICE_BALANCER_SAMPLE_SIZE:
+        return peer_ids
+    weights: Dict[str, float] = peer_weights(peer_ids=peer_ids)
+    ranked: List[str] = sorted(peer_ids, key=weights.__getitem__, reverse=True)
+    top, rest = ranked[:SERVICE_BALANCER_SAMPLE_SIZE], ranked[SERVICE_BALANCER_SAMPLE_SIZE:]
+    explore = set(random.sample(rest, min(SERVICE_BALANCER_EXPLORATION, len(rest))))
+    return top + [_id for _id in rest if _id in explore] + [_id for _id in rest if _id not in explore]
+
 
 def service_balancer(
         metadata: celaut.Metadata,
@@ -47,15 +67,22 @@ def service_balancer(
         raise e
 
     try:
-        for peer_id in peers_id_iterator(ignore_network=ignore_network):
+        # Only the sample is asked, and more peers while there are not enough candidates.
+        asked = 0
+        for peer_id in peers_id_iterator(ignore_network=ignore_network, peer_ids=__peers_to_ask()):
+            if SERVICE_BALANCER_SAMPLE_SIZE and len(peers) >= SERVICE_BALANCER_MIN_CANDIDATES \
+                    and asked >= SERVICE_BALANCER_SAMPLE_SIZE + SERVICE_BALANCER_EXPLORATION:
+                break
+            if not PeerPerformance().available(peer_id=peer_id, method='GetServiceEstimatedCost'):
+                log.LOGGER('Skip the peer ' + peer_id + ', it is failing to give costs.')
+                continue
+            asked += 1
             log.LOGGER('Check cost on peer ' + peer_id)
             # TODO could use async or concurrency
             try:
                 peers[peer_id] = next(bee.client_grpc(
                         method=gateway_pb2_grpc.GatewayStub(
-                            grpc.insecure_channel(
-                                next(generate_uris_by_peer_id(peer_id))
-                            )
+                            peer_channel(peer_id=peer_id)
                         ).GetServiceEstimatedCost,
                         indices_parser=gateway_pb2.EstimatedCost,
                         timeout=EXTERNAL_COST_TIMEOUT,
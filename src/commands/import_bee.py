@@ -3,6 +3,7 @@ from protos import celaut_pb2
 from bee_rpc.client import read_from_file
 
 from src.gateway.iterables.abstract_service_iterable import find_service_hash
+from src.manager.registry_store import store_service
 from src.utils.env import EnvManager
 
 env_manager = EnvManager()
@@ -39,7 +40,10 @@ def import_bee(path: str):
         
         service_dir = next(it).dir
         if not service_saved:
-            os.system(f"mv {service_dir} {os.path.join(REGISTRY, service_hash)}")
+            if not store_service(service_dir=service_dir, service_hash=service_hash,
+                                 expected_hashes=metadata.hashtag.hash):
+                print("The service doesn't match the hashes of its metadata.")
+                return
             
         else:
             os.system(f"rm -rf {service_dir}")
@@ -8,6 +8,7 @@ from protos import celaut_pb2, pack_pb2, gateway_pb2_bee, gateway_pb2_grpc
 from src.commands.packer.zip_with_dockerfile.prepare_directory import prepare_directory
 from src.commands.packer.zip_with_dockerfile.generate_service_zip import generate_service_zip
 from src.database.access_functions.peers import get_peer_ids, get_peer_directions
+from src.manager.registry_store import store_service
 from src.utils.env import EnvManager
 
 env_manager = EnvManager()
@@ -81,7 +82,9 @@ def __on_peer(peer: str, service_zip_dir: str):
                     f.write(b.SerializeToString())
             elif type(b) == grpcbb.Dir and b.type == pack_pb2.Service and _id:
                 # b is ServiceWithMeta grpc-bb cache directory.
-                os.system(f"mv {b.dir} {REGISTRY}{_id}")
+                if not store_service(service_dir=b.dir, service_hash=_id):
+                    print(f"\nThe service received doesn't match its id {_id}")
+                    return
             elif type(b) == pack_pb2.PackOutputError:
                 print(f"\nError in the compilation process: \n{b.message}")
                 return
@@ -1,4 +1,5 @@
 import os
+from src.manager.block_store import unregister_service_blocks
 from src.utils.env import EnvManager, DOCKER_COMMAND
 
 env_manager = EnvManager()
@@ -15,6 +16,9 @@ def remove(service: str):
         print("This script requires superuser privileges. Please run with sudo.")
         return
 
+    # Its blocks will be collected once they are not used by other services.
+    unregister_service_blocks(service_hash=service)
+
     # Iterate through the commands and execute each.
     for cmd in [
         f"{DOCKER_COMMAND} rmi {service}.docker --force",
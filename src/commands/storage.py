@@ -1,28 +1,20 @@
-import json
-import os
-from typing import List
+from src.manager.block_store import rebuild_block_references, collect_unused_blocks, get_block_usage
 
-from src.utils.env import EnvManager
 
-env_manager = EnvManager()
-
-REGISTRY = env_manager.get_env("REGISTRY")
-BLOCKDIR = env_manager.get_env("BLOCKDIR")
-
-
-# It will delete all unused cache and blocks.
+# It will delete all unused blocks (once the grace period is over).
 def prune_blocks():
-    blocks_used: List[str] = []
+    # Resync the block references with the registry before collecting.
+    rebuild_block_references()
+    deleted = collect_unused_blocks(batch_size=None)
+    print(f"{deleted} blocks deleted")
 
-    # Take used blocks..
-    for service in os.listdir(REGISTRY):
-        _js = json.load(open(f"{REGISTRY}/{service}/_.json"))
-        for partition in _js:
-            if type(partition) is list:
-                blocks_used.append(partition[0])
 
-    # Delete unused blocks.
-    for block in os.listdir(BLOCKDIR):
-        if block not in blocks_used:
-            os.remove(f"{BLOCKDIR}/{block}")
-            print(f"Block {block[:6]} deleted")
+def block_stats():
+    usage = get_block_usage()
+    print("Blocks:\n")
+    for block in usage:
+        print(f"{block['hash'][:6]}     refs {block['refs']}     {(block['size'] or 0) / (1024 * 1024):.2f} MB"
+              f"     {', '.join(s[:6] for s in block['services'])}"
+              f"{'     unreferenced since ' + block['unreferenced_since'] if block['unreferenced_since'] else ''}")
+    print(f"\n{len(usage)} blocks, {sum(b['size'] or 0 for b in usage) / (1024 * 1024):.2f} MB, "
+          f"{len([b for b in usage if b['refs'] <= 0])} unreferenced.")
@@ -141,6 +141,59 @@ def create_tables(cursor):
                 FOREIGN KEY (client_id) REFERENCES clients (id)
             )
         ''',
+        "block": '''
+            CREATE TABLE IF NOT EXISTS block (
+                hash TEXT PRIMARY KEY,
+                refs INTEGER DEFAULT 0,
+                size INTEGER,
+                unreferenced_since DATETIME DEFAULT NULL
+            )
+        ''',
+        "service_block": '''
+            CREATE TABLE IF NOT EXISTS service_block (
+                service_hash TEXT,
+                block_hash TEXT,
+                PRIMARY KEY (service_hash, block_hash),
+                FOREIGN KEY (block_hash) REFERENCES block (hash)
+            )
+        ''',
+        "block_store_state": '''
+            CREATE TABLE IF NOT EXISTS block_store_state (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                references_rebuilt_at DATETIME
+            )
+        ''',
+        "peer_performance": '''
+            CREATE TABLE IF NOT EXISTS peer_performance (
+                peer_id TEXT,
+                method TEXT,
+                latency REAL,
+                success_rate REAL,
+                timeouts INTEGER,
+                calls INTEGER,
+                last_call REAL,
+                PRIMARY KEY (peer_id, method)
+            )
+        ''',
+        "reputation_event": '''
+            CREATE TABLE IF NOT EXISTS reputation_event (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                entity_type TEXT,
+                entity_id TEXT,
+                amount INTEGER,
+                events INTEGER,
+                timestamp REAL
+            )
+        ''',
+        "reputation_entity": '''
+            CREATE TABLE IF NOT EXISTS reputation_entity (
+                entity_type TEXT,
+                entity_id TEXT,
+                score INTEGER,
+                events INTEGER,
+                PRIMARY KEY (entity_type, entity_id)
+            )
+        ''',
         "energy_consumption": '''
             CREATE TABLE IF NOT EXISTS energy_consumption (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -1,6 +1,5 @@
 import datetime
 import os
-import math
 import uuid
 import sqlite3
 import time
@@ -123,6 +122,44 @@ class SQLConnection(metaclass=Singleton):
                 SQLConnection._connection.rollback()
                 raise e
 
+    def _execute_many(self, query: str, params_list: List[tuple]) -> sqlite3.Cursor:
+        """
+        Executes a query for each set of parameters on a single transaction, ensuring thread safety.
+
+        Args:
+            query (str): The SQL query to execute.
+            params_list (List[tuple]): The parameters to bind to each execution.
+
+        Returns:
+            sqlite3.Cursor: The cursor for the executed queries.
+        """
+        with SQLConnection._lock:
+            try:
+                cursor = SQLConnection._connection.cursor()
+                cursor.executemany(query, params_list)
+                SQLConnection._connection.commit()
+                return cursor
+            except sqlite3.Error as e:
+                SQLConnection._connection.rollback()
+                raise e
+
+    def _execute_transaction(self, statements: List[Tuple[str, List[tuple]]]):
+        """
+        Executes several queries, each one for every set of its parameters, on a single transaction.
+
+        Args:
+            statements (List[Tuple[str, List[tuple]]]): The queries with their parameters, in order.
+        """
+        with SQLConnection._lock:
+            try:
+                cursor = SQLConnection._connection.cursor()
+                for query, params_list in statements:
+                    cursor.executemany(query, params_list)
+                SQLConnection._connection.commit()
+            except sqlite3.Error as e:
+                SQLConnection._connection.rollback()
+                raise e
+
     # Client Methods
 
     def add_client(self, client_id: str, gas: int, last_usage: Optional[float]):
@@ -482,69 +519,126 @@ class SQLConnection(metaclass=Singleton):
 
     # Peer Methods
 
-    def update_reputation_peer(self, peer_id: str, amount: int) -> bool:
+    def get_reputations(self, peer_ids: List[str]) -> Dict[str, Tuple[int, int]]:
         """
-        Updates the reputation of a peer by increasing the reputation score and index.
+        Retrieves the reputation score and index of several peers with a single query per batch.
 
         Args:
-            peer_id (str): The ID of the peer whose reputation is to be updated.
-            amount (int): The amount to add to the reputation score.
+            peer_ids (List[str]): The IDs of the peers.
 
         Returns:
-            bool: True if the update was successful, False otherwise.
+            Dict[str, Tuple[int, int]]: The reputation score and index of each peer found.
+        """
+        reputations: Dict[str, Tuple[int, int]] = {}
+        for i in range(0, len(peer_ids), 500):  # Below the SQLite limit of query parameters.
+            batch = peer_ids[i:i + 500]
+            result = self._execute(
+                f'SELECT id, reputation_score, reputation_index FROM peer WHERE id IN ({",".join("?" * len(batch))})',
+                tuple(batch)
+            )
+            for row in result.fetchall():
+                reputations[row['id']] = (row['reputation_score'] or 0, row['reputation_index'] or 0)
+        return reputations
+
+    def get_entity_reputations(self, entity_type: str, entity_ids: List[str]) -> Dict[str, Tuple[int, int]]:
         """
-        try:
-            # Fetch current reputation score and index
-            result = self._execute('SELECT reputation_score, reputation_index FROM peer WHERE id = ?', (peer_id,))
-            row = result.fetchone()
+        Retrieves the reputation score and number of events of several entities (services, clients, ledgers ...).
 
-            if row:
-                current_score = row['reputation_score'] or 0  # Handle potential NULL values
-                current_index = row['reputation_index'] or 0
+        Args:
+            entity_type (str): The type of the entities.
+            entity_ids (List[str]): The IDs of the entities.
 
-                # Update the reputation score and index
-                new_score = current_score + amount
-                new_index = current_index + 1
+        Returns:
+            Dict[str, Tuple[int, int]]: The reputation score and number of events of each entity found.
+        """
+        reputations: Dict[str, Tuple[int, int]] = {}
+        for i in range(0, len(entity_ids), 500):  # Below the SQLite variables limit.
+            batch = entity_ids[i:i + 500]
+            result = self._execute(
+                f'SELECT entity_id, score, events FROM reputation_entity '
+                f'WHERE entity_type = ? AND entity_id IN ({",".join("?" * len(batch))})',
+                (entity_type, *batch)
+            )
+            for row in result.fetchall():
+                reputations[row['entity_id']] = (row['score'], row['events'])
+        return reputations
 
-                self._execute('''
-                    UPDATE peer SET reputation_score = ?, reputation_index = ? WHERE id = ?
-                ''', (new_score, new_index, peer_id))
+    def add_reputation_events(self, events: List[Tuple[str, str, int, float]],
+                              updates: Dict[Tuple[str, str], Tuple[int, int]], peer_type: str):
+        """
+        Appends the events to the reputation log and applies their aggregation to the scores,
+        on a single transaction.
 
-                return True
-            else:
-                raise Exception(f'Peer not found: {peer_id}')
-        except Exception as e:
-            logger.LOGGER(f'Error updating reputation for peer {peer_id}: {e}')
-            return False
+        Args:
+            events (List[Tuple[str, str, int, float]]): The entity type, entity ID, amount and timestamp of each event.
+            updates (Dict[Tuple[str, str], Tuple[int, int]]): The amount and number of events of each entity.
+            peer_type (str): The entity type of the peers, whose scores are on the peer table.
+                Peers that don't exist are ignored.
+        """
+        self._execute_transaction([
+            ('''
+                INSERT INTO reputation_event (entity_type, entity_id, amount, events, timestamp)
+                VALUES (?, ?, ?, 1, ?)
+            ''', events),
+            ('''
+                UPDATE peer
+                SET reputation_score = COALESCE(reputation_score, 0) + ?,
+                    reputation_index = COALESCE(reputation_index, 0) + ?
+                WHERE id = ?
+            ''', [(amount, count, _id) for (_type, _id), (amount, count) in updates.items() if _type == peer_type]),
+            ('''
+                INSERT INTO reputation_entity (entity_type, entity_id, score, events) VALUES (?, ?, ?, ?)
+                ON CONFLICT (entity_type, entity_id) DO UPDATE
+                SET score = score + excluded.score, events = events + excluded.events
+            ''', [(_type, _id, amount, count) for (_type, _id), (amount, count) in updates.items()
+                  if _type != peer_type]),
+        ])
+
+    def compact_reputation_events(self, before: float):
+        """
+        Compacts the reputation events older than the given time into one event per entity, timestamped
+        at that time. Their aggregation is already on the scores, so only the history gets shorter.
 
-    def get_reputation(self, peer_id: str) -> Optional[float]:
+        Args:
+            before (float): Timestamp of the oldest event kept as it is.
         """
-        Retrieves the reputation score for a peer, adjusted by the reputation index.
+        self._execute_transaction([
+            ('''
+                INSERT INTO reputation_event (entity_type, entity_id, amount, events, timestamp)
+                SELECT entity_type, entity_id, SUM(amount), SUM(events), ?
+                FROM reputation_event WHERE timestamp < ?
+                GROUP BY entity_type, entity_id
+            ''', [(before, before)]),
+            ('''
+                DELETE FROM reputation_event WHERE timestamp < ?
+            ''', [(before,)]),
+        ])
 
-        Args:
-            peer_id (str): The ID of the peer whose reputation is to be retrieved.
+    # Peer Performance
 
-        Returns:
-            Optional[float]: The adjusted reputation score, or None if the peer is not found.
+    def get_peer_performance(self) -> List[sqlite3.Row]:
         """
-        try:
-            # Fetch current reputation score and index
-            result = self._execute('SELECT reputation_score, reputation_index FROM peer WHERE id = ?', (peer_id,))
-            row = result.fetchone()
+        Fetches the performance index of every peer and method.
 
-            if row:
-                reputation_score = row['reputation_score'] or 0  # Handle potential NULL values
-                reputation_index = row['reputation_index'] or 1  # Default to 1 to avoid division by zero
+        Returns:
+            List[sqlite3.Row]: The rows with peer_id, method, latency, success_rate, timeouts, calls and last_call.
+        """
+        return self._execute('''
+            SELECT peer_id, method, latency, success_rate, timeouts, calls, last_call FROM peer_performance
+        ''').fetchall()
 
-                # Calculate the adjusted reputation score
-                adjusted_reputation = reputation_score * (1 + math.log(reputation_index))
+    def save_peer_performance(self, rows: List[Tuple[str, str, float, float, int, int, float]]):
+        """
+        Saves the performance index, replacing the previous values.
 
-                return adjusted_reputation
-            else:
-                raise Exception(f'Peer not found: {peer_id}')
-        except Exception as e:
-            logger.LOGGER(f'Error fetching reputation for peer {peer_id}: {e}')
-            return None
+        Args:
+            rows (List[Tuple]): peer_id, method, latency, success_rate, timeouts, calls and last_call of each entry.
+        """
+        self._execute_many('''
+            INSERT OR REPLACE INTO peer_performance
+            (peer_id, method, latency, success_rate, timeouts, calls, last_call)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', rows)
 
     def submit_to_ledger(self, submit: Callable[[List[Tuple[str, int, str]]], bool], force_submit: bool = False) -> bool:
         """
@@ -1389,6 +1483,142 @@ class SQLConnection(metaclass=Singleton):
             DELETE FROM tunnels WHERE id = ?
         ''', (tunnel_id,))
 
+    # Block store
+
+    def add_service_blocks(self, service_hash: str, blocks: Dict[str, int]) -> int:
+        """
+        References the blocks used by a service, increasing the reference count of each block
+        the first time the service references it.
+
+        Args:
+            service_hash (str): The hash of the service.
+            blocks (Dict[str, int]): The block hashes used by the service and their sizes.
+
+        Returns:
+            int: The number of new references added.
+        """
+        added = 0
+        for block_hash, size in blocks.items():
+            if self._execute('''
+                INSERT OR IGNORE INTO service_block (service_hash, block_hash)
+                VALUES (?, ?)
+            ''', (service_hash, block_hash)).rowcount == 0:
+                continue  # Already referenced by this service.
+
+            self._execute('''
+                INSERT INTO block (hash, refs, size, unreferenced_since)
+                VALUES (?, 1, ?, NULL)
+                ON CONFLICT(hash) DO UPDATE SET refs = refs + 1, size = excluded.size, unreferenced_since = NULL
+            ''', (block_hash, size))
+            added += 1
+        return added
+
+    def remove_service_blocks(self, service_hash: str) -> List[str]:
+        """
+        Removes the block references of a service, decreasing the reference count of each block.
+
+        Args:
+            service_hash (str): The hash of the service.
+
+        Returns:
+            List[str]: The block hashes that are no longer referenced by any service.
+        """
+        blocks = [row['block_hash'] for row in self._execute('''
+            SELECT block_hash FROM service_block WHERE service_hash = ?
+        ''', (service_hash,)).fetchall()]
+
+        self._execute('DELETE FROM service_block WHERE service_hash = ?', (service_hash,))
+
+        unreferenced = []
+        for block_hash in blocks:
+            self._execute('''
+                UPDATE block
+                SET refs = MAX(refs - 1, 0),
+                    unreferenced_since = CASE WHEN refs - 1 <= 0 THEN CURRENT_TIMESTAMP ELSE NULL END
+                WHERE hash = ?
+            ''', (block_hash,))
+            row = self._execute('SELECT refs FROM block WHERE hash = ?', (block_hash,)).fetchone()
+            if row and row['refs'] <= 0:
+                unreferenced.append(block_hash)
+        return unreferenced
+
+    def get_block(self, block_hash: str) -> Optional[dict]:
+        """
+        Retrieves the reference information of a block.
+
+        Args:
+            block_hash (str): The hash of the block.
+
+        Returns:
+            Optional[dict]: The block details, including the seconds since it was unreferenced,
+                or None if the block is not registered.
+        """
+        row = self._execute('''
+            SELECT hash, refs, size, unreferenced_since,
+                   CAST(STRFTIME('%s', 'now') - STRFTIME('%s', unreferenced_since) AS INTEGER) AS unreferenced_seconds
+            FROM block WHERE hash = ?
+        ''', (block_hash,)).fetchone()
+        return dict(row) if row else None
+
+    def delete_block(self, block_hash: str):
+        """
+        Deletes a block and its references from the database.
+
+        Args:
+            block_hash (str): The hash of the block.
+        """
+        self._execute('DELETE FROM service_block WHERE block_hash = ?', (block_hash,))
+        self._execute('DELETE FROM block WHERE hash = ?', (block_hash,))
+
+    def get_blocks_usage(self) -> List[dict]:
+        """
+        Fetches the usage statistics of every registered block.
+
+        Returns:
+            List[dict]: A list of dictionaries with the block hash, reference count, size,
+                the time it was unreferenced and the services that use it.
+        """
+        result = self._execute('''
+            SELECT b.hash, b.refs, b.size, b.unreferenced_since, GROUP_CONCAT(sb.service_hash) AS services
+            FROM block b
+            LEFT JOIN service_block sb ON sb.block_hash = b.hash
+            GROUP BY b.hash
+            ORDER BY b.refs DESC, b.size DESC
+        ''')
+        return [{
+            'hash': row['hash'],
+            'refs': row['refs'],
+            'size': row['size'],
+            'unreferenced_since': row['unreferenced_since'],
+            'services': row['services'].split(',') if row['services'] else []
+        } for row in result.fetchall()]
+
+    def clear_block_references(self):
+        """
+        Deletes all the block references, used to rebuild them from the registry.
+        """
+        self._execute('DELETE FROM service_block')
+        self._execute('UPDATE block SET refs = 0, unreferenced_since = CURRENT_TIMESTAMP')
+
+    def set_block_references_rebuilt(self):
+        """
+        Records that the block references were rebuilt from the whole registry.
+        """
+        self._execute('''
+            INSERT INTO block_store_state (id, references_rebuilt_at) VALUES (1, CURRENT_TIMESTAMP)
+            ON CONFLICT(id) DO UPDATE SET references_rebuilt_at = excluded.references_rebuilt_at
+        ''')
+
+    def block_references_rebuilt(self) -> bool:
+        """
+        Checks if the block references were ever rebuilt from the whole registry.
+
+        Returns:
+            bool: True once every service on the registry has its blocks referenced.
+        """
+        row = self._execute('SELECT references_rebuilt_at FROM block_store_state WHERE id = 1').fetchone()
+        return bool(row and row['references_rebuilt_at'])
+
     # Payment system
     def add_deposit_token(self, client_id: str, status: str) -> str:
         """
@@ -0,0 +1,205 @@
+import asyncio
+import threading
+from collections import OrderedDict
+from time import monotonic
+from typing import Dict, Optional, Tuple
+
+import grpc
+
+from src.database.sql_connection import SQLConnection
+from src.gateway.method_classes import method_class, CONTROL, METERING, HEAVY, STREAMING
+from src.utils import logger as log
+from src.utils.singleton import Singleton
+from src.utils.utils import get_only_the_ip_from_context
+from src.utils.env import EnvManager
+
+env_manager = EnvManager()
+
+GATEWAY_CONTROL_WORKERS = int(env_manager.get_env("GATEWAY_CONTROL_WORKERS"))
+GATEWAY_METERING_WORKERS = int(env_manager.get_env("GATEWAY_METERING_WORKERS"))
+GATEWAY_HEAVY_WORKERS = int(env_manager.get_env("GATEWAY_HEAVY_WORKERS"))
+GATEWAY_STREAMING_WORKERS = int(env_manager.get_env("GATEWAY_STREAMING_WORKERS"))
+GATEWAY_ADMISSION_QUEUE = int(env_manager.get_env("GATEWAY_ADMISSION_QUEUE"))
+GATEWAY_CLIENT_RATE = float(env_manager.get_env("GATEWAY_CLIENT_RATE"))
+GATEWAY_CLIENT_BURST = float(env_manager.get_env("GATEWAY_CLIENT_BURST"))
+MAX_SERVER_THREADS = int(env_manager.get_env("GATEWAY_SERVER_THREADS"))
+GATEWAY_AIO = env_manager.get_env("GATEWAY_AIO")
+
+"""
+Gateway admission control.
+
+Each method class (see method_classes) has its own concurrency limit, and each client (the peer IP, or the
+client_id request metadata if the client is known to the node) has a token bucket. The buckets of the least
+recently seen clients are forgotten after MAX_BUCKETS. Requests over the rate limit, or over the limit of
+its class, are rejected with RESOURCE_EXHAUSTED, so the node stays responsive under overload.
+
+On the aio server the class executors keep a bounded queue (GATEWAY_ADMISSION_QUEUE) of admitted requests.
+On the sync server every request takes a thread of the server pool, also while waiting, so there is no queue
+and the class limits are shares of the pool: the long-lived streams can never take the threads of the
+cheap requests.
+"""
+
+MAX_BUCKETS = 10_000
+
+
+def _sync_class_limits(threads: int) -> Dict[str, int]:
+    # Shares of the sync server threads, adding up to the pool (for pools of at least 4 threads).
+    streaming = max(1, min(GATEWAY_STREAMING_WORKERS, threads // 3))
+    heavy = max(1, min(GATEWAY_HEAVY_WORKERS, threads // 6))
+    metering = max(1, min(GATEWAY_METERING_WORKERS, threads // 4))
+    control = max(1, min(GATEWAY_CONTROL_WORKERS, threads - streaming - heavy - metering))
+    return {CONTROL: control, METERING: metering, HEAVY: heavy, STREAMING: streaming}
+
+
+CLASS_LIMITS: Dict[str, int] = {
+    CONTROL: GATEWAY_CONTROL_WORKERS,
+    METERING: GATEWAY_METERING_WORKERS,
+    HEAVY: GATEWAY_HEAVY_WORKERS,
+    STREAMING: GATEWAY_STREAMING_WORKERS,
+} if GATEWAY_AIO else _sync_class_limits(threads=MAX_SERVER_THREADS)
+
+ADMISSION_QUEUE = GATEWAY_ADMISSION_QUEUE if GATEWAY_AIO else 0
+
+sc = SQLConnection()
+
+
+class _TokenBucket:
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = monotonic()
+
+    def refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self) -> bool:
+        self.refill(monotonic())
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class Admission(metaclass=Singleton):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running: Dict[str, int] = {c: 0 for c in CLASS_LIMITS}  # Including the queued ones.
+        self.shed: Dict[str, int] = {c: 0 for c in CLASS_LIMITS}
+        self.buckets: OrderedDict[str, _TokenBucket] = OrderedDict()  # From the least recently seen.
+
+    def __allow_client(self, client: str) -> bool:
+        bucket = self.buckets.get(client)
+        if bucket:
+            self.buckets.move_to_end(client)
+        else:
+            if len(self.buckets) >= MAX_BUCKETS:
+                self.buckets.popitem(last=False)
+            bucket = self.buckets[client] = _TokenBucket(rate=GATEWAY_CLIENT_RATE, burst=GATEWAY_CLIENT_BURST)
+        return bucket.take()
+
+    def enter(self, _class: str, client: str) -> Tuple[bool, Optional[str]]:
+        """
+        Admits a request if the client is under its rate and the class under its limit plus the queue.
+        Never waits, so a rejected request doesn't hold a thread of the server.
+
+        Returns if the request is admitted and, if not, the reason.
+        """
+        with self.lock:
+            if not self.__allow_client(client):
+                self.shed[_class] += 1
+                return False, f"Rate limit exceeded for {client}."
+
+            if self.running[_class] >= CLASS_LIMITS[_class] + ADMISSION_QUEUE:
+                self.shed[_class] += 1
+                return False, f"Too many {_class} requests."
+            self.running[_class] += 1
+            return True, None
+
+    def leave(self, _class: str):
+        with self.lock:
+            self.running[_class] -= 1
+
+    def get_stats(self) -> Dict[str, Dict[str, int]]:
+        with self.lock:
+            return {
+                c: {'running': self.running[c], 'shed': self.shed[c]}
+                for c in CLASS_LIMITS
+            }
+
+
+def _client_key(context) -> str:
+    # The client_id metadata is sent by the client, only the ones known to the node are trusted,
+    # otherwise sending a different id on each request would bypass the rate limit.
+    for key, value in context.invocation_metadata() or ():
+        if key == 'client_id' and value and sc.client_exists(client_id=value):
+            return value
+    try:
+        return get_only_the_ip_from_context(context_peer=context.peer()) or context.peer()
+    except Exception:
+        return context.peer()
+
+
+def _rejected(method: str, reason: str) -> str:
+    log.LOGGER(f"Request to {method} rejected: {reason}")
+    return reason
+
+
+class AdmissionInterceptor(grpc.ServerInterceptor):
+
+    def intercept_service(self, continuation, handler_call_details):
+        handler = continuation(handler_call_details)
+        if handler is None or not handler.stream_stream:
+            return handler
+
+        method = handler_call_details.method
+        _class = method_class(method)
+        behavior = handler.stream_stream
+
+        def admitted(request_iterator, context):
+            ok, reason = Admission().enter(_class=_class, client=_client_key(context))
+            if not ok:
+                context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, _rejected(method, reason))
+            try:
+                yield from behavior(request_iterator, context)
+            finally:
+                Admission().leave(_class=_class)
+
+        return grpc.stream_stream_rpc_method_handler(
+            admitted,
+            request_deserializer=handler.request_deserializer,
+            response_serializer=handler.response_serializer
+        )
+
+
+class AsyncAdmissionInterceptor(grpc.aio.ServerInterceptor):
+
+    async def intercept_service(self, continuation, handler_call_details):
+        handler = await continuation(handler_call_details)
+        if handler is None or not handler.stream_stream:
+            return handler
+
+        method = handler_call_details.method
+        _class = method_class(method)
+        behavior = handler.stream_stream
+
+        async def admitted(request_iterator, context):
+            # The class executors of the aio gateway keep the queue, so this never blocks the event loop.
+            client = await asyncio.get_running_loop().run_in_executor(None, _client_key, context)  # Database lookup.
+            ok, reason = Admission().enter(_class=_class, client=client)
+            if not ok:
+                await context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, _rejected(method, reason))
+            try:
+                async for response in behavior(request_iterator, context):
+                    yield response
+            finally:
+                Admission().leave(_class=_class)
+
+        return grpc.stream_stream_rpc_method_handler(
+            admitted,
+            request_deserializer=handler.request_deserializer,
+            response_serializer=handler.response_serializer
+        )
@@ -0,0 +1,128 @@
+import asyncio
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncGenerator, Callable, Dict
+
+import grpc
+
+from src.gateway.gateway import Gateway
+from src.gateway.method_classes import METHOD_CLASS, CONTROL, METERING, HEAVY, STREAMING
+from src.utils import logger as log
+from src.utils.env import EnvManager
+
+env_manager = EnvManager()
+
+GATEWAY_CONTROL_WORKERS = int(env_manager.get_env("GATEWAY_CONTROL_WORKERS"))
+GATEWAY_METERING_WORKERS = int(env_manager.get_env("GATEWAY_METERING_WORKERS"))
+GATEWAY_HEAVY_WORKERS = int(env_manager.get_env("GATEWAY_HEAVY_WORKERS"))
+GATEWAY_STREAMING_WORKERS = int(env_manager.get_env("GATEWAY_STREAMING_WORKERS"))
+GATEWAY_AIO_STREAM_BUFFER = int(env_manager.get_env("GATEWAY_AIO_STREAM_BUFFER"))
+
+"""
+Gateway for the grpc.aio server.
+
+The gRPC transport runs on the event loop, while the Gateway handlers (blocking work: Docker, SQLite,
+builds, bee_rpc parsing) run on an executor sized for its method class, so slow streams never take the
+threads of the cheap requests. Both directions are bridged with bounded buffers, keeping the gRPC
+flow control.
+
+The handlers stay synchronous (bee_rpc only parses synchronous iterators), so each stream still holds a thread
+of its executor while open, and a ServiceTunnel two more for its relay. The concurrent streams are bounded by
+GATEWAY_STREAMING_WORKERS: the streams above it are rejected with RESOURCE_EXHAUSTED instead of waiting
+for a thread.
+"""
+
+_END = object()
+
+
+class AsyncGateway:
+
+    def __init__(self, gateway: Gateway = None):
+        self.gateway = gateway if gateway else Gateway()
+        self.executors: Dict[str, ThreadPoolExecutor] = {
+            CONTROL: ThreadPoolExecutor(max_workers=GATEWAY_CONTROL_WORKERS, thread_name_prefix=CONTROL),
+            METERING: ThreadPoolExecutor(max_workers=GATEWAY_METERING_WORKERS, thread_name_prefix=METERING),
+            HEAVY: ThreadPoolExecutor(max_workers=GATEWAY_HEAVY_WORKERS, thread_name_prefix=HEAVY),
+            STREAMING: ThreadPoolExecutor(max_workers=GATEWAY_STREAMING_WORKERS, thread_name_prefix=STREAMING),
+        }
+        self.streams = 0  # Streaming handlers running, only modified on the event loop.
+
+    def __stream_done(self):
+        self.streams -= 1
+
+    async def bridge(self, method: str, request_iterator, context) -> AsyncGenerator:
+        loop = asyncio.get_running_loop()
+        handler: Callable = getattr(self.gateway, method)
+        streaming = METHOD_CLASS[method] == STREAMING
+        if streaming:
+            if self.streams >= GATEWAY_STREAMING_WORKERS:
+                log.LOGGER(f"Rejected {method}, {self.streams} streams open.")
+                await context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, "Too many streams open on the node.")
+            self.streams += 1
+
+        requests: queue.Queue = queue.Queue()
+        request_slots = asyncio.Semaphore(GATEWAY_AIO_STREAM_BUFFER)
+        responses: asyncio.Queue = asyncio.Queue(maxsize=GATEWAY_AIO_STREAM_BUFFER)
+        closed = threading.Event()  # The client went away.
+
+        async def feed():
+            try:
+                async for request in request_iterator:
+                    await request_slots.acquire()
+                    requests.put(request)
+            finally:
+                requests.put(_END)
+
+        def sync_requests():
+            while True:
+                request = requests.get()
+                if request is _END:
+                    return
+                loop.call_soon_threadsafe(request_slots.release)
+                yield request
+
+        def run():
+            try:
+                for response in handler(sync_requests(), context):
+                    if closed.is_set():
+                        return
+                    asyncio.run_coroutine_threadsafe(responses.put(response), loop).result()
+                result = _END
+            except BaseException as e:
+                result = e
+            finally:
+                if streaming:
+                    loop.call_soon_threadsafe(self.__stream_done)
+            if not closed.is_set():
+                asyncio.run_coroutine_threadsafe(responses.put(result), loop).result()
+
+        feeder = asyncio.ensure_future(feed())
+        loop.run_in_executor(self.executors[METHOD_CLASS[method]], run)
+        try:
+            while True:
+                response = await responses.get()
+                if response is _END:
+                    break
+                if isinstance(response, BaseException):
+                    log.LOGGER(f"Exception on {method}: {str(response)}")
+                    raise response
+                yield response
+        finally:
+            closed.set()
+            feeder.cancel()
+            # Unblock the handler if it's waiting on the full buffer.
+            while not responses.empty():
+                responses.get_nowait()
+
+
+def __async_method(method: str):
+    async def handler(self, request_iterator, context):
+        async for response in self.bridge(method, request_iterator, context):
+            yield response
+    handler.__name__ = method
+    return handler
+
+
+for _method in METHOD_CLASS:
+    setattr(AsyncGateway, _method, __async_method(_method))
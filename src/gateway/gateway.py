@@ -83,7 +83,7 @@ class Gateway(gateway_pb2_grpc.Gateway):
         yield from bee.serialize_to_buffer(gateway_instance)
 
     def IntroducePeer(self, request_iterator, context, **kwargs):
-        # TODO DDOS protection.   ¿?
+        # Rate limited by the admission interceptor.
         log.LOGGER('Introduce peer method.')
         add_peer_instance(
                 instance=next(bee.parse_from_buffer(
@@ -96,7 +96,7 @@ class Gateway(gateway_pb2_grpc.Gateway):
         yield from bee.serialize_to_buffer(gateway_pb2.RecursionGuard(token="OK"))  # Recursion guard shouldn't be used here, another message should be used. TODO
 
     def GenerateClient(self, request_iterator, context, **kwargs):
-        # TODO DDOS protection.   ¿?
+        # Rate limited by the admission interceptor.
         yield from bee.serialize_to_buffer(
                 message_iterator=generate_client()
         )
@@ -196,8 +196,8 @@ class Gateway(gateway_pb2_grpc.Gateway):
                 message_iterator=service_tunnel(
                     iterator=bee.parse_from_buffer(
                         request_iterator=request_iterator,
-                        indices={0: bytes},
-                        partitions_message_mode={0: False}
+                        indices={0: bytes, 1: gateway_pb2.TokenMessage},
+                        partitions_message_mode={0: False, 1: True}
                     )
                 ),
                 indices=gateway_pb2.Metrics,
@@ -8,8 +8,11 @@ from protos import gateway_pb2
 from protos.gateway_pb2_bee import StartService_input_indices, \
     StartService_input_message_mode
 from src.gateway.utils import save_service
+from src.manager.registry_store import ReceiveHasher
 from src.utils import logger as log
 from src.utils.env import SHA3_256_ID
+from src.utils.tools.duplicate_grabber import DuplicateGrabber, hash_keys
+from src.utils.tools.registry_cache import RegistryCache
 from src.manager.maintain_thread import wanted_services
 from src.utils.env import EnvManager
 
@@ -18,6 +21,8 @@ env_manager = EnvManager()
 REGISTRY = env_manager.get_env("REGISTRY")
 METADATA_REGISTRY = env_manager.get_env("METADATA_REGISTRY")
 
+SERVICE_INDEX = next(index for index, _type in StartService_input_indices.items() if _type == celaut.Service)
+
 
 class BreakIteration(Exception):
     pass
@@ -34,9 +39,10 @@ def find_service_hash(_hash: gateway_pb2.celaut__pb2.Metadata.HashTag.Hash) \
 
 
 def combine_metadata(service_hash: str, request_metadata: Optional[celaut.Metadata]) -> celaut.Metadata:
-    disk_metadata = celaut.Metadata()
-    with open(METADATA_REGISTRY + service_hash, 'rb') as f:
-        disk_metadata.ParseFromString(f.read())
+    # The disk metadata is shared by the registry cache, it's merged into a new message if it needs changes.
+    disk_metadata = RegistryCache().get_metadata(service_hash=service_hash)
+    if disk_metadata is None:
+        raise FileNotFoundError(METADATA_REGISTRY + service_hash)
 
     if request_metadata:
         combined_metadata = celaut.Metadata()
@@ -78,8 +84,10 @@ class AbstractServiceIterable:
     metadata: Optional[gateway_pb2.celaut__pb2.Metadata] = None
 
     def __init__(self, request_iterator, context):
+        # The service is hashed as it arrives, so it's not read again to verify it.
+        self.receive_hasher = ReceiveHasher(request_iterator=request_iterator, service_index=SERVICE_INDEX)
         self.parser_iterator = bee.parse_from_buffer(
-            request_iterator=request_iterator,
+            request_iterator=iter(self.receive_hasher),
             indices=StartService_input_indices,
             partitions_message_mode=StartService_input_message_mode
         )
@@ -121,22 +129,28 @@ class AbstractServiceIterable:
                 if r.type != gateway_pb2.celaut__pb2.Service:
                     raise Exception('Incorrect service message.')
 
-                #  -- TODO --
-                #  NO TIENE SENTIDO USAR AQUI EL DUPLICATE GRABBER YA QUE AHORA NO RETORNAMOS PRIMERO EL TIPO, SI NO QUE
-                #  RETORNAMOS EL TIPO JUNTO CON EL DIRECTORIO DEL SERVICIO YA DESCARGADO. EL DUPLICATE GRABBER DEBERIA
-                #  USARSE ANTES.
-
                 log.LOGGER('Save service on disk')
-                # Take it from metadata.
-                if not self.service_hash:
-                    # TODO  compute the hash of r.dir.
-                    raise Exception("Not registry hash.")
-
-                self.service_saved = save_service(
+                # The service is already received, but concurrent requests with the same service only verify
+                #  and store one copy. The others wait for it, and then store their own copy only if it was rejected.
+                # Without hash on the metadata, the one computed while storing it is used.
+                received = self.receive_hasher.received()
+                save = lambda: save_service(
                     metadata=self.metadata,
                     service_dir=r.dir,
-                    service_hash=self.service_hash
+                    service_hash=self.service_hash,
+                    received=received
+                )
+                service_hash, owner = DuplicateGrabber().run(
+                    keys=[self.service_hash] if self.service_hash
+                        else hash_keys(self.metadata.hashtag.hash) if self.metadata else [],
+                    function=save,
+                    scope='save'
                 )
+                if not owner:
+                    service_hash = save()
+                if not service_hash:
+                    raise Exception("The service doesn't match its hashes.")
+                self.service_hash, self.service_saved = service_hash, True
 
         if self.service_saved:
             yield buffer_pb2.Buffer(signal=True)
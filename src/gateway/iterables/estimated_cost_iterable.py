@@ -8,6 +8,7 @@ from src.gateway.iterables.abstract_service_iterable import AbstractServiceItera
 from src.manager.manager import default_initial_cost
 from src.utils.cost_functions.generate_estimated_cost import generate_estimated_cost
 from src.utils.logger import LOGGER as log
+from src.utils.tools.duplicate_grabber import DuplicateGrabber
 from src.utils.utils import from_gas_amount, get_only_the_ip_from_context
 
 
@@ -29,12 +30,19 @@ class GetServiceEstimatedCostIterable(AbstractServiceIterable):
                         else get_only_the_ip_from_context(context_peer=self.context.peer())
                     )
 
-            yield from bee.serialize_to_buffer(
-                message_iterator=generate_estimated_cost(
+            # The same service, with the same configuration and gas, is only estimated once at a time.
+            estimated_cost, _ = DuplicateGrabber().run(
+                keys=[f"{self.service_hash}:{initial_gas_amount}:"
+                      f"{self.configuration.SerializeToString(deterministic=True).hex()}"],
+                function=lambda: generate_estimated_cost(
                     metadata=self.metadata,
                     initial_gas_amount=initial_gas_amount,
                     config=self.configuration
                 ),
+                scope='cost'
+            )
+            yield from bee.serialize_to_buffer(
+                message_iterator=estimated_cost,
                 indices=gateway_pb2.EstimatedCost
             )
         except build.UnsupportedArchitectureException as e:
@@ -1,24 +1,58 @@
+import os
 from typing import Generator
 
 from bee_rpc import client as bee, buffer_pb2
 
 from protos.gateway_pb2_bee import StartService_input_indices
 from src.virtualizers.docker import build
-from src.gateway.iterables.abstract_service_iterable import AbstractServiceIterable
+from src.gateway.iterables.abstract_service_iterable import AbstractServiceIterable, SERVICE_INDEX
 from src.utils.logger import LOGGER as log
+from src.utils.tools.mapped_files import MappedFiles
 from src.utils.utils import service_extended, read_metadata_from_disk
+from src.utils.env import EnvManager
+
+env_manager = EnvManager()
+
+REGISTRY = env_manager.get_env("REGISTRY")
+GET_SERVICE_MMAP = env_manager.get_env("GET_SERVICE_MMAP")
+# Leaves room for the buffer message fields around the chunk.
+MMAP_CHUNK_SIZE = int(env_manager.get_env("GRPC_MAX_MESSAGE_LENGTH")) - 1024
 
 
 class GetServiceIterable(AbstractServiceIterable):
     def start(self):
         log('Request for a service.')
 
+    def __mapped_service(self, filename: str) -> Generator[buffer_pb2.Buffer, None, None]:
+        # The service is sent from the shared map, slice by slice, instead of reading the file on each request.
+        yield buffer_pb2.Buffer(head=buffer_pb2.Buffer.Head(index=SERVICE_INDEX))
+        for chunk in MappedFiles().chunks(path=filename, chunk_size=MMAP_CHUNK_SIZE):
+            yield buffer_pb2.Buffer(chunk=chunk.tobytes())
+        yield buffer_pb2.Buffer(separator=True)
+
     def generate(self) -> Generator[buffer_pb2.Buffer, None, None]:
         try:
             yield buffer_pb2.Buffer(signal=True)  # TODO; must be deleted with https://github.com/pee-rpc-protocol/pee-rpc/issues/4 solved.
+            metadata = read_metadata_from_disk(service_hash=self.service_hash) if not self.metadata else self.metadata
+            filename = REGISTRY + self.service_hash
+
+            # Services stored with blocks are left to bee-rpc, that sends the blocks the peer doesn't have.
+            if GET_SERVICE_MMAP and os.path.isfile(filename):
+                yield from bee.serialize_to_buffer(
+                    message_iterator=(
+                        message for message in service_extended(
+                            metadata=metadata,
+                            recursion_guard_token=self.recursion_guard_token
+                        ) if type(message) is not bee.Dir
+                    ),
+                    indices=StartService_input_indices
+                )
+                yield from self.__mapped_service(filename=filename)
+                return
+
             yield from bee.serialize_to_buffer(
                 message_iterator=service_extended(
-                    metadata=read_metadata_from_disk(service_hash=self.service_hash) if not self.metadata else self.metadata,
+                    metadata=metadata,
                     recursion_guard_token=self.recursion_guard_token
                 ),
                 indices=StartService_input_indices  # Client and configuration not needed.
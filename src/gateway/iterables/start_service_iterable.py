@@ -7,7 +7,8 @@ from src.gateway.iterables.abstract_service_iterable import AbstractServiceItera
 from src.gateway.launcher.launch_service import launch_service
 from src.utils import logger as log
 from src.utils.env import EnvManager
-from src.utils.utils import get_only_the_ip_from_context, read_metadata_from_disk, read_service_from_disk
+from src.utils.utils import get_only_the_ip_from_context, read_metadata_from_disk, \
+    read_service_header_from_disk
 from src.utils.env import EnvManager
 
 env_manager = EnvManager()
@@ -30,7 +31,8 @@ class StartServiceIterable(AbstractServiceIterable):
         yield from bee.serialize_to_buffer(
             indices={},
             message_iterator=launch_service(
-                service=read_service_from_disk(service_hash=self.service_hash),
+                # The filesystem is only loaded by the builder if the container is not built yet.
+                service=read_service_header_from_disk(service_hash=self.service_hash),
                 metadata=self.metadata if self.metadata else read_metadata_from_disk(service_hash=self.service_hash),
                 config=self.configuration,
                 service_id=self.service_hash,
@@ -1,7 +1,6 @@
 from hashlib import sha256
 from typing import Callable, List
 
-import grpc
 from bee_rpc import client as bee
 
 from src.utils.env import EnvManager
@@ -10,6 +9,7 @@ from protos import gateway_pb2, gateway_pb2_grpc
 from protos.gateway_pb2_bee import StartService_input_indices
 from src.manager.manager import get_client_id_on_other_peer
 from src.manager.metrics import gas_amount_on_other_peer
+from src.manager.peer_performance import peer_channel
 from src.database.sql_connection import SQLConnection
 from src.payment_system.payment_process import increase_deposit_on_peer
 from src.utils import utils, logger as log
@@ -36,9 +36,7 @@ def delegate_execution(
         log.LOGGER('Spent gas, go to launch the service on ' + str(peer))
         service_instance = next(bee.client_grpc(
             method=gateway_pb2_grpc.GatewayStub(
-                grpc.insecure_channel(
-                    next(utils.generate_uris_by_peer_id(peer))
-                )
+                peer_channel(peer_id=peer)
             ).StartService,
             timeout=START_SERVICE_ON_PEER_TIMEOUT if START_SERVICE_ON_PEER_TIMEOUT > 0 else None,
             partitions_message_mode_parser=True,
@@ -0,0 +1,33 @@
+from typing import Dict
+
+"""
+Gateway methods grouped by their cost, to size the resources each group can take.
+"""
+
+CONTROL = "control"  # Cheap requests that modify the node state.
+METERING = "metering"  # Metrics and cost estimation.
+HEAVY = "heavy"  # Builds, packing and service launches.
+STREAMING = "streaming"  # Long-lived streams.
+
+METHOD_CLASS: Dict[str, str] = {
+    "StopService": CONTROL,
+    "ModifyGasDeposit": CONTROL,
+    "GetInstance": CONTROL,
+    "IntroducePeer": CONTROL,
+    "GenerateClient": CONTROL,
+    "GenerateDepositToken": CONTROL,
+    "Payable": CONTROL,
+    "SignPublicKey": CONTROL,
+    "ModifyServiceSystemResources": CONTROL,
+    "GetMetrics": METERING,
+    "GetServiceEstimatedCost": METERING,
+    "StartService": HEAVY,
+    "Pack": HEAVY,
+    "GetService": STREAMING,
+    "ServiceTunnel": STREAMING,
+}
+
+
+def method_class(method: str) -> str:
+    # Accepts the method name or the full gRPC method path (/gateway.Gateway/StartService).
+    return METHOD_CLASS.get(method.rsplit("/", 1)[-1], CONTROL)
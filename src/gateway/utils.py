@@ -1,13 +1,15 @@
 import os
-import shutil
 from typing import Generator, Optional
 
 import netifaces as ni
 
 import src.utils.utils
+from src.manager.registry_store import store_service
+from src.utils.verify import StreamHasher
 from src.payment_system.ledgers import generate_contract_ledger
 from protos import celaut_pb2 as celaut, gateway_pb2
 from src.utils import logger as log
+from src.utils.tools.registry_cache import RegistryCache
 from src.utils.env import EnvManager
 
 env_manager = EnvManager()
@@ -61,27 +63,35 @@ def generate_gateway_instance(network: str) -> gateway_pb2.Instance:
 
 
 # If the service is not on the registry, save it.
+# The service is verified against its hash and the metadata hashes, and it's hash is returned (None if rejected).
 def save_service(
         metadata: Optional[celaut.Metadata],
         service_dir: str,
-        service_hash: str
-) -> bool:
-    def __save():
+        service_hash: Optional[str],
+        received: Optional[StreamHasher] = None
+) -> Optional[str]:
+    if service_hash and os.path.exists(REGISTRY + service_hash):
+        return store_service(service_dir=service_dir, service_hash=service_hash)  # Only discards the received copy.
+
+    try:
+        service_hash = store_service(
+            service_dir=service_dir,
+            service_hash=service_hash,
+            expected_hashes=metadata.hashtag.hash if metadata else (),
+            received=received
+        )
+    except Exception as e:
+        log.LOGGER(f'Exception saving a service {service_hash}: ' + str(e))
+        return None
+
+    if service_hash and metadata:
         try:
-            shutil.move(service_dir, REGISTRY + service_hash)
-            return True
+            with open(METADATA_REGISTRY + service_hash, "wb") as f:
+                f.write(metadata.SerializeToString())
         except Exception as e:
-            log.LOGGER(f'Exception saving a service {service_hash}: ' + str(e))
-            return False
-        finally:
-            if metadata:
-                try:
-                    with open(METADATA_REGISTRY + service_hash, "wb") as f:
-                        f.write(metadata.SerializeToString())
-                except Exception as e:
-                    log.LOGGER(f'Exception writing metadata of {service_hash}: ' + str(e))
-
-    return os.path.isdir(REGISTRY + service_hash) or __save()
+            log.LOGGER(f'Exception writing metadata of {service_hash}: ' + str(e))
+        RegistryCache().invalidate(service_hash=service_hash)
+    return service_hash
 
 
 def search_container(
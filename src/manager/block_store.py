@@ -0,0 +1,158 @@
+import json
+import os
+import time
+from typing import Dict, Iterator, List, Optional
+
+from src.database.sql_connection import SQLConnection
+from src.utils.logger import LOGGER as log
+from src.utils.env import EnvManager
+
+env_manager = EnvManager()
+
+REGISTRY = env_manager.get_env("REGISTRY")
+BLOCKDIR = env_manager.get_env("BLOCKDIR")
+BLOCK_GC_GRACE_PERIOD = int(env_manager.get_env("BLOCK_GC_GRACE_PERIOD"))
+BLOCK_GC_BATCH_SIZE = int(env_manager.get_env("BLOCK_GC_BATCH_SIZE"))
+
+"""
+Reference counted block store.
+
+Each service stored on the registry as a directory references its blocks on the _.json file. The block
+references are kept on the database, updated when a service is registered or removed, so unused blocks
+can be collected incrementally by the manager thread without loading every service definition.
+
+Blocks that are not referenced (or not registered, as the ones being downloaded right now) are only
+removed once the grace period is over, both since they were unreferenced and since they were written.
+The references of the services stored before the block store existed are built from the registry before
+the first collection, until then no unregistered block is removed.
+"""
+
+sc = SQLConnection()
+
+__gc_iterator: Optional[Iterator[os.DirEntry]] = None
+
+
+def __read_service_blocks(service_hash: str) -> Dict[str, int]:
+    # Only services stored with blocks are directories with the _.json file.
+    json_file = os.path.join(REGISTRY, service_hash, "_.json")
+    if not os.path.isfile(json_file):
+        return {}
+
+    with open(json_file, "r") as f:
+        blocks = {partition[0] for partition in json.load(f) if type(partition) is list}
+
+    return {
+        block: os.path.getsize(os.path.join(BLOCKDIR, block)) if os.path.exists(os.path.join(BLOCKDIR, block)) else 0
+        for block in blocks
+    }
+
+
+def register_service_blocks(service_hash: str) -> int:
+    """
+    Adds a reference from the service to each block it uses.
+
+    Returns the number of new references.
+    """
+    try:
+        added = sc.add_service_blocks(service_hash=service_hash, blocks=__read_service_blocks(service_hash))
+        if added:
+            log(f"Block store: {added} block references added for the service {service_hash}.")
+        return added
+    except Exception as e:
+        log(f"Block store: error registering the blocks of {service_hash}: {e}")
+        return 0
+
+
+def unregister_service_blocks(service_hash: str) -> List[str]:
+    """
+    Removes the references from the service to its blocks.
+
+    Returns the blocks that are no longer used by any service, they will be collected after the grace period.
+    """
+    try:
+        unreferenced = sc.remove_service_blocks(service_hash=service_hash)
+        if unreferenced:
+            log(f"Block store: {len(unreferenced)} blocks unreferenced after removing {service_hash}.")
+        return unreferenced
+    except Exception as e:
+        log(f"Block store: error unregistering the blocks of {service_hash}: {e}")
+        return []
+
+
+def rebuild_block_references():
+    """
+    Rebuilds all the block references from the services on the registry.
+    """
+    sc.clear_block_references()
+    for service_hash in os.listdir(REGISTRY):
+        register_service_blocks(service_hash=service_hash)
+    sc.set_block_references_rebuilt()
+
+
+def __collectable(entry: os.DirEntry, grace_period: int) -> bool:
+    # Recently written blocks could belong to an in-flight download.
+    if time.time() - entry.stat().st_mtime < grace_period:
+        return False
+
+    block = sc.get_block(block_hash=entry.name)
+    if not block:
+        # Nobody registered it once the grace period is over. Without a rebuild, it could belong to a service
+        # stored before the block references existed.
+        return sc.block_references_rebuilt()
+
+    return block['refs'] <= 0 and (block['unreferenced_seconds'] or 0) >= grace_period
+
+
+def collect_unused_blocks(
+        batch_size: Optional[int] = BLOCK_GC_BATCH_SIZE,
+        grace_period: int = BLOCK_GC_GRACE_PERIOD
+) -> int:
+    """
+    Incremental garbage collection of the block directory.
+
+    Each call checks up to batch_size entries, continuing where the previous call stopped.
+    With batch_size None the whole directory is checked at once.
+
+    Returns the number of deleted blocks.
+    """
+    global __gc_iterator
+    deleted, checked = 0, 0
+
+    if not sc.block_references_rebuilt():
+        log("Block store: building the block references of the registry before the first collection.")
+        rebuild_block_references()
+
+    if batch_size is None and __gc_iterator is not None:
+        __gc_iterator.close()
+        __gc_iterator = None
+
+    while batch_size is None or checked < batch_size:
+        if __gc_iterator is None:
+            __gc_iterator = os.scandir(BLOCKDIR)
+
+        entry = next(__gc_iterator, None)
+        if entry is None:
+            __gc_iterator = None  # Start again on the next call.
+            break
+
+        checked += 1
+        try:
+            if entry.is_file() and __collectable(entry=entry, grace_period=grace_period):
+                os.remove(entry.path)
+                sc.delete_block(block_hash=entry.name)
+                deleted += 1
+        except FileNotFoundError:
+            sc.delete_block(block_hash=entry.name)
+        except Exception as e:
+            log(f"Block store: error collecting the block {entry.name}: {e}")
+
+    if deleted:
+        log(f"Block store: {deleted} unused blocks deleted.")
+    return deleted
+
+
+def get_block_usage() -> List[dict]:
+    """
+    Usage statistics for each block: references, size and the services using it.
+    """
+    return sc.get_blocks_usage()
@@ -1,21 +1,30 @@
-from typing import Optional, List, Dict
-import os, json, requests
+from typing import Optional, List, Dict, Tuple
+import os, json, requests, threading
+from time import sleep, time
 
 from src.utils.env import EnvManager
+from src.utils.http_client import HttpClient, HTTP_CLIENT_RETRIES
 from src.utils.logger import LOGGER as log
-from concurrent.futures import ThreadPoolExecutor
+from src.utils.singleton import Singleton
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 
 from src.utils.network import internet_available
 
 env_manager = EnvManager()
 
+ERGO_PROBE_INTERVAL = int(env_manager.get_env("ERGO_PROBE_INTERVAL"))
+ERGO_PROBE_PARALLELISM = int(env_manager.get_env("ERGO_PROBE_PARALLELISM"))
+ERGO_PROBE_TIMEOUT = float(env_manager.get_env("ERGO_PROBE_TIMEOUT"))
+ERGO_PROBE_MAX_NODES = int(env_manager.get_env("ERGO_PROBE_MAX_NODES"))
 
-def __available_ergo_node(url: Optional[str]) -> Optional[Dict]:
+
+def __available_ergo_node(url: Optional[str], retries: int = HTTP_CLIENT_RETRIES) -> Optional[Dict]:
     ergo_node_url = env_manager.get_env("ERGO_NODE_URL") if not url else url
     try:
-        info_url = f"{ergo_node_url}/info"
-        response = requests.get(info_url)
-        response.raise_for_status() 
+        response = HttpClient().get(
+            path="/info", base_urls=[ergo_node_url], timeout=ERGO_PROBE_TIMEOUT, retries=retries
+        )
+        response.raise_for_status()
 
         data = response.json()
 
@@ -29,85 +38,176 @@ def __available_ergo_node(url: Optional[str]) -> Optional[Dict]:
         else:
             log(f"Ergo node {ergo_node_url} is not on the mainnet or has an incorrect genesis block ID.")
             return None
-    except requests.exceptions.RequestException as e:
+    except (requests.exceptions.RequestException, ValueError) as e:
         log(f"Error connecting to Ergo node: {e}")
         return None
 
-def get_refresh_peers() -> Dict[str, Dict]:
-    http_peers_file = env_manager.get_env("ERGO_HTTP_PEERS")
-    if not os.path.exists(http_peers_file):
-        with open(http_peers_file, 'w') as f:
-            f.write("{}")
-    
-    with open(http_peers_file, 'r') as f:
-        peers = json.load(f)
-        
-    current_node = env_manager.get_env("ERGO_NODE_URL")
-    if current_node not in peers:
-        peers[current_node] = {}
-    
-    available_peers = {}
-    checked_peers = set(peers.keys())
-    
-    def fetch_peers(url: str):
+
+def _probe_node(url: str) -> Tuple[Optional[Dict], List[str]]:
+    """
+    Info of the node (None if it's not available), with its latency, and the rest api urls of its peers.
+    Probed with a single attempt, so the latency is the one of the node and not of the retries.
+    """
+    start = time()
+    info = __available_ergo_node(url, retries=0)
+    if not info:
+        return None, []
+    info["latency"] = time() - start
+
+    try:
+        response = HttpClient().get(path="/peers/connected", base_urls=[url], timeout=ERGO_PROBE_TIMEOUT, retries=0)
+        response.raise_for_status()
+        peers = [peer.get("restApiUrl") for peer in response.json()]
+    except (requests.RequestException, ValueError) as e:
+        log(f"Error fetching peers from {url}: {e}")
+        peers = []
+    return info, [peer for peer in peers if peer]
+
+
+class ErgoNodes(metaclass=Singleton):
+    """
+    Latency ranked list of the available Ergo nodes.
+
+    The nodes are probed concurrently (up to ERGO_PROBE_PARALLELISM at a time), crawling the peers of each
+    available node, every ERGO_PROBE_INTERVAL on its own thread. The list is persisted on ERGO_HTTP_PEERS
+    as each node answers.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.probe_lock = threading.Lock()
+        self.nodes: Dict[str, Dict] = {}  # url -> info, with its latency.
         try:
-            response = requests.get(f"{url}/peers/connected", timeout=5)
-            response.raise_for_status()
-            data = response.json()
-            
-            for peer in data:
-                rest_api_url = peer.get("restApiUrl")
-                if rest_api_url and rest_api_url not in checked_peers:
-                    checked_peers.add(rest_api_url)
-                    
-                    node_info = __available_ergo_node(rest_api_url)
-                    if node_info:
-                        available_peers[rest_api_url] = node_info
-                        log(f"Found available Ergo node: {rest_api_url}")
-                        fetch_peers(rest_api_url)
-        except requests.RequestException as e:
-            log(f"Error fetching peers from {url}: {e}")
-    
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        executor.map(fetch_peers, peers.keys())
-    
-    with open(http_peers_file, 'w') as f:
-        json.dump(available_peers, f)
-        
-    return available_peers
-    
+            with open(env_manager.get_env("ERGO_HTTP_PEERS"), 'r') as f:
+                self.nodes = json.load(f)
+        except (OSError, ValueError):
+            pass
+        threading.Thread(target=self.__prober, daemon=True).start()
+
+    def ranked(self) -> List[str]:
+        with self.lock:
+            return sorted(self.nodes, key=lambda url: self.nodes[url].get("latency", ERGO_PROBE_TIMEOUT))
+
+    def fastest(self) -> Optional[str]:
+        return next(iter(self.ranked()), None)
+
+    def available(self) -> Dict[str, Dict]:
+        with self.lock:
+            return {url: self.nodes[url] for url in self.nodes}
+
+    def __update(self, url: str, info: Optional[Dict]):
+        with self.lock:
+            if info:
+                self.nodes[url] = info
+            elif url in self.nodes:
+                del self.nodes[url]
+            else:
+                return
+            nodes = dict(sorted(self.nodes.items(), key=lambda node: node[1].get("latency", ERGO_PROBE_TIMEOUT)))
+
+            http_peers_file = env_manager.get_env("ERGO_HTTP_PEERS")
+            try:
+                with open(http_peers_file + ".tmp", 'w') as f:
+                    json.dump(nodes, f)
+                os.replace(http_peers_file + ".tmp", http_peers_file)
+            except OSError as e:
+                log(f"Error persisting the Ergo nodes: {e}")
+
+    def probe(self) -> Dict[str, Dict]:
+        """
+        Probes the known nodes and the peers found on them. Returns the available ones.
+        """
+        if not self.probe_lock.acquire(blocking=False):
+            with self.probe_lock:  # Already probing, wait for it.
+                return self.available()
+        try:
+            seeds = [env_manager.get_env("ERGO_NODE_URL")] + list(self.available())
+            checked = set(url for url in seeds if url)
+            with ThreadPoolExecutor(max_workers=ERGO_PROBE_PARALLELISM) as executor:
+                pending = {executor.submit(_probe_node, url): url for url in checked}
+                while pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        url = pending.pop(future)
+                        info, peers = future.result()
+                        self.__update(url=url, info=info)
+                        if info:
+                            log(f"Found available Ergo node: {url} ({round(info['latency'] * 1000)} ms)")
+                        for peer in peers:
+                            if peer not in checked and len(checked) < ERGO_PROBE_MAX_NODES:
+                                checked.add(peer)
+                                pending[executor.submit(_probe_node, peer)] = peer
+            return self.available()
+        finally:
+            self.probe_lock.release()
+
+    def __prober(self):
+        while True:
+            if internet_available():
+                try:
+                    self.probe()
+                except Exception as e:
+                    log(f"Error probing the Ergo nodes: {e}")
+            sleep(ERGO_PROBE_INTERVAL)
+
+
+def ergo_node_url() -> str:
+    """
+    The fastest available Ergo node, or ERGO_NODE_URL before any of them was probed.
+    """
+    return ErgoNodes().fastest() or env_manager.get_env("ERGO_NODE_URL")
+
+
+def ergo_nodes() -> List[str]:
+    """
+    The available Ergo nodes from the fastest, followed by ERGO_NODE_URL if it's not among them, for failover.
+    """
+    nodes = ErgoNodes().ranked()
+    current_node = env_manager.get_env("ERGO_NODE_URL")
+    return nodes + [current_node] if current_node and current_node not in nodes else nodes
+
+
+def ergo_node_get(path: str, params: Optional[Dict] = None, cache_ttl: float = 0) -> requests.Response:
+    """
+    GET on the Ergo node API, failing over to the next nodes.
+    """
+    return HttpClient().get(path=path, base_urls=ergo_nodes(), params=params, cache_ttl=cache_ttl)
+
+
+def get_refresh_peers() -> Dict[str, Dict]:
+    return ErgoNodes().probe()
+
 def check_ergo_node_availability():
     """
     Checks the availability of the current Ergo node. If the current node is not available,
-    it attempts to find a new available node from refreshed peers and updates the environment
-    variable "ERGO_NODE_URL" with the new node URL.
+    it updates the environment variable "ERGO_NODE_URL" with the fastest available node of the prober.
     - Retrieves the current Ergo node URL from the environment.
     - Checks if the current Ergo node is available.
-    - If not available, logs the unavailability and fetches a list of refreshed available peers.
-    - If no available peers are found and the current node URL has not been manually changed,
+    - If not available, logs the unavailability and takes the fastest node found by the last probes.
+    - If no available nodes are known and the current node URL has not been manually changed,
       logs the absence of available nodes and clears the "ERGO_NODE_URL" environment variable.
-    - If available peers are found, updates the "ERGO_NODE_URL" environment variable with the
-      first available peer and logs the update.
+    - If available nodes are known, updates the "ERGO_NODE_URL" environment variable with the
+      fastest one and logs the update.
     Note: Check for equality in case it has been manually changed.
     """
-    
+
     if not internet_available():
         return
-    
+
     log("Checking Ergo node availability...")
-    
+
     current_ergo_node = env_manager.get_env("ERGO_NODE_URL")
     if __available_ergo_node(current_ergo_node):
         return
-    
+
     log(f"Ergo node {current_ergo_node} is not available.")
-    availables = get_refresh_peers()  # New refreshed available peers.
-    
-    if not availables and current_ergo_node == env_manager.get_env("ERGO_NODE_URL"): 
-        log("No available Ergo nodes found.")
-        env_manager.write_env("ERGO_NODE_URL", "")
+    new_ergo_node_url = next((url for url in ErgoNodes().ranked() if url != current_ergo_node), None)
+
+    if not new_ergo_node_url:
+        if current_ergo_node == env_manager.get_env("ERGO_NODE_URL"):
+            log("No available Ergo nodes found.")
+            env_manager.write_env("ERGO_NODE_URL", "")
         return
-    
-    new_ergo_node_url = next(iter(availables))
+
     env_manager.write_env("ERGO_NODE_URL", new_ergo_node_url)
     log(f"ERGO_NODE_URL has been updated to {new_ergo_node_url}")
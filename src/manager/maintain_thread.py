@@ -1,23 +1,28 @@
+from concurrent.futures import ThreadPoolExecutor
 from time import sleep
+from typing import Optional
 from uuid import uuid4
 import os
 
-import grpc
 from bee_rpc import client as peerpc
 
 import docker as docker_lib
 
-from protos import celaut_pb2 as celaut, gateway_pb2_grpc, gateway_pb2
+from protos import gateway_pb2_grpc, gateway_pb2
 from protos.gateway_pb2_bee import StartService_input_indices, StartService_input_message_mode
+from src.manager.block_store import collect_unused_blocks
+from src.manager.registry_store import store_service
 from src.manager.ergo import check_ergo_node_availability
 from src.manager.manager import prune_container, spend_gas, update_peer_instance
 from src.manager.metrics import gas_amount_on_other_peer
+from src.manager.peer_performance import peer_channel
 from src.database.sql_connection import SQLConnection, is_peer_available
 from src.payment_system.payment_process import increase_deposit_on_peer, init_interfaces
-from src.reputation_system.interface import update_reputation, submit_reputation
+from src.reputation_system.interface import update_reputation, submit_reputation, SERVICE
 from src.utils import logger as log
-from src.utils.utils import generate_uris_by_peer_id, peers_id_iterator
-from src.utils.cost_functions.general_cost_functions import compute_maintenance_cost
+from src.utils.utils import peers_id_iterator
+from src.manager.usage_collector import UsageCollector, container_service_hash
+from src.utils.cost_functions.general_cost_functions import compute_service_maintenance_cost
 from src.utils.env import DOCKER_CLIENT, SHA3_256_ID, EnvManager
 from src.utils.tools.duplicate_grabber import DuplicateGrabber
 from src.utils.env import EnvManager
@@ -30,6 +35,7 @@ MIN_SLOTS_OPEN_PER_PEER = env_manager.get_env("MIN_SLOTS_OPEN_PER_PEER")
 MIN_DEPOSIT_PEER = env_manager.get_env("MIN_DEPOSIT_PEER")
 DEV_CLIENT_GAS_AMOUNT = env_manager.get_env("DEV_CLIENT_GAS_AMOUNT")
 TOTAL_REFILLED_DEPOSIT = env_manager.get_env("TOTAL_REFILLED_DEPOSIT")
+PEER_DEPOSIT_WORKERS = env_manager.get_env("PEER_DEPOSIT_WORKERS")
 MANAGER_ITERATION_TIME = env_manager.get_env("MANAGER_ITERATION_TIME")
 REGISTRY = env_manager.get_env("REGISTRY")
 METADATA_REGISTRY = env_manager.get_env("METADATA_REGISTRY")
@@ -48,7 +54,7 @@ wanted_services = {}  # str: bool
 
 
 def check_wanted_services():
-    for wanted in wanted_services.keys():  # TODO async
+    for wanted in list(wanted_services.keys()):  # TODO async
         if not wanted_services[wanted]:
             wanted_services[wanted] = True
             log.LOGGER(f"Taking the service {wanted}")
@@ -56,52 +62,61 @@ def check_wanted_services():
                     type=SHA3_256_ID,
                     value=bytes.fromhex(wanted)
                 )
-            for peer in peers_id_iterator():
-                """  TODO if get_service cost amount > 0
+            def fetch():
+                for peer in peers_id_iterator():
+                    """  TODO if get_service cost amount > 0
 
-                if gas_amount_on_other_peer(
+                    if gas_amount_on_other_peer(
+                            peer_id=peer,
+                    ) <= cost and not increase_deposit_on_peer(
                         peer_id=peer,
-                ) <= cost and not increase_deposit_on_peer(
-                    peer_id=peer,
-                    amount=cost
-                ):
-                    raise Exception(
-                        'Get service error increasing deposit on ' + peer + 'when it didn\'t have enough '
-                                                                               'gas.')
-                """
-                log.LOGGER(f"Using peer {peer}")
-                try:
-                    for b in peerpc.client_grpc(
-                            method=gateway_pb2_grpc.GatewayStub(
-                                grpc.insecure_channel(
-                                    next(generate_uris_by_peer_id(peer))
-                                )
-                            ).GetService,  # TODO An timeout should be implemented when requesting a service.
-                            indices_serializer=StartService_input_indices,
-                            indices_parser=StartService_input_indices,
-                            partitions_message_mode_parser=StartService_input_message_mode,
-                            input=_hash
+                        amount=cost
                     ):
-                        log.LOGGER(f"type of chunk -> {type(b)}")
-                        if  type(b) == peerpc.Dir:
-                            log.LOGGER(f"    type of dir {b.type}")
-                        if type(b) == gateway_pb2.celaut__pb2.Metadata:
-                            log.LOGGER("Store the metadata.")
-                            with open(f"{METADATA_REGISTRY}{wanted}", "wb") as f:
-                                f.write(b.SerializeToString())
-                        elif type(b) == peerpc.Dir and b.type == gateway_pb2.celaut__pb2.Service:
-                            log.LOGGER(f"Store the service {b.dir}")
-                            os.system(f"mv {b.dir} {REGISTRY}{wanted}")
-                    del wanted_services[wanted]
-                    log.LOGGER(f"Wanted service {wanted} stored successfully.")
-                except Exception as e:
-                    log.LOGGER(f"Exception on peer {peer} getting a service. {str(e)}. Continue")
-                    wanted_services[wanted] = False
+                        raise Exception(
+                            'Get service error increasing deposit on ' + peer + 'when it didn\'t have enough '
+                                                                                   'gas.')
+                    """
+                    log.LOGGER(f"Using peer {peer}")
+                    try:
+                        for b in peerpc.client_grpc(
+                                method=gateway_pb2_grpc.GatewayStub(
+                                    peer_channel(peer_id=peer)
+                                ).GetService,  # TODO An timeout should be implemented when requesting a service.
+                                indices_serializer=StartService_input_indices,
+                                indices_parser=StartService_input_indices,
+                                partitions_message_mode_parser=StartService_input_message_mode,
+                                input=_hash
+                        ):
+                            log.LOGGER(f"type of chunk -> {type(b)}")
+                            if  type(b) == peerpc.Dir:
+                                log.LOGGER(f"    type of dir {b.type}")
+                            if type(b) == gateway_pb2.celaut__pb2.Metadata:
+                                log.LOGGER("Store the metadata.")
+                                with open(f"{METADATA_REGISTRY}{wanted}", "wb") as f:
+                                    f.write(b.SerializeToString())
+                            elif type(b) == peerpc.Dir and b.type == gateway_pb2.celaut__pb2.Service:
+                                log.LOGGER(f"Store the service {b.dir}")
+                                if not store_service(service_dir=b.dir, service_hash=wanted):
+                                    raise Exception(f"the service received doesn't match the hash {wanted}")
+                        wanted_services.pop(wanted, None)
+                        log.LOGGER(f"Wanted service {wanted} stored successfully.")
+                        return
+                    except Exception as e:
+                        log.LOGGER(f"Exception on peer {peer} getting a service. {str(e)}. Continue")
+                        wanted_services[wanted] = False
+
+            # Only one fetch of each service at a time.
+            DuplicateGrabber().run(keys=[wanted], function=fetch, scope='fetch')
 
 
 def maintain_containers(debug_mode: bool=False):
-    def remove_and_penalize_container(id):
-        update_reputation(token=id, amount=-100)
+    # The reputation is of the service (the image of the container), not of the instance.
+    def update_service_reputation(service_hash: Optional[str], amount: int):
+        if service_hash:
+            update_reputation(token=service_hash, amount=amount, entity_type=SERVICE)
+
+    def remove_and_penalize_container(id, service_hash: Optional[str] = None):
+        update_service_reputation(service_hash=service_hash, amount=-100)
         log.LOGGER(f"Prunning container {id} from the registry because the docker container does not exist.")
         try:
             prune_container(token=id)
@@ -115,28 +130,31 @@ def maintain_containers(debug_mode: bool=False):
             if debug_mode: log.LOGGER(f"Container {id} status: {container.status}")
             if container.status == 'exited':
                 log.LOGGER(f"Container {id} has exited. Removing and penalizing.")
-                remove_and_penalize_container(id=id)
+                remove_and_penalize_container(id=id, service_hash=container_service_hash(container=container))
+                continue
         except (docker_lib.errors.NotFound, docker_lib.errors.APIError) as e:
             log.LOGGER(f"Error fetching container {id}: {str(e)}. Assuming it does not exist.")
             remove_and_penalize_container(id=id)
-            
-        gas_cost = compute_maintenance_cost(
-            system_resources=celaut.Sysresources(
-                mem_limit=sc.get_sys_req(id=id)['mem_limit']
-            )
+            continue
+
+        # Billed from the same observed usage its cost was estimated with.
+        service_hash = container_service_hash(container=container)
+        gas_cost = compute_service_maintenance_cost(
+            mem_limit=sc.get_sys_req(id=id)['mem_limit'],
+            usage=UsageCollector().get(service_hash=service_hash) if service_hash else None
         )
         if debug_mode: log.LOGGER(f"Computed gas cost for {id}: {gas_cost}")
         
         if not spend_gas(id=id, gas_to_spend=gas_cost):
             try:
-                update_reputation(token=id, amount=-10)  # TODO Needs to update the reputation of the service, not the instance. 
+                update_service_reputation(service_hash=service_hash, amount=-10)
                 log.LOGGER(f"Pruning container {id} due to insufficient gas.")
                 prune_container(token=id)
             except Exception as e:
                 log.LOGGER(f'Error purging {id}: {str(e)}')
                 raise Exception(f'Error purging {id}: {str(e)}')
         else:
-            update_reputation(token=id, amount=10)
+            update_service_reputation(service_hash=service_hash, amount=10)
             if debug_mode: log.LOGGER(f"Updated reputation for {id} due to successful maintenance.")
 
 
@@ -147,15 +165,23 @@ def maintain_clients():
             SQLConnection().delete_client(client_id)
 
 
+def __refill_deposit(peer_id: str, amount: int):
+    # Runs on the executor, nobody waits for its result.
+    try:
+        if not increase_deposit_on_peer(peer_id=peer_id, amount=amount):
+            log.LOGGER(f'Manager error: the peer {peer_id} could not be increased.')
+    except Exception as e:
+        log.LOGGER(f'Manager error: increasing the deposit on the peer {peer_id} failed: {str(e)}')
+
+
 def peer_deposits():
-    for peer_id in SQLConnection().get_peers_id(): # TODO async
+    refills = []
+    for peer_id in SQLConnection().get_peers_id():
         if not is_peer_available(peer_id=peer_id, min_slots_open=MIN_SLOTS_OPEN_PER_PEER):
             try:
                 instance = next(peerpc(
                     method=gateway_pb2_grpc.GatewayStub(
-                        grpc.insecure_channel(
-                            next(generate_uris_by_peer_id(peer_id=peer_id), "")
-                        )
+                        peer_channel(peer_id=peer_id)
                     ).GetInstance,
                     indices_parser=gateway_pb2.Instance,
                     partitions_message_mode_parser=True
@@ -182,8 +208,12 @@ def peer_deposits():
             # f'\n   min deposit per peer -> {MIN_DEPOSIT_PEER}'
             # f'\n   actual gas deposit -> {gas_amount_on_other_peer(peer_id=peer_id)}'
             # f'\n\n')
-            if not increase_deposit_on_peer(peer_id=peer_id, amount=TOTAL_REFILLED_DEPOSIT-peer_gas):
-                log.LOGGER(f'Manager error: the peer {peer_id} could not be increased.')
+            refills.append((peer_id, TOTAL_REFILLED_DEPOSIT-peer_gas))
+
+    # The payments are in flight at the same time, each one only waits for its own confirmation.
+    with ThreadPoolExecutor(max_workers=PEER_DEPOSIT_WORKERS) as executor:
+        for peer_id, amount in refills:
+            executor.submit(__refill_deposit, peer_id=peer_id, amount=amount)
 
 
 def check_dev_clients():
@@ -223,6 +253,7 @@ def manager_thread():
         maintain_clients()
         peer_deposits()
         DuplicateGrabber().manager()
+        collect_unused_blocks()
         
         sleep(MANAGER_ITERATION_TIME)
         short_interval_count += 1
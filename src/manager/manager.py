@@ -3,11 +3,11 @@ import uuid
 from typing import Optional, Generator, Protocol, Tuple
 
 import docker as docker_lib
-import grpc
 from bee_rpc import client as bee
 from google.protobuf.json_format import MessageToJson
 
-from src.manager.resources_manager import IOBigData
+from src.manager.resources_manager import IOBigData, MemoryRequestTooBig
+from src.manager.peer_performance import peer_channel
 from protos import celaut_pb2, gateway_pb2, gateway_pb2_grpc
 from src.reputation_system.contracts.ergo.proof_validation import validate_contract_ledger
 
@@ -17,11 +17,11 @@ from src.utils import logger as log
 from src.utils import utils
 from src.utils.env import DOCKER_CLIENT, EnvManager
 from src.utils.utils import (
-    to_gas_amount,
-    generate_uris_by_peer_id
+    to_gas_amount
 )
 from src.utils.env import EnvManager
 from src.virtualizers.docker.firewall import remove_rule
+from src.tunneling_system.rpc_tunnel import invalidate_container_ip
 
 env_manager = EnvManager()
 
@@ -113,7 +113,11 @@ def __modify_sysreq(id: str, sys_req: celaut_pb2.Sysresources) -> bool:
     if sys_req.HasField('mem_limit'):
         variation = sc.get_sys_req(id=id)['mem_limit'] - sys_req.mem_limit
         if variation < 0:
-            IOBigData().lock_ram(ram_amount=abs(variation))
+            try:
+                IOBigData().lock_ram(ram_amount=abs(variation))
+            except MemoryRequestTooBig as e:
+                log.LOGGER(f'Manager error: container {id} can not get more memory. {e}')
+                return False
         elif variation > 0:
             IOBigData().unlock_ram(ram_amount=variation)
         if variation != 0:
@@ -266,9 +270,7 @@ def get_client_id_on_other_peer(peer_id: str) -> Optional[str]:
     log.LOGGER('Generate new client for peer ' + peer_id)
     client_msg = next(bee.client_grpc(
         method=gateway_pb2_grpc.GatewayStub(
-            grpc.insecure_channel(
-                next(generate_uris_by_peer_id(peer_id=peer_id), "")
-            )
+            peer_channel(peer_id=peer_id)
         ).GenerateClient,
         indices_parser=gateway_pb2.Client,
         partitions_message_mode_parser=True
@@ -384,6 +386,7 @@ def prune_container(token: str) -> Optional[int]:  # TODO Should be divided into
             DOCKER_CLIENT().containers.get(token).remove(force=True)
         except (docker_lib.errors.NotFound, docker_lib.errors.APIError):
             pass  # Maybe was killed
+        invalidate_container_ip(token=token)  # Its IP could be assigned to another container.
         
         father_id = sc.get_internal_father_id(id=token)
         serialized_instance = sc.get_internal_instance(id=token)
@@ -402,9 +405,7 @@ def prune_container(token: str) -> Optional[int]:  # TODO Should be divided into
             refund = utils.from_gas_amount(
                 next(bee.client_grpc(
                     method=gateway_pb2_grpc.GatewayStub(
-                        grpc.insecure_channel(
-                            next(utils.generate_uris_by_peer_id(peer_id))
-                        )
+                        peer_channel(peer_id=peer_id)
                     ).ModifyGasDeposit,  # TODO Verify: Should use StopService instead ??
                         partitions_message_mode_parser=True,
                         indices_parser=gateway_pb2.ModifyGasDepositOutput,
@@ -499,9 +500,7 @@ def modify_gas_deposit(gas_amount: int, service_token: str) -> Tuple[bool, str]:
             peer_id = sc.get_peer_id_by_external_service(token=external_token)
             _output = next(bee.client_grpc(
                 method=gateway_pb2_grpc.GatewayStub(
-                    grpc.insecure_channel(
-                        next(utils.generate_uris_by_peer_id(peer_id))
-                    )
+                    peer_channel(peer_id=peer_id)
                 ).ModifyGasDeposit,
                 partitions_message_mode_parser=True,
                 indices_parser=gateway_pb2.ModifyGasDepositOutput,
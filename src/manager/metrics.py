@@ -1,4 +1,3 @@
-import grpc
 from bee_rpc import client as bee
 
 import datetime
@@ -6,11 +5,11 @@ import datetime
 from protos import gateway_pb2, gateway_pb2_grpc
 
 from src.manager.manager import get_client_id_on_other_peer
+from src.manager.peer_performance import peer_channel
 from src.database.sql_connection import SQLConnection, is_peer_available
 
 from src.utils.env import DOCKER_NETWORK
-from src.utils.utils import from_gas_amount, get_network_name, to_gas_amount, \
-    generate_uris_by_peer_id
+from src.utils.utils import from_gas_amount, get_network_name, to_gas_amount
 from src.utils.logger import LOGGER as log
 from src.utils.env import EnvManager
 
@@ -70,9 +69,7 @@ def __get_metrics_external(peer_id: str, token: str) -> gateway_pb2.Metrics:
     """
     return next(bee.client_grpc(
         method=gateway_pb2_grpc.GatewayStub(
-            grpc.insecure_channel(
-                next(generate_uris_by_peer_id(peer_id=peer_id))
-            )
+            peer_channel(peer_id=peer_id)
         ).GetMetrics,
         input=gateway_pb2.TokenMessage(
             token=token
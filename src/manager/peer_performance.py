@@ -0,0 +1,177 @@
+import threading
+from time import sleep, time
+from typing import Dict, List, Optional, Tuple
+
+import grpc
+
+from src.database.sql_connection import SQLConnection
+from src.utils.logger import LOGGER as log
+from src.utils.singleton import Singleton
+from src.utils.utils import generate_uris_by_peer_id
+from src.utils.env import EnvManager
+
+env_manager = EnvManager()
+
+PEER_PERFORMANCE_ALPHA = float(env_manager.get_env("PEER_PERFORMANCE_ALPHA"))
+PEER_PERFORMANCE_PERSIST_INTERVAL = int(env_manager.get_env("PEER_PERFORMANCE_PERSIST_INTERVAL"))
+PEER_MIN_SUCCESS_RATE = float(env_manager.get_env("PEER_MIN_SUCCESS_RATE"))
+PEER_RETRY_INTERVAL = int(env_manager.get_env("PEER_RETRY_INTERVAL"))
+
+"""
+Performance index of the peers.
+
+Every call to a peer made through peer_channel records its latency (until the first response), if it
+succeeded and if it timed out, as exponentially weighted averages per peer and per RPC method.
+The index is kept in memory and persisted periodically on the peer_performance table.
+
+The service balancer uses it to skip the peers that are failing and to weight their scores.
+"""
+
+PEER = ''  # Method of the stats of the peer, aggregated for all its methods.
+MIN_CALLS = 3  # Calls before a peer can be skipped.
+
+sc = SQLConnection()
+
+
+class Stats:
+
+    def __init__(self, latency: float = 0, success: float = 1, timeouts: int = 0, calls: int = 0,
+                 last_call: float = 0):
+        self.latency = latency  # Seconds.
+        self.success = success  # Rate, from 0 to 1.
+        self.timeouts = timeouts
+        self.calls = calls
+        self.last_call = last_call
+
+    def add(self, latency: float, success: bool, timeout: bool):
+        alpha = PEER_PERFORMANCE_ALPHA if self.calls else 1
+        self.latency += alpha * (latency - self.latency)
+        self.success += alpha * (success - self.success)
+        self.timeouts += timeout
+        self.calls += 1
+        self.last_call = time()
+
+
+class PeerPerformance(metaclass=Singleton):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats: Dict[Tuple[str, str], Stats] = {}  # (peer_id, method) -> stats
+        self.changed = False
+        try:
+            for row in sc.get_peer_performance():
+                self.stats[(row['peer_id'], row['method'])] = Stats(
+                    latency=row['latency'], success=row['success_rate'], timeouts=row['timeouts'],
+                    calls=row['calls'], last_call=row['last_call']
+                )
+        except Exception as e:
+            log(f"Peer performance: the index couldn't be loaded, {e}")
+        threading.Thread(target=self.__persister, daemon=True).start()
+
+    def record(self, peer_id: str, method: str, latency: float, success: bool, timeout: bool = False):
+        with self.lock:
+            for key in ((peer_id, method), (peer_id, PEER)):
+                self.stats.setdefault(key, Stats()).add(latency=latency, success=success, timeout=timeout)
+            self.changed = True
+
+    def get(self, peer_id: str, method: str = PEER) -> Optional[Stats]:
+        with self.lock:
+            return self.stats.get((peer_id, method))
+
+    def available(self, peer_id: str, method: str = PEER) -> bool:
+        """
+        False while the peer is failing, it's tried again once the retry interval is over.
+        """
+        stats = self.get(peer_id=peer_id, method=method)
+        return not stats or stats.calls < MIN_CALLS or stats.success >= PEER_MIN_SUCCESS_RATE \
+            or time() - stats.last_call > PEER_RETRY_INTERVAL
+
+    def factors(self, peer_ids: List[str]) -> Dict[str, float]:
+        """
+        Weight of each peer on the balancer scores: its success rate, penalized by its latency.
+        Peers without calls have a weight of 1.
+        """
+        with self.lock:
+            return {
+                peer_id: stats.success / (1 + stats.latency) if stats else 1
+                for peer_id in peer_ids
+                for stats in (self.stats.get((peer_id, PEER)),)
+            }
+
+    def persist(self):
+        with self.lock:
+            if not self.changed:
+                return
+            rows = [
+                (peer_id, method, stats.latency, stats.success, stats.timeouts, stats.calls, stats.last_call)
+                for (peer_id, method), stats in self.stats.items()
+            ]
+            self.changed = False
+        try:
+            sc.save_peer_performance(rows=rows)
+        except Exception as e:
+            log(f"Peer performance: error persisting the index, {e}")
+            self.changed = True
+
+    def __persister(self):
+        while True:
+            sleep(PEER_PERFORMANCE_PERSIST_INTERVAL)
+            self.persist()
+
+
+class _RecordedResponses:
+    # Records the call once, on its first response or on the error before it.
+
+    def __init__(self, call, peer_id: str, method: str, start: float):
+        self.call = call
+        self.peer_id = peer_id
+        self.method = method
+        self.start = start
+        self.recorded = False
+
+    def __record(self, success: bool, timeout: bool = False):
+        if not self.recorded:
+            self.recorded = True
+            PeerPerformance().record(peer_id=self.peer_id, method=self.method, latency=time() - self.start,
+                                     success=success, timeout=timeout)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            response = next(self.call)
+        except StopIteration:
+            self.__record(success=True)
+            raise
+        except grpc.RpcError as e:
+            self.__record(success=False, timeout=e.code() == grpc.StatusCode.DEADLINE_EXCEEDED)
+            raise
+        self.__record(success=True)
+        return response
+
+    def __getattr__(self, name):
+        return getattr(self.call, name)
+
+
+class _PerformanceInterceptor(grpc.StreamStreamClientInterceptor):
+
+    def __init__(self, peer_id: str):
+        self.peer_id = peer_id
+
+    def intercept_stream_stream(self, continuation, client_call_details, request_iterator):
+        method: str = client_call_details.method.split('/')[-1]
+        return _RecordedResponses(
+            call=continuation(client_call_details, request_iterator),
+            peer_id=self.peer_id, method=method, start=time()
+        )
+
+
+def peer_channel(peer_id: str, uri: Optional[str] = None) -> grpc.Channel:
+    """
+    Channel to a peer (to its first open uri, if not given) that records the performance of its calls.
+    """
+    return grpc.intercept_channel(
+        grpc.insecure_channel(uri or next(generate_uris_by_peer_id(peer_id=peer_id), "")),
+        _PerformanceInterceptor(peer_id=peer_id)
+    )
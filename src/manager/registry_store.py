@@ -0,0 +1,170 @@
+import mmap
+import os
+import shutil
+from typing import Iterable, Iterator, Optional
+from uuid import uuid4
+
+from bee_rpc import client as grpcbb
+
+from protos import celaut_pb2 as celaut
+from src.manager.block_store import register_service_blocks
+from src.utils.logger import LOGGER as log
+from src.utils.tools.registry_cache import RegistryCache
+from src.utils.verify import StreamHasher, hashes_match, get_service_hex_main_hash
+from src.utils.env import SHA3_256_ID, EnvManager
+
+env_manager = EnvManager()
+
+REGISTRY = env_manager.get_env("REGISTRY")
+REGISTRY_STAGING = env_manager.get_env("REGISTRY_STAGING")
+
+CHUNK_SIZE = 1024 * 1024
+
+"""
+Stores received services on the registry.
+
+The service is first moved to the staging area (on the same filesystem as the registry, so it's only
+copied once if it was received on another one), its hashes are verified, and then it's renamed
+atomically into the registry, so readers never see a partially written or corrupted service.
+
+The hashes are computed as the service partitions arrive on the gateway (see ReceiveHasher), otherwise
+while the service is copied to the staging area, or with a single read of the staged service if it was
+only renamed.
+"""
+
+
+class ReceiveHasher:
+    """
+    Hashes the service partition of a bee request stream as its buffers arrive.
+
+    Wraps the request iterator given to the bee parser. Services sent with blocks are not hashed here,
+    their content is hashed from the staging area with the blocks.
+    """
+
+    def __init__(self, request_iterator: Iterator, service_index: int):
+        self.request_iterator = request_iterator
+        self.service_index = service_index
+        self.index: Optional[int] = None
+        self.hasher: Optional[StreamHasher] = None
+        self.blocks = False
+
+    def __iter__(self):
+        for buffer in self.request_iterator:
+            if buffer.HasField('head'):
+                self.index = buffer.head.index
+                if self.index == self.service_index:
+                    self.hasher, self.blocks = StreamHasher(), False
+            if self.index == self.service_index:
+                if buffer.HasField('block'):
+                    self.blocks = True
+                elif buffer.HasField('chunk'):
+                    self.hasher.update(buffer.chunk)
+            yield buffer
+
+    def received(self) -> Optional[StreamHasher]:
+        """
+        The hasher of the service received, if it could be hashed on arrival.
+        """
+        return self.hasher if self.hasher and not self.blocks else None
+
+
+def __copy_file(source: str, destination: str, hasher: StreamHasher):
+    with open(source, 'rb') as src, open(destination, 'wb') as dst:
+        for chunk in iter(lambda: src.read(CHUNK_SIZE), b''):
+            hasher.update(chunk)
+            dst.write(chunk)
+
+
+def __stage(service_dir: str, staging: str, hasher: Optional[StreamHasher]) -> bool:
+    """
+    Returns if the service was hashed while staging it (only with a hasher).
+    """
+    try:
+        os.rename(service_dir, staging)  # Same filesystem, nothing is copied.
+        return False
+    except OSError:
+        if os.path.isdir(service_dir):
+            shutil.copytree(service_dir, staging)
+            shutil.rmtree(service_dir, ignore_errors=True)
+            return False
+        if not hasher:
+            shutil.copyfile(service_dir, staging)
+            os.remove(service_dir)
+            return False
+        __copy_file(source=service_dir, destination=staging, hasher=hasher)
+        os.remove(service_dir)
+        return True
+
+
+def __hash_staged(staging: str, hasher: StreamHasher):
+    if os.path.isdir(staging):
+        # The service content, with the blocks, in the order of the serialized message.
+        for chunk in grpcbb.read_multiblock_directory(staging + '/'):
+            hasher.update(chunk)
+        return
+
+    with open(staging, 'rb') as f:
+        if os.fstat(f.fileno()).st_size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                view = memoryview(m)
+                for position in range(0, len(view), CHUNK_SIZE):
+                    hasher.update(view[position:position + CHUNK_SIZE])
+                view.release()
+
+
+def __discard(path: str):
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def store_service(
+        service_dir: str,
+        service_hash: Optional[str] = None,
+        expected_hashes: Iterable[celaut.Metadata.HashTag.Hash] = (),
+        received: Optional[StreamHasher] = None
+) -> Optional[str]:
+    """
+    Verifies and moves a received service into the registry.
+
+    The service must match the service hash (if given) and the expected hashes of the supported types.
+    Without service hash, the computed one is used. If the service was hashed while it was received, the
+    received hasher is used and the service is not read again.
+
+    Returns the service hash if the service is on the registry, or None if it was rejected.
+    """
+    if service_hash and os.path.exists(REGISTRY + service_hash):
+        __discard(service_dir)
+        return service_hash
+
+    os.makedirs(REGISTRY_STAGING, exist_ok=True)
+    staging = REGISTRY_STAGING + uuid4().hex
+    hasher = received or StreamHasher()
+    try:
+        if not __stage(service_dir=service_dir, staging=staging, hasher=None if received else hasher) \
+                and not received:
+            __hash_staged(staging=staging, hasher=hasher)
+
+        hashes = hasher.hashes()
+        computed_hash = get_service_hex_main_hash(other_hashes=hashes)
+        expected = list(expected_hashes)
+        if service_hash:
+            expected.append(celaut.Metadata.HashTag.Hash(type=SHA3_256_ID, value=bytes.fromhex(service_hash)))
+        if not hashes_match(computed=hashes, expected=expected):
+            log(f"Service rejected, the content hash {computed_hash} doesn't match {service_hash}.")
+            __discard(staging)
+            return None
+
+        service_hash = computed_hash
+        os.rename(staging, REGISTRY + service_hash)
+    except OSError as e:
+        __discard(staging)
+        if service_hash and os.path.exists(REGISTRY + service_hash):
+            return service_hash  # Stored concurrently by another request.
+        log(f"Exception storing the service {service_hash}: {e}")
+        return None
+
+    RegistryCache().invalidate(service_hash=service_hash)
+    register_service_blocks(service_hash=service_hash)
+    return service_hash
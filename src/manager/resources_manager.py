@@ -1,7 +1,10 @@
 # I/O Big Data utils.
 import gc
-from time import sleep
-from threading import Lock
+import heapq
+from itertools import count
+from time import time
+from threading import Condition, Lock
+from typing import List, Tuple
 
 import threading
 
@@ -21,17 +24,45 @@ class Singleton(type):
         return cls._instances[cls]
 
 
-mem_manager = lambda len: IOBigData().lock(len=len)
+mem_manager = lambda len, priority=0: IOBigData().lock(len=len, priority=priority)
+
+
+class MemoryRequestTooBig(Exception):
+
+    def __init__(self, ram_amount: int, ram_pool: int):
+        self.ram_amount = ram_amount
+        self.ram_pool = ram_pool
+
+    def __str__(self):
+        return f"Memory request of {IOBigData.convert_size(self.ram_amount)} is bigger than " \
+               f"the memory pool {IOBigData.convert_size(self.ram_pool)}."
 
 
 class IOBigData(metaclass=Singleton):
+    """
+    Memory admission controller.
+
+    Memory reservations wait on a queue ordered by priority (lower first) and arrival. The head of the queue
+    is admitted as soon as it fits, and the requests behind it that fit are admitted meanwhile, so a big
+    reservation doesn't block the small ones while there is memory for them. Once the head waited for
+    BACKFILL_MAX_HEAD_WAIT only the head is admitted, so the big reservations are not starved by the small ones.
+
+    Waiters are notified as soon as some memory is released. They also re-check every RECHECK_INTERVAL, since
+    the pool is the memory available on the system, that changes outside the node too (the cost of the
+    poll is a wake up per second of each waiter).
+    """
+
+    RECHECK_INTERVAL = 1  # Seconds.
+    BACKFILL_MAX_HEAD_WAIT = 30  # Seconds.
+
     class RamLocker(object):
-        def __init__(self, len, iobd):
+        def __init__(self, len, iobd, priority: int = 0):
             self.len = len
             self.iobd = iobd
+            self.priority = priority
 
         def __enter__(self):
-            self.iobd.lock_ram(ram_amount=self.len)
+            self.iobd.lock_ram(ram_amount=self.len, priority=self.priority)
             return self
 
         def unlock(self, amount: int):
@@ -40,7 +71,6 @@ class IOBigData(metaclass=Singleton):
 
         def __exit__(self, type, value, traceback):
             self.iobd.unlock_ram(ram_amount=self.len)
-            gc.collect()
 
     def __init__(self,
                  log=lambda message: print(message),
@@ -53,9 +83,17 @@ class IOBigData(metaclass=Singleton):
         self.ram_locked = 0
         self.get_ram_avaliable = lambda: self.ram_pool() - self.ram_locked
         self.amount_lock = Lock()
+        self.released = Condition(self.amount_lock)
 
-        self.wait = []
-        self.wait_lock = Lock()
+        self.wait: List[Tuple[int, int, int, float]] = []  # Heap of (priority, arrival, amount, arrival time).
+        self.arrivals = count()
+
+        # Counters.
+        self.waiting_amount = 0
+        self.max_queue_depth = 0
+        self.total_wait_time = 0.0
+        self.admitted = 0
+        self.rejected = 0
 
     # General methods.
 
@@ -83,50 +121,86 @@ class IOBigData(metaclass=Singleton):
                 self.log('RAM POOL       -> ' + IOBigData.convert_size(self.ram_pool()))
                 self.log('RAM LOCKED     -> ' + IOBigData.convert_size(self.ram_locked))
                 self.log('RAM AVAILABLE  -> ' + IOBigData.convert_size(self.get_ram_avaliable()))
-                self.log('RAM WAITING    -> ' + IOBigData.convert_size(sum(self.wait)))
+                self.log('RAM WAITING    -> ' + IOBigData.convert_size(self.waiting_amount))
+                self.log('QUEUE DEPTH    -> ' + str(len(self.wait)))
                 self.log('-----------------------------------------\n')
 
-    # Gas manager methods.
-    def __push_wait_list(self, l: int):
-        with self.wait_lock:
-            self.wait.append(l)
-
-    def __pop_wait_list(self, l: int):
-        with self.wait_lock:
-            self.wait.remove(l)
+    def get_stats(self) -> dict:
+        with self.amount_lock:
+            return {
+                'ram_locked': self.ram_locked,
+                'ram_waiting': self.waiting_amount,
+                'queue_depth': len(self.wait),
+                'max_queue_depth': self.max_queue_depth,
+                'total_wait_time': self.total_wait_time,
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+            }
 
     # Manage resources methods.
 
-    def lock(self, len):
-        return self.RamLocker(len=len, iobd=self)
+    def lock(self, len, priority: int = 0):
+        return self.RamLocker(len=len, iobd=self, priority=priority)
 
-    def lock_ram(self, ram_amount: int, wait: bool = True):
-        self.__stats('want lock ' + IOBigData.convert_size(ram_amount))
-        self.__push_wait_list(l=ram_amount)
-        while True:
-            self.__stats('go to lock ' + IOBigData.convert_size(ram_amount))
-            if wait:
-                self.wait_to_prevent_kill(len=ram_amount)
+    def __backfill(self) -> bool:
+        # With the lock. If the requests behind the head of the queue can be admitted.
+        return not self.wait or time() - self.wait[0][3] < self.BACKFILL_MAX_HEAD_WAIT
 
-            elif not self.prevent_kill(len=ram_amount):
-                self.__pop_wait_list(l=ram_amount)
-                raise Exception
+    def __admissible(self, request: Tuple[int, int, int, float]) -> bool:
+        # With the lock.
+        if self.get_ram_avaliable() <= request[2]:
+            return False
+        return self.wait[0] is request or self.__backfill()
 
-            with self.amount_lock:
-                if self.get_ram_avaliable() > ram_amount:
-                    self.ram_locked += ram_amount
-                else:
-                    continue
-            self.__pop_wait_list(l=ram_amount)
-            break
+    def lock_ram(self, ram_amount: int, wait: bool = True, priority: int = 0):
+        self.__stats('want lock ' + IOBigData.convert_size(ram_amount))
+        with self.amount_lock:
+            # The memory that would be available with nothing locked, the ones waiting for it could fit later.
+            ram_pool = self.ram_pool() + self.ram_locked
+            if ram_amount > ram_pool:
+                self.rejected += 1
+                raise MemoryRequestTooBig(ram_amount=ram_amount, ram_pool=ram_pool)
+
+        with self.released:
+            if not wait:
+                if not self.__backfill() or self.get_ram_avaliable() <= ram_amount:
+                    self.rejected += 1
+                    raise Exception(f"Not enough memory to lock {IOBigData.convert_size(ram_amount)}")
+                self.ram_locked += ram_amount
+                self.admitted += 1
+                return
+
+            start = time()
+            request = (priority, next(self.arrivals), ram_amount, start)
+            heapq.heappush(self.wait, request)
+            self.waiting_amount += ram_amount
+            self.max_queue_depth = max(self.max_queue_depth, len(self.wait))
+            try:
+                while not self.__admissible(request):
+                    self.released.wait(timeout=self.RECHECK_INTERVAL)
+                self.ram_locked += ram_amount
+                self.admitted += 1
+            finally:
+                # Leave the queue, also on errors so the next request can be admitted.
+                self.wait.remove(request)
+                heapq.heapify(self.wait)
+                self.waiting_amount -= ram_amount
+                self.total_wait_time += time() - start
+                self.released.notify_all()  # The new head could fit too.
         self.__stats('locked ' + IOBigData.convert_size(ram_amount))
 
     def unlock_ram(self, ram_amount: int):
-        with self.amount_lock:
+        with self.released:
             if ram_amount < self.ram_locked:
                 self.ram_locked -= ram_amount
             else:
                 self.ram_locked = 0
+            pending = bool(self.wait)
+            self.released.notify_all()
+
+        # Only collect the garbage when someone is waiting for memory.
+        if pending:
+            gc.collect()
 
         self.__stats('unlocked ' + IOBigData.convert_size(ram_amount))
 
@@ -136,8 +210,6 @@ class IOBigData(metaclass=Singleton):
         return b
 
     def wait_to_prevent_kill(self, len: int) -> None:
-        while True:
-            if not self.prevent_kill(len=len):
-                sleep(1)
-            else:
-                return
+        with self.released:
+            while self.get_ram_avaliable() <= len:
+                self.released.wait(timeout=self.RECHECK_INTERVAL)
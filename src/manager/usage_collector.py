@@ -0,0 +1,125 @@
+import os
+import threading
+from time import sleep
+from typing import Dict, Optional
+
+from src.utils.logger import LOGGER as log
+from src.utils.singleton import Singleton
+from src.utils.env import DOCKER_CLIENT, EnvManager
+
+env_manager = EnvManager()
+
+USAGE_SAMPLE_INTERVAL = int(env_manager.get_env("USAGE_SAMPLE_INTERVAL"))
+USAGE_STATS_ALPHA = float(env_manager.get_env("USAGE_STATS_ALPHA"))
+USAGE_MIN_SAMPLES = int(env_manager.get_env("USAGE_MIN_SAMPLES"))
+
+"""
+Observed resource usage of the services.
+
+A background collector samples the memory of every running container, from its cgroup files when they are
+available or from the Docker stats otherwise, and keeps rolling statistics (exponentially weighted mean and
+variance) per service hash, the image of the container.
+
+The cost model uses them to estimate the maintenance cost of a service and its variance, and the maintainer
+bills the running services from them.
+"""
+
+CGROUP = "/sys/fs/cgroup"
+
+
+class RollingStats:
+
+    def __init__(self):
+        self.samples = 0
+        self.mean = 0.0
+        self.variance = 0.0
+
+    def add(self, value: float):
+        self.samples += 1
+        if self.samples == 1:
+            self.mean = value
+            return
+        diff = value - self.mean
+        increment = USAGE_STATS_ALPHA * diff
+        self.mean += increment
+        self.variance = (1 - USAGE_STATS_ALPHA) * (self.variance + diff * increment)
+
+    @property
+    def std(self) -> float:
+        return self.variance ** 0.5
+
+
+class ServiceUsage:
+
+    def __init__(self):
+        self.memory = RollingStats()  # Bytes.
+
+
+def __read_int(path: str) -> Optional[int]:
+    try:
+        with open(path) as f:
+            return int(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _cgroup_sample(container_id: str) -> Optional[int]:
+    """
+    Memory in bytes, from cgroup v2 or v1.
+    """
+    v2 = f"{CGROUP}/system.slice/docker-{container_id}.scope"
+    if os.path.isdir(v2):
+        return __read_int(f"{v2}/memory.current")
+    return __read_int(f"{CGROUP}/memory/docker/{container_id}/memory.usage_in_bytes")
+
+
+def _docker_sample(container) -> Optional[int]:
+    try:
+        return container.stats(stream=False)["memory_stats"]["usage"]
+    except Exception:
+        return None
+
+
+def container_service_hash(container) -> Optional[str]:
+    """
+    Hash of the service of a container, from its image (tagged <service hash>.docker by the builder).
+    """
+    image: str = container.attrs.get("Config", {}).get("Image") or container.attrs.get("Image", "")
+    return image[:-len(".docker")] if image.endswith(".docker") else None
+
+
+class UsageCollector(metaclass=Singleton):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.services: Dict[str, ServiceUsage] = {}
+        threading.Thread(target=self.__collector, daemon=True).start()
+
+    def get(self, service_hash: str) -> Optional[ServiceUsage]:
+        """
+        Usage of the service, if it was observed enough times.
+        """
+        with self.lock:
+            usage = self.services.get(service_hash)
+            return usage if usage and usage.memory.samples >= USAGE_MIN_SAMPLES else None
+
+    def sample(self):
+        for container in DOCKER_CLIENT().containers.list():
+            service_hash = container_service_hash(container=container)
+            if not service_hash:
+                continue  # Not a service container.
+
+            memory = _cgroup_sample(container_id=container.id) or _docker_sample(container=container)
+            if memory is None:
+                continue
+
+            with self.lock:
+                self.services.setdefault(service_hash, ServiceUsage()).memory.add(memory)
+
+    def __collector(self):
+        while True:
+            try:
+                self.sample()
+            except Exception as e:
+                log(f"Usage collector error: {e}")
+            sleep(USAGE_SAMPLE_INTERVAL)
@@ -1,5 +1,8 @@
 import codecs
-from typing import Generator, List, Tuple, Union
+import tarfile
+from hashlib import sha3_256
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Generator, List, Optional, Set, Tuple, Union
 
 from src.utils import logger as log
 import json
@@ -19,12 +22,88 @@ CACHE = env_manager.get_env("CACHE")
 PACKER_MEMORY_SIZE_FACTOR = env_manager.get_env("PACKER_MEMORY_SIZE_FACTOR")
 SAVE_ALL = env_manager.get_env("SAVE_ALL")
 MIN_BUFFER_BLOCK_SIZE = env_manager.get_env("MIN_BUFFER_BLOCK_SIZE")
+PACKER_WORKERS = int(env_manager.get_env("PACKER_WORKERS"))
+INCREMENTAL_PACK = env_manager.get_env("INCREMENTAL_PACK")
+PACK_MANIFESTS = env_manager.get_env("PACK_MANIFESTS")
+BLOCKDIR = env_manager.get_env("BLOCKDIR")
+
+SYMLINK_MAX_HOPS = 40  # As the Linux SYMLOOP_MAX.
+
+
+class _Entry:
+    # Node of the merged filesystem of the image layers.
+    DIRECTORY, FILE, LINK = range(3)
+
+    def __init__(self, kind: int, layer: int, member: Optional[tarfile.TarInfo] = None, src: Optional[str] = None):
+        self.kind = kind
+        self.layer = layer  # Layer that wrote the entry.
+        self.member = member
+        self.src = src
+        self.path: Optional[str] = None  # Path of the file on the image.
+        self.children: Dict[str, '_Entry'] = {}
+        self.content = None
+        self.digest: Optional[str] = None  # Sha3-256 of the file content, for the incremental pack.
+
+
+def _follow(root: _Entry, entry: Optional[_Entry], hops: int = 0) -> Optional[_Entry]:
+    # Target of the link (through the chain of links), None if it's dangling or loops.
+    while entry and entry.kind == _Entry.LINK:
+        hops += 1
+        if hops > SYMLINK_MAX_HOPS:
+            return None
+        entry = _lookup(root=root, path=entry.src, hops=hops)
+    return entry
+
+
+def _lookup(root: _Entry, path: str, hops: int = 0) -> Optional[_Entry]:
+    # Entry of the path on the merged filesystem, following the links of its parent directories.
+    entry = root
+    for index, part in enumerate([p for p in os.path.normpath("/" + path).split("/") if p]):
+        if index:
+            entry = _follow(root=root, entry=entry, hops=hops)
+        if not entry or entry.kind != _Entry.DIRECTORY:
+            return None
+        entry = entry.children.get(part)
+    return entry
+
+
+def _hide_lower(directory: _Entry, layer: int):
+    # Opaque whiteout, keeps only the content of the directory written by the layer, also inside its subdirectories.
+    for name, child in list(directory.children.items()):
+        if child.kind == _Entry.DIRECTORY:
+            _hide_lower(directory=child, layer=layer)
+            if child.layer != layer and not child.children:
+                del directory.children[name]
+        elif child.layer != layer:
+            del directory.children[name]
+
+
+def _copy_digest(src, dst=None) -> str:
+    # Sha3-256 of the stream, copying it to dst if given.
+    digest = sha3_256()
+    for chunk in iter(lambda: src.read(1024 * 1024), b''):
+        digest.update(chunk)
+        if dst:
+            dst.write(chunk)
+    return digest.hexdigest()
+
+
+def _create_block(file_path: str) -> Tuple[bytes, bytes]:
+    # Runs on the packer process pool.
+    block_hash, block = block_builder.create_block(
+        file_path=file_path,
+        copy=True
+    )
+    os.remove(file_path)
+    return block_hash, block.SerializeToString()
 
 
 class ZipContainerPacker:
     def __init__(self, path, aux_id):
         super().__init__()
         self.blocks: List[bytes] = []
+        self.__blocks_set: Set[bytes] = set()
+        self.layers: List[str] = []
         self.service = pack_pb2.Service()
         self.metadata = celaut.Metadata()
         self.path = path
@@ -40,7 +119,6 @@ class ZipContainerPacker:
 
         # Directories are created on cache.
         os.system("mkdir " + CACHE + self.aux_id + "/building")
-        os.system("mkdir " + CACHE + self.aux_id + "/filesystem")
 
         # Log the selected architecture.
         log.LOGGER(f"Arch selected {arch}")
@@ -51,9 +129,8 @@ class ZipContainerPacker:
 
         # Define Docker commands
         commands = [
-            f"{DOCKER_COMMAND} buildx build --platform {arch} --no-cache -t builder{self.aux_id} {self.path}",
-            f"{DOCKER_COMMAND} save builder{self.aux_id} > {CACHE}{self.aux_id}/building/container.tar",
-            f"tar -xvf {CACHE}{self.aux_id}/building/container.tar -C {CACHE}{self.aux_id}/building/"
+            f"{DOCKER_COMMAND} buildx build --platform {arch}{'' if INCREMENTAL_PACK else ' --no-cache'} -t builder{self.aux_id} {self.path}",
+            f"{DOCKER_COMMAND} save builder{self.aux_id} > {CACHE}{self.aux_id}/building/container.tar"
         ]
 
         # Execute Docker commands with error handling using subprocess
@@ -103,53 +180,183 @@ class ZipContainerPacker:
         # Check first tag for use as name
         self.tag = self.json["tag"] if "tag" in self.json else None
         
+    def __merge_layers(self) -> _Entry:
+        # Applies the layers in the manifest order, including the whiteouts,
+        #  https://github.com/opencontainers/image-spec/blob/main/layer.md#whiteouts
+        root = _Entry(kind=_Entry.DIRECTORY, layer=-1)
+        with tarfile.open(CACHE + self.aux_id + "/building/container.tar") as image:
+            self.layers = json.load(image.extractfile("manifest.json"))[0]["Layers"]
+            for layer, layer_name in enumerate(self.layers):
+                log.LOGGER('Reading layer ' + layer_name)
+                with tarfile.open(fileobj=image.extractfile(layer_name)) as layer_tar:
+                    for member in layer_tar:
+                        self.__merge_member(root=root, layer=layer, member=member)
+        return root
+
+    @staticmethod
+    def __merge_member(root: _Entry, layer: int, member: tarfile.TarInfo):
+        parts = [p for p in os.path.normpath("/" + member.name).split("/") if p]
+        if not parts:
+            return
+
+        parent = root
+        for part in parts[:-1]:
+            # A link to a directory is resolved, the member goes to the target directory.
+            child = _follow(root=root, entry=parent.children.get(part))
+            if not child or child.kind != _Entry.DIRECTORY:
+                child = parent.children[part] = _Entry(kind=_Entry.DIRECTORY, layer=layer)
+            parent = child
+
+        name = parts[-1]
+        if name == '.wh..wh..opq':
+            # Opaque whiteout, hides the content of the directory from the lower layers.
+            _hide_lower(directory=parent, layer=layer)
+        elif name.startswith('.wh.'):
+            parent.children.pop(name[len('.wh.'):], None)
+        elif member.isdir():
+            if name not in parent.children or parent.children[name].kind != _Entry.DIRECTORY:
+                parent.children[name] = _Entry(kind=_Entry.DIRECTORY, layer=layer)
+            else:
+                parent.children[name].layer = layer
+        elif member.issym():
+            src = member.linkname if member.linkname.startswith("/") \
+                else os.path.normpath(os.path.join("/" + "/".join(parts[:-1]), member.linkname))
+            parent.children[name] = _Entry(kind=_Entry.LINK, layer=layer, src=src)
+        elif member.islnk():
+            # Hard links share the entry (and the block) with its target.
+            target = _lookup(root=root, path=member.linkname)
+            if target and target.kind == _Entry.FILE:
+                parent.children[name] = target
+            else:
+                log.LOGGER(f"Hard link {member.name} ignored, its target {member.linkname} is not a file of the image.")
+        elif member.isfile():
+            parent.children[name] = _Entry(kind=_Entry.FILE, layer=layer, member=member)
+            parent.children[name].path = "/" + "/".join(parts)
+
+    def __manifest_file(self) -> str:
+        # One manifest for each project, identified by its tag (or the service.json if it has no tag) and architecture.
+        project = json.dumps([self.json.get("tag") or self.json, self.json.get("architecture")], sort_keys=True)
+        return PACK_MANIFESTS + sha3_256(project.encode()).hexdigest() + ".json"
+
+    def __load_manifest(self) -> Dict[str, dict]:
+        if not INCREMENTAL_PACK:
+            return {}
+        try:
+            with open(self.__manifest_file(), "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def __save_manifest(self, manifest: Dict[str, dict]):
+        if not INCREMENTAL_PACK:
+            return
+        os.makedirs(PACK_MANIFESTS, exist_ok=True)
+        with open(self.__manifest_file(), "w") as f:
+            json.dump(manifest, f)
+
+    @staticmethod
+    def __reuse_block(entry: _Entry, previous: Optional[dict], layer_tar: tarfile.TarFile) \
+            -> Optional[Tuple[bytes, bytes]]:
+        # The file content is the same as on the last pack and its block is still on the block directory.
+        #  The content is hashed from the layer, that is cheaper than creating the block again.
+        if not previous or previous["size"] != entry.member.size or not previous.get("digest") \
+                or not os.path.isfile(BLOCKDIR + previous["hash"]):
+            return None
+        entry.digest = _copy_digest(src=layer_tar.extractfile(entry.member))
+        if entry.digest != previous["digest"]:
+            return None
+        try:
+            os.utime(BLOCKDIR + previous["hash"])  # Keeps it out of the block collector during the grace period.
+        except FileNotFoundError:
+            return None
+        return bytes.fromhex(previous["hash"]), bytes.fromhex(previous["block"])
+
+    def __read_files(self, root: _Entry) -> int:
+        # Returns the number of blocks reused from the last pack.
+        # Group the files by the layer that contains its last version.
+        files_by_layer: Dict[int, Dict[int, _Entry]] = {}
+        pending: List[_Entry] = [root]
+        while pending:
+            for entry in pending.pop().children.values():
+                if entry.kind == _Entry.DIRECTORY:
+                    pending.append(entry)
+                elif entry.kind == _Entry.FILE:
+                    files_by_layer.setdefault(entry.layer, {})[id(entry)] = entry
+
+        previous_manifest = self.__load_manifest()
+        manifest: Dict[str, dict] = {}
+        reused = 0
+
+        staging_dir = CACHE + self.aux_id + "/building/blocks/"
+        os.makedirs(staging_dir, exist_ok=True)
+        with tarfile.open(CACHE + self.aux_id + "/building/container.tar") as image, \
+                ProcessPoolExecutor(max_workers=PACKER_WORKERS) as pool:
+            block_entries: List[_Entry] = []
+            for layer, entries in files_by_layer.items():
+                with tarfile.open(fileobj=image.extractfile(self.layers[layer])) as layer_tar:
+                    for entry in entries.values():
+                        if entry.member.size < MIN_BUFFER_BLOCK_SIZE:
+                            entry.content = layer_tar.extractfile(entry.member).read()
+                            continue
+
+                        block_entries.append(entry)
+                        entry.content = self.__reuse_block(
+                            entry=entry, previous=previous_manifest.get(entry.path), layer_tar=layer_tar
+                        )
+                        if entry.content:
+                            reused += 1
+                            continue
+
+                        # Only the files that will be blocks are written to disk.
+                        staging_file = staging_dir + str(len(block_entries))
+                        with open(staging_file, 'wb') as f:
+                            entry.digest = _copy_digest(src=layer_tar.extractfile(entry.member), dst=f)
+                        entry.content = pool.submit(_create_block, staging_file)
+
+            for entry in block_entries:
+                block_hash, block = entry.content if type(entry.content) is tuple else entry.content.result()
+                entry.content = block
+                manifest[entry.path] = {
+                    "size": entry.member.size,
+                    "digest": entry.digest,
+                    "hash": block_hash.hex(),
+                    "block": block.hex()
+                }
+                if block_hash not in self.__blocks_set:
+                    self.__blocks_set.add(block_hash)
+                    self.blocks.append(block_hash)
+
+        if INCREMENTAL_PACK:
+            log.LOGGER(f"Incremental pack: {reused} of {len(block_entries)} blocks reused.")
+        self.__save_manifest(manifest=manifest)
+        return reused
+
+    def __filesystem(self, directory: _Entry, path: str) -> celaut.Service.Container.Filesystem:
+        filesystem = celaut.Service.Container.Filesystem()
+        for name in sorted(directory.children):
+            entry = directory.children[name]
+            branch = filesystem.branch.add()
+            branch.name = name
+            if entry.kind == _Entry.DIRECTORY:
+                branch.filesystem.CopyFrom(
+                    self.__filesystem(directory=entry, path=path + name + '/')
+                )
+            elif entry.kind == _Entry.LINK:
+                branch.link.dst = path + name
+                branch.link.src = entry.src
+            else:
+                branch.file = entry.content
+        return filesystem
+
     def parseContainer(self):
         def parseFilesys() -> celaut.Metadata.HashTag:
-            # Save his filesystem on cache.
-            for layer in os.listdir(CACHE + self.aux_id + "/building/"):
-                if os.path.isdir(CACHE + self.aux_id + "/building/" + layer):
-                    log.LOGGER('Unzipping layer ' + layer)
-                    os.system(
-                        "tar -xvf " + CACHE + self.aux_id + "/building/" + layer + "/layer.tar -C "
-                        + CACHE + self.aux_id + "/filesystem/"
-                    )
-            # Add filesystem data to filesystem buffer object.
-            def recursive_parsing(directory: str) -> celaut.Service.Container.Filesystem:
-                host_dir = CACHE + self.aux_id + "/filesystem"
-                filesystem = celaut.Service.Container.Filesystem()
-                for b_name in os.listdir(host_dir + directory):
-                    if b_name == '.wh..wh..opq':
-                        # https://github.com/opencontainers/image-spec/blob/master/layer.md#opaque-whiteout
-                        continue
-                    branch = celaut.Service.Container.Filesystem.ItemBranch()
-                    branch.name = os.path.basename(b_name)
-                    # It's a link.
-                    if os.path.islink(host_dir + directory + b_name):
-                        branch.link.dst = directory + b_name
-                        branch.link.src = os.path.realpath(host_dir + directory + b_name)[
-                                          len(host_dir):] if host_dir in os.path.realpath(
-                            host_dir + directory + b_name) else os.path.realpath(host_dir + directory + b_name)
-                    # It's a file.
-                    elif os.path.isfile(host_dir + directory + b_name):
-                        if os.path.getsize(host_dir + directory + b_name) < MIN_BUFFER_BLOCK_SIZE:
-                            with open(host_dir + directory + b_name, 'rb') as file:
-                                branch.file = file.read()
-                        else:
-                            block_hash, block = block_builder.create_block(
-                                file_path=host_dir + directory + b_name,
-                                copy=True
-                            )
-                            branch.file = block.SerializeToString()
-                            if block_hash not in self.blocks:
-                                self.blocks.append(block_hash)
-                    # It's a folder.
-                    elif os.path.isdir(host_dir + directory + b_name):
-                        branch.filesystem.CopyFrom(
-                            recursive_parsing(directory=directory + b_name + '/')
-                        )
-                    filesystem.branch.append(branch)
-                return filesystem
-            self.service.container.filesystem.CopyFrom(recursive_parsing(directory="/"))
+            # Merge the layers of the image without extracting them, and create the blocks on the process pool.
+            root = self.__merge_layers()
+            self.__read_files(root=root)
+            self.service.container.filesystem.CopyFrom(self.__filesystem(directory=root, path="/"))
+            # Known limitation: the hash is the one of the multiblock serialization of the filesystem, that only
+            #  bee_rpc knows how to lay out, so it can't be computed while the blocks are created and the directory
+            #  is read again.
             return celaut.Metadata.HashTag(
                 hash=calculate_hashes(
                     value=self.service.container.filesystem.SerializeToString()
@@ -292,10 +499,6 @@ class ZipContainerPacker:
                     value=bytes_id
                 )]
             )
-            from hashlib import sha3_256
-            validate_content = sha3_256()
-            for i in grpcbb.read_multiblock_directory(directory=service_directory):
-                validate_content.update(i)
             service = service_directory
         # Add the tag attribute as the first tag or tag list in the metadata. This could be used as the name of the service for better human identification.
         if self.tag and type(self.tag) is str: 
@@ -315,12 +518,16 @@ def ok(path, aux_id) -> Tuple[str, celaut.Metadata, Union[str, pack_pb2.Service]
     
     _memory = int(PACKER_MEMORY_SIZE_FACTOR) * spec_file.buffer_len
     log.LOGGER(f"Try to lock {_memory / (1024**2):.2f} MB")
-    with resources_manager.mem_manager(len=_memory):
-        spec_file.parseContainer()
-        spec_file.parseApi()
-        spec_file.parseNetwork()
+    try:
+        with resources_manager.mem_manager(len=_memory):
+            spec_file.parseContainer()
+            spec_file.parseApi()
+            spec_file.parseNetwork()
 
-        identifier, metadata, service = spec_file.save()
+            identifier, metadata, service = spec_file.save()
+    except resources_manager.MemoryRequestTooBig as e:
+        log.LOGGER(f"Can't pack the service. {e}")
+        identifier, metadata, service = None, None, str(e)
 
     # os.system(DOCKER_COMMAND+' tag builder' + aux_id + ' ' + identifier + '.docker')  <-- This avoids rebuilding the container on the first run, but it causes file permission issues since it inherits them as they were on the host. Preferably, if using Docker, it is better to rebuild it.
     os.system(DOCKER_COMMAND + ' rmi -f builder' + aux_id)
@@ -1,15 +1,18 @@
-from typing import Optional, List, Tuple
+from concurrent.futures import Future
+from typing import Callable, Optional, List, Tuple, Dict, Set
 from protos import celaut_pb2, gateway_pb2
-import requests
 from hashlib import sha3_256
 from ergpy import appkit
 from ergpy.helper_functions import simple_send
 from src.database import sql_connection
 from src.payment_system.exceptions import DoubleSpendingAttempt
+from src.manager.ergo import ergo_node_url, ergo_node_get
+from src.utils.http_client import HttpClient
 from src.utils.logger import LOGGER
+from src.utils.singleton import Singleton
 from src.utils.env import EnvManager
-from threading import Lock
-from time import sleep
+from threading import Condition, Lock, Thread
+from time import sleep, time
 
 from jpype import *
 import java.lang
@@ -25,7 +28,7 @@ DEFAULT_FEE = 1_000_000  # Fee for the transaction in nanoErgs
 LEDGER = "ergo" # or "ergo-testnet" for Ergo testnet.
 CONTRACT = "proveDlog(decodePoint())".encode('utf-8')  # Ergo tree script
 CONTRACT_HASH = sha3_256(CONTRACT).hexdigest()
-ERGO_NODE_URL = lambda: env_manager.get_env("ERGO_NODE_URL")
+ERGO_NODE_URL = lambda: ergo_node_url()  # The fastest available node.
 COLD_WALLET = lambda: env_manager.get_env('ERGO_PAYMENTS_RECIVER_WALLET')
 ERGO_DONATION_WALLET = lambda: env_manager.get_env('ERGO_DONATION_WALLET')
 ERGO_DONATION_PERCENTAGE = lambda: clamp(float(env_manager.get_env('ERGO_DONATION_PERCENTAGE')), 1.0, 0.0)  # type: ignore
@@ -34,8 +37,12 @@ ERGO_AUXILIAR_MNEMONIC = env_manager.get_env("ERGO_AUXILIAR_MNEMONIC")
 ERGO_WALLET_MNEMONIC = lambda: env_manager.get_env('ERGO_WALLET_MNEMONIC')
 WAIT_TX_TIME = 240  # 20 minutes (each 5 seconds)
 WAT_TX_SLEEP_TIME = 5
+WAIT_TX_RESULT_MARGIN = 60  # Seconds the payment waits after the tracker deadline, for its last poll.
+ERGO_HTTP_CACHE_TTL = float(env_manager.get_env("ERGO_HTTP_CACHE_TTL"))
 
-payment_lock = Lock()  # Ensures that the same input box is no spent with more amount that it has. (could be more efficient ...)
+reserved_boxes: Set[str] = set()  # Input boxes of the payments in flight, so no two payments spend the same box.
+spent_boxes: Set[str] = set()  # Input boxes of the submitted payments, reserved until they leave the unspent set.
+reserved_boxes_condition = Condition()  # Notified when a payment releases its boxes.
 
 def __gas_to_nanoerg(amount: int) -> int:
     return int(amount/(10**58)) if amount > 10**58 else amount  # type: ignore
@@ -57,13 +64,14 @@ def __get_sender_addr(mnemonic: str) -> Address:
     sender_address = ergo.getSenderAddress(index=0, wallet_mnemonic=_m[1], wallet_password=_m[2])
     return sender_address
 
-def __get_input_boxes(amount: int) -> List[dict]:
-    ergo = __init_ergo()
+def __input_boxes_path(sender_address: Address) -> str:
+    return f"/api/v1/boxes/unspent/unconfirmed/byAddress/{sender_address}"
+
+def __get_input_boxes(ergo, sender_address: Address) -> List[dict]:
     explorer_api = ergo.get_api_url()
-    sender_address = __get_sender_addr(ERGO_WALLET_MNEMONIC())
 
-    url = f"{explorer_api}/api/v1/boxes/unspent/unconfirmed/byAddress/{sender_address}"
-    response = requests.get(url)
+    # Not cached, it must include the change boxes of the payments just submitted.
+    response = HttpClient().get(path=__input_boxes_path(sender_address), base_urls=[explorer_api])
 
     if response.status_code != 200:
         LOGGER(f"Error fetching UTXOs: {response.status_code} - {response.text}")
@@ -78,17 +86,59 @@ def __get_input_boxes(amount: int) -> List[dict]:
             decoded_r4 = bytes.fromhex(r4_value).decode("utf-8")
             if decoded_r4 in []: # ... in deposit tokens (from db).
                 continue
-        inputs.append(box_dict)  # TODO Should convert dict -> InputBox.
+        inputs.append(box_dict)
     return inputs
 
+def __reserve_input_boxes(ergo, sender_address: Address, amount: int) -> List[str]:
+    """
+    Reserves unspent boxes of the wallet, not reserved by other payment in flight, covering the amount and the fee.
+
+    If the unreserved boxes are not enough while other payments are in flight, waits for them to release
+    their boxes or for their change boxes to be on the (unconfirmed) unspent set, up to WAIT_TX_TIME polls.
+    """
+    deadline = time() + WAIT_TX_TIME * WAT_TX_SLEEP_TIME
+    while True:
+        boxes = __get_input_boxes(ergo=ergo, sender_address=sender_address) or []
+        with reserved_boxes_condition:
+            spent_boxes.intersection_update(box["boxId"] for box in boxes)  # The others left the unspent set.
+            selected, total = [], 0
+            for box in boxes:
+                if box["boxId"] in reserved_boxes or box["boxId"] in spent_boxes:
+                    continue
+                selected.append(box["boxId"])
+                total += box["value"]
+                if total >= amount + 2 * DEFAULT_FEE:  # The change box needs value too.
+                    reserved_boxes.update(selected)
+                    return selected
+
+            if not reserved_boxes and not spent_boxes:
+                raise Exception(f"Not enough UTXOs to cover {amount} nanoErgs." if boxes
+                                else "No UTXO found for the wallet address.")
+            if time() > deadline:
+                raise Exception(f"Not enough unreserved UTXOs to cover {amount} nanoErgs.")
+            reserved_boxes_condition.wait(timeout=WAT_TX_SLEEP_TIME)
+
+def __release_input_boxes(box_ids: List[str], submitted: bool):
+    """
+    Releases the boxes of a payment. The boxes of a submitted transaction, that could still be on the mempool,
+    are kept reserved until they leave the unspent set.
+    """
+    with reserved_boxes_condition:
+        reserved_boxes.difference_update(box_ids)
+        if submitted:
+            spent_boxes.update(box_ids)
+        reserved_boxes_condition.notify_all()
+
 def __balance_total(address: Address) -> Optional[dict]:
     # Initialize ErgoAppKit and fetch unspent UTXOs for the contract address
     ergo = __init_ergo()
     explorer_api = ergo.get_api_url()
 
     # Construct the API URL to fetch unspent UTXOs for the contract address
-    url = f"{explorer_api}/api/v1/addresses/{str(address.toString())}/balance/total"
-    response = requests.get(url)
+    response = HttpClient().get(
+        path=f"/api/v1/addresses/{str(address.toString())}/balance/total",
+        base_urls=[explorer_api], cache_ttl=ERGO_HTTP_CACHE_TTL
+    )
 
     if response.status_code != 200:
         LOGGER(f"Error fetching the total balance: {response.status_code} - {response.text}")
@@ -179,79 +229,147 @@ def manager():
         LOGGER(f"Exception on simple send -> {str(e)}")
 
 
-# Function to process the payment, generating a transaction with the token in register R4
-def process_payment(amount: int, deposit_token: str, ledger: str, contract_address: str) -> celaut_pb2.ContractLedger:
-    with payment_lock:
-        amount = __gas_to_nanoerg(amount)
-        LOGGER(f"Process ergo platform payment for token {deposit_token} of {amount}")
+class ConfirmationTracker(metaclass=Singleton):
+    """
+    Confirms the submitted payment transactions from a background poller, so no payment waits for the others.
+    Each pending transaction has a future, resolved with its contract ledger once it's confirmed or failed
+    with an exception if it isn't in WAIT_TX_TIME polls.
+    on_done is called with whether the transaction was confirmed or is still on the mempool.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.pending: Dict[str, Tuple[Future, celaut_pb2.ContractLedger, str, Callable[[bool], None], float]] = {}
+        Thread(target=self.__poller, daemon=True).start()
+
+    def track(self, tx_id: str, contract_ledger: celaut_pb2.ContractLedger, explorer_api: str,
+              on_done: Callable[[bool], None]) -> Future:
+        future = Future()
+        with self.lock:
+            self.pending[tx_id] = (future, contract_ledger, explorer_api, on_done,
+                                   time() + WAIT_TX_TIME * WAT_TX_SLEEP_TIME)
+        return future
+
+    def __resolve(self, tx_id: str, submitted: bool, error: Optional[Exception] = None):
+        with self.lock:
+            future, contract_ledger, _, on_done, _ = self.pending.pop(tx_id)
+        try:
+            on_done(submitted)
+        except Exception as e:
+            LOGGER(f"Error releasing the tx {tx_id}: {e}")
+        if error:
+            future.set_exception(error)
+        else:
+            future.set_result(contract_ledger)
 
+    def __confirmed(self, tx_id: str, explorer_api: str) -> bool:
         try:
-            # Initialize ErgoAppKit and get the sender's address
-            ergo = __init_ergo()
-            sender_address = __get_sender_addr(ERGO_WALLET_MNEMONIC())
-
-            # Fetch UTXO from the contract's address
-            input_utxo = ergo.getInputBoxCovering(
-                amount_list=[amount],
-                sender_address=sender_address
-            )
+            response = HttpClient().get(path=f"/api/v1/transactions/{tx_id}", base_urls=[explorer_api])
+        except Exception as e:
+            LOGGER(f"{explorer_api} requests to check tx {tx_id} failed: {e}")
+            return False
+        if response.status_code != 200:
+            if response.status_code != 404:
+                LOGGER(f"{explorer_api} requests to check tx {tx_id} failed with status code {response.status_code}")
+            return False
+        return response.json()["numConfirmations"] > 1
 
-            if not input_utxo:
-                raise Exception("No UTXO found for the contract address with the required token.")
-
-            # Build the output box with the token in register R4
-            out_box = ergo._ctx.newTxBuilder() \
-                        .outBoxBuilder() \
-                        .value(amount) \
-                        .registers([
-                            ErgoValue.of(jpype.JString(deposit_token).getBytes("utf-8"))  # Store token in R4
-                        ]) \
-                        .contract(Address.create(contract_address).toErgoContract()) \
-                        .build()  # Build the output box
-
-            # Create the unsigned transaction
-            unsigned_tx = ergo.buildUnsignedTransaction(
-                input_box=input_utxo,  # Input UTXO
-                outBox=[out_box],  # Output box
-                fee=DEFAULT_FEE / 10**9,  # Fee for the transaction
-                sender_address=sender_address  # Sender's address
-            )
+    def __in_mempool(self, tx_id: str) -> bool:
+        try:
+            return ergo_node_get(path=f"/transactions/unconfirmed/byTransactionId/{tx_id}").status_code != 404
+        except Exception as e:
+            LOGGER(f"Can't check if the tx {tx_id} is on the mempool, assuming it is: {e}")
+            return True
+
+    def __poller(self):
+        while True:
+            sleep(WAT_TX_SLEEP_TIME)
+            with self.lock:
+                pending = [(tx_id, entry[2], entry[4]) for tx_id, entry in self.pending.items()]
+            for tx_id, explorer_api, deadline in pending:
+                try:
+                    if self.__confirmed(tx_id=tx_id, explorer_api=explorer_api):
+                        LOGGER(f"Tx {tx_id} verified.")
+                        self.__resolve(tx_id=tx_id, submitted=True)
+                    elif time() > deadline:
+                        self.__resolve(tx_id=tx_id, submitted=self.__in_mempool(tx_id=tx_id),
+                                       error=Exception(f"Can't verify the tx {tx_id}"))
+                except Exception as e:
+                    LOGGER(f"Error checking the tx {tx_id}, retrying on the next poll: {e}")
+
+
+# Function to submit the payment, generating a transaction with the token in register R4
+def submit_payment(amount: int, deposit_token: str, ledger: str, contract_address: str) -> Future:
+    """
+    Builds, signs and submits the payment transaction. Returns a future of its contract ledger,
+    resolved once the transaction is confirmed.
+    """
+    amount = __gas_to_nanoerg(amount)
+    LOGGER(f"Process ergo platform payment for token {deposit_token} of {amount}")
 
-            # Sign the transaction
-            w_mnemonic = ergo.getMnemonic(wallet_mnemonic=ERGO_WALLET_MNEMONIC(), mnemonic_password=None)[0]
-            signed_tx = ergo.signTransaction(unsigned_tx, w_mnemonic, prover_index=0)
-
-            # Submit the transaction and get the transaction ID
-            try:
-                tx_id = ergo.txId(signed_tx)
-                LOGGER(f"Transaction submitted: {tx_id} for token {deposit_token}")
-            except Exception as e:
-                if "Double spending attempt" in str(e):
-                    raise DoubleSpendingAttempt(LEDGER)
-                else:
-                    raise e
-
-            for sec in range(0, WAIT_TX_TIME):
-                sleep(WAT_TX_SLEEP_TIME)
-                response = requests.get(f"{ergo.get_api_url()}/api/v1/transactions/{tx_id}")
-                if response.status_code != 200:
-                    if response.status_code != 404:
-                        LOGGER(f"{ergo.get_api_url()} requests to check tx {tx_id} failed with status code {response.status_code}")
-                    continue
+    # Initialize ErgoAppKit and get the sender's address
+    ergo = __init_ergo()
+    sender_address = __get_sender_addr(ERGO_WALLET_MNEMONIC())
 
-                obj = response.json()
-                if obj["numConfirmations"] > 1:
-                    LOGGER(f"Tx {tx_id} verified.")
-                    return gateway_pb2.celaut__pb2.ContractLedger(
-                        ledger=ledger,
-                        contract_addr=contract_address,
-                        contract=CONTRACT
-                    )
+    # Reserve the input boxes, other payments can be built meanwhile with other boxes.
+    box_ids = __reserve_input_boxes(ergo=ergo, sender_address=sender_address, amount=amount)
+    release = lambda submitted: __release_input_boxes(box_ids=box_ids, submitted=submitted)
 
-            raise Exception(f"Can't verify the tx {tx_id}")
+    try:
+        input_utxo = java.util.Arrays.asList(ergo._ctx.getBoxesById(*box_ids))
+
+        # Build the output box with the token in register R4
+        out_box = ergo._ctx.newTxBuilder() \
+                    .outBoxBuilder() \
+                    .value(amount) \
+                    .registers([
+                        ErgoValue.of(jpype.JString(deposit_token).getBytes("utf-8"))  # Store token in R4
+                    ]) \
+                    .contract(Address.create(contract_address).toErgoContract()) \
+                    .build()  # Build the output box
+
+        # Create the unsigned transaction
+        unsigned_tx = ergo.buildUnsignedTransaction(
+            input_box=input_utxo,  # Input UTXOs
+            outBox=[out_box],  # Output box
+            fee=DEFAULT_FEE / 10**9,  # Fee for the transaction
+            sender_address=sender_address  # Sender's address
+        )
 
+        # Sign the transaction
+        w_mnemonic = ergo.getMnemonic(wallet_mnemonic=ERGO_WALLET_MNEMONIC(), mnemonic_password=None)[0]
+        signed_tx = ergo.signTransaction(unsigned_tx, w_mnemonic, prover_index=0)
+
+        # Submit the transaction and get the transaction ID
+        try:
+            tx_id = ergo.txId(signed_tx)
+            LOGGER(f"Transaction submitted: {tx_id} for token {deposit_token}")
         except Exception as e:
-            raise e
+            if "Double spending attempt" in str(e):
+                raise DoubleSpendingAttempt(LEDGER)
+            else:
+                raise e
+    except Exception as e:
+        release(False)
+        raise e
+
+    return ConfirmationTracker().track(
+        tx_id=tx_id,
+        contract_ledger=gateway_pb2.celaut__pb2.ContractLedger(
+            ledger=ledger,
+            contract_addr=contract_address,
+            contract=CONTRACT
+        ),
+        explorer_api=ergo.get_api_url(),
+        on_done=release
+    )
+
+
+def process_payment(amount: int, deposit_token: str, ledger: str, contract_address: str) -> celaut_pb2.ContractLedger:
+    # Only waits for its own transaction, the payments of other peers are in flight meanwhile.
+    return submit_payment(
+        amount=amount, deposit_token=deposit_token, ledger=ledger, contract_address=contract_address
+    ).result(timeout=WAIT_TX_TIME * WAT_TX_SLEEP_TIME + WAIT_TX_RESULT_MARGIN)
 
 
 # Function to validate the payment process by checking if there is an unspent box with the token in register R4
@@ -265,8 +383,10 @@ def payment_process_validator(amount: int, token: str, ledger: str, contract_add
         explorer_api = ergo.get_api_url()
 
         # Construct the API URL to fetch unspent UTXOs for the contract address
-        url = f"{explorer_api}/api/v1/boxes/unspent/unconfirmed/byAddress/{contract_addr}"
-        response = requests.get(url)
+        response = HttpClient().get(
+            path=f"/api/v1/boxes/unspent/unconfirmed/byAddress/{contract_addr}",
+            base_urls=[explorer_api]
+        )
 
         if response.status_code != 200:
             LOGGER(f"Error fetching UTXOs: {response.status_code} - {response.text}")
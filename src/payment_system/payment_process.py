@@ -3,7 +3,6 @@ from threading import Thread
 from time import sleep
 from datetime import datetime, timedelta
 from threading import Lock
-import grpc
 from bee_rpc import client as bee
 from src.payment_system.exceptions import DoubleSpendingAttempt
 from src.payment_system.ledger_balancer import ledger_balancer
@@ -12,9 +11,10 @@ from src.payment_system.contracts.envs import AVAILABLE_PAYMENT_PROCESS, INIT_IN
 
 from protos import gateway_pb2_grpc, gateway_pb2
 
-from src.reputation_system.interface import update_reputation
+from src.reputation_system.interface import update_reputation, LEDGER
 
 from src.manager.manager import get_client_id_on_other_peer, increase_local_gas_for_client
+from src.manager.peer_performance import peer_channel
 from src.database.sql_connection import SQLConnection
 
 from src.utils import logger as _l
@@ -49,7 +49,7 @@ def __get_grpc_stub(peer_id):
     uri = next(generate_uris_by_peer_id(peer_id=peer_id), None)
     if uri is None:
         return None
-    return gateway_pb2_grpc.GatewayStub(grpc.insecure_channel(uri))
+    return gateway_pb2_grpc.GatewayStub(peer_channel(peer_id=peer_id, uri=uri))
 
 
 def __peer_payment_process(peer_id: str, amount: int) -> bool:
@@ -107,8 +107,8 @@ def __peer_payment_process(peer_id: str, amount: int) -> bool:
                     )
                     _l.LOGGER(f"Payment processed. Deposit token: {deposit_token}")
                     if contract_address and ledger:
-                        update_reputation(token=contract_address, amount=10)  # TODO On envs.
-                        update_reputation(token=ledger, amount=1)  # TODO On envs.
+                        update_reputation(token=contract_address, amount=10, entity_type=LEDGER)  # TODO On envs.
+                        update_reputation(token=ledger, amount=1, entity_type=LEDGER)  # TODO On envs.
                 except DoubleSpendingAttempt as e:
                     _l.LOGGER(str(e))
                     # Internally, the exception updates the wait time to retry the ledger. 
@@ -129,8 +129,8 @@ def __peer_payment_process(peer_id: str, amount: int) -> bool:
                             auxiliar_contract_address_reputation[contract_address] += timedelta(seconds=600)  # Adds 10 minutes.
 
                     if contract_address and ledger:
-                        update_reputation(token=contract_address, amount=-100)  # TODO On envs.
-                        update_reputation(token=ledger, amount=-10)  # TODO On envs.
+                        update_reputation(token=contract_address, amount=-100, entity_type=LEDGER)  # TODO On envs.
+                        update_reputation(token=ledger, amount=-10, entity_type=LEDGER)  # TODO On envs.
                     continue
 
 
@@ -11,25 +11,27 @@ from src.reputation_system.contracts.ergo.utils import get_public_key, addr_to_p
 from src.reputation_system.envs import CONTRACT, LEDGER
 from src.reputation_system.bip_wallet_verification import bip_ecdsa_verify, bip_ecdsa_sign
 from src.database.access_functions.peers import get_peer_directions
+from src.manager.ergo import ergo_node_get, ergo_nodes
 from src.utils.logger import LOGGER as log
 from src.utils.env import EnvManager
 
 from typing import Optional
 
+ERGO_HTTP_CACHE_TTL = float(EnvManager().get_env("ERGO_HTTP_CACHE_TTL"))
+
 def __get_single_address_with_all_tokens(token_id: str) -> Optional[str]:
-    ergo_node = EnvManager().get_env("ERGO_NODE_URL")
-    if not ergo_node:
+    if not ergo_nodes():
         log("No ergo node available.")
         return None
 
-    url = f"{ergo_node}/blockchain/box/unspent/byTokenId/{token_id}"
     params = {
         "offset": 0,
         "limit": 100  # Adjust the limit as needed
     }
     
     try:
-        response = requests.get(url, params=params)
+        response = ergo_node_get(path=f"/blockchain/box/unspent/byTokenId/{token_id}", params=params,
+                                 cache_ttl=ERGO_HTTP_CACHE_TTL)
         if response.status_code != 200:
             log(f"Failed to fetch data from API for token_id {token_id}. Status code: {response.status_code}")
             return None
@@ -10,6 +10,7 @@ from src.reputation_system.contracts.ergo.utils import get_public_key
 from src.reputation_system.envs import CONTRACT
 from src.reputation_system.contracts.ergo.proof_validation import validate_reputation_proof_ownership
 from src.tunneling_system.tunnels import TunnelSystem
+from src.manager.ergo import ergo_node_url
 from src.utils.logger import LOGGER
 from src.utils.env import EnvManager
 
@@ -25,7 +26,7 @@ sigmastate = JPackage('sigmastate')
 
 # Constants
 env_manager = EnvManager()
-ERGO_NODE_URL = lambda: env_manager.get_env("ERGO_NODE_URL")
+ERGO_NODE_URL = lambda: ergo_node_url()  # The fastest available node.
 SUBMIT_NETWORK_ADDRESS_TO_REPUTATION_PROOF = env_manager.get_env('SUBMIT_NETWORK_ADDRESS_TO_REPUTATION_PROOF')
 DEFAULT_FEE = 1_000_000
 SAFE_MIN_BOX_VALUE = 1_000_000
@@ -0,0 +1,139 @@
+import math
+import threading
+from time import time
+from typing import Dict, List, Tuple
+
+from src.database.sql_connection import SQLConnection
+from src.utils.logger import LOGGER as log
+from src.utils.singleton import Singleton
+from src.utils.env import EnvManager
+
+env_manager = EnvManager()
+
+REPUTATION_FLUSH_INTERVAL = int(env_manager.get_env("REPUTATION_FLUSH_INTERVAL"))
+REPUTATION_BATCH_SIZE = int(env_manager.get_env("REPUTATION_BATCH_SIZE"))
+REPUTATION_EVENTS_RETENTION = int(env_manager.get_env("REPUTATION_EVENTS_RETENTION"))
+REPUTATION_COMPACTION_INTERVAL = int(env_manager.get_env("REPUTATION_COMPACTION_INTERVAL"))
+
+"""
+In memory reputation of the peers, services, clients and ledgers.
+
+The score and index (number of events) of each entity are loaded once from the database, and the adjusted
+reputation (score * (1 + log(index))) is kept in memory for the balancers.
+
+Reputation events are applied in memory right away and queued. The queue is flushed to the database periodically
+(or once it has REPUTATION_BATCH_SIZE events): the events are appended to the reputation_event log and their
+aggregation per entity is added to the scores, on one transaction. So the request and payment paths never wait
+for a reputation write.
+The scores of the peers are kept on the peer table (the ledger submission reads them there), the ones of the
+other entities on the reputation_entity table.
+
+The events older than REPUTATION_EVENTS_RETENTION are compacted into one event per entity.
+"""
+
+PEER = "peer"
+SERVICE = "service"
+CLIENT = "client"
+LEDGER = "ledger"
+
+sc = SQLConnection()
+
+
+def _adjusted(score: int, index: int) -> float:
+    return score * (1 + math.log(index or 1))
+
+
+class ReputationEngine(metaclass=Singleton):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.entities: Dict[Tuple[str, str], Tuple[int, int]] = {}  # (type, id) -> (score, index)
+        self.adjusted: Dict[Tuple[str, str], float] = {}
+        self.pending: Dict[Tuple[str, str], Tuple[int, int]] = {}  # (type, id) -> (amount, events) not written yet.
+        self.events: List[Tuple[str, str, int, float]] = []  # (type, id, amount, timestamp) not written yet.
+        self.flush_event = threading.Event()
+        self.last_compaction = time()
+        threading.Thread(target=self.__flusher, daemon=True).start()
+
+    def __load(self, entity_type: str, entity_ids: List[str]):
+        # Without a flush in progress, the database plus the pending events is the current reputation.
+        with self.flush_lock:
+            loaded = sc.get_reputations(peer_ids=entity_ids) if entity_type == PEER else \
+                sc.get_entity_reputations(entity_type=entity_type, entity_ids=entity_ids)
+            with self.lock:
+                for entity_id in entity_ids:
+                    key = (entity_type, entity_id)
+                    if key in self.entities:
+                        continue
+                    if entity_id not in loaded and entity_type == PEER:
+                        continue  # Unknown peer.
+                    score, index = loaded.get(entity_id, (0, 0))
+                    amount, events = self.pending.get(key, (0, 0))
+                    self.entities[key] = (score + amount, index + events)
+                    self.adjusted[key] = _adjusted(score + amount, index + events)
+
+    def get(self, entity_ids: List[str], entity_type: str = PEER) -> Dict[str, float]:
+        """
+        Adjusted reputation of the entities found.
+        """
+        with self.lock:
+            missing = [_id for _id in entity_ids if (entity_type, _id) not in self.entities]
+        if missing:
+            self.__load(entity_type=entity_type, entity_ids=missing)
+        with self.lock:
+            return {
+                _id: self.adjusted[(entity_type, _id)]
+                for _id in entity_ids if (entity_type, _id) in self.adjusted
+            }
+
+    def update(self, entity_id: str, amount: int, entity_type: str = PEER):
+        key = (entity_type, entity_id)
+        with self.lock:
+            if key in self.entities:
+                score, index = self.entities[key]
+                self.entities[key] = (score + amount, index + 1)
+                self.adjusted[key] = _adjusted(score + amount, index + 1)
+            pending_amount, pending_events = self.pending.get(key, (0, 0))
+            self.pending[key] = (pending_amount + amount, pending_events + 1)
+            self.events.append((entity_type, entity_id, amount, time()))
+            if len(self.events) >= REPUTATION_BATCH_SIZE:
+                self.flush_event.set()
+
+    def flush(self) -> int:
+        """
+        Writes the pending events to the database. Returns the number of events written.
+        """
+        with self.flush_lock:
+            with self.lock:
+                updates, self.pending = self.pending, {}
+                events, self.events = self.events, []
+            if not events:
+                return 0
+
+            try:
+                sc.add_reputation_events(events=events, updates=updates, peer_type=PEER)
+                return len(events)
+            except Exception as e:
+                log(f"Reputation engine: error writing {len(events)} events, retrying on the next flush. {e}")
+                with self.lock:
+                    for key, (amount, count) in updates.items():
+                        pending_amount, pending_events = self.pending.get(key, (0, 0))
+                        self.pending[key] = (pending_amount + amount, pending_events + count)
+                    self.events = events + self.events
+                return 0
+
+    def compact(self):
+        sc.compact_reputation_events(before=time() - REPUTATION_EVENTS_RETENTION)
+        self.last_compaction = time()
+
+    def __flusher(self):
+        while True:
+            self.flush_event.wait(timeout=REPUTATION_FLUSH_INTERVAL)
+            self.flush_event.clear()
+            try:
+                self.flush()
+                if time() - self.last_compaction > REPUTATION_COMPACTION_INTERVAL:
+                    self.compact()
+            except Exception as e:
+                log(f"Reputation engine: flush error {e}")
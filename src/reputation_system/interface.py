@@ -1,32 +1,38 @@
-from typing import Optional
+from typing import Dict, List, Optional
 from src.utils.env import EnvManager
 from src.database.sql_connection import SQLConnection
-from src.utils.logger import LOGGER
 from src.reputation_system.contracts.ergo.transaction import submit_reputation_proof
+from src.reputation_system.engine import ReputationEngine, PEER, SERVICE, CLIENT, LEDGER
 
 sc = SQLConnection()
 env_manager = EnvManager()
 
-def update_reputation(token: str, amount: int) -> Optional[str]:
-    # Take the peer_id when the token it's external. Do nothing if it's an internal service.
-    peer_id: str = token.split('##')[1] if "##" in token else token
-    if sc.peer_exists(peer_id=peer_id):
-        return sc.update_reputation_peer(peer_id, amount)
-
-    # For services.
-    # For clients.
-    # For ledgers.
+def update_reputation(token: str, amount: int, entity_type: str = PEER) -> Optional[str]:
+    """
+    Records a reputation event of a peer, service (SERVICE), client (CLIENT) or ledger account (LEDGER).
+    Applied in memory and written to the event log on the next flush.
+    """
+    # Take the peer_id when the token it's external.
+    if "##" in token:
+        token, entity_type = token.split('##')[1], PEER
+    ReputationEngine().update(entity_id=token, amount=amount, entity_type=entity_type)
 
-def compute_reputation(peer_id) -> float:
+def compute_reputation(peer_id, entity_type: str = PEER) -> float:
     """
     As an initial implementation, the node will only consider its own observations.
     Therefore, it will not take into account the reputation assigned by other peers for each of the pairs it interacts with.
     """
-    _result: float = sc.get_reputation(peer_id)
-    LOGGER(f"Computed reputation: {_result}")
-    return _result
+    return ReputationEngine().get(entity_ids=[peer_id], entity_type=entity_type).get(peer_id)
+
+def compute_reputations(peer_ids: List[str]) -> Dict[str, float]:
+    """
+    Reputation of several peers at once, for the balancers. Unknown peers have no reputation (0).
+    """
+    reputations: Dict[str, float] = ReputationEngine().get(entity_ids=peer_ids)
+    return {peer_id: reputations.get(peer_id, 0) for peer_id in peer_ids}
 
 def submit_reputation(force_submit: bool = False):
+    ReputationEngine().flush()  # The ledger submission reads the reputation index from the database.
     sc.submit_to_ledger(
         submit=lambda objects: submit_reputation_proof(objects=objects),
         force_submit=force_submit
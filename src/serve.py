@@ -1,3 +1,4 @@
+import asyncio
 import threading
 from concurrent import futures
 
@@ -5,9 +6,13 @@ import grpc, json
 import netifaces as ni
 
 from protos import gateway_pb2, gateway_pb2_grpc
+from src.gateway.admission import AdmissionInterceptor, AsyncAdmissionInterceptor, MAX_SERVER_THREADS
+from src.gateway.aio_gateway import AsyncGateway
 from src.gateway.gateway import Gateway
 from src.tunneling_system.tunnels import TunnelSystem
 from src.manager.maintain_thread import manager_thread
+from src.manager.usage_collector import UsageCollector
+from src.manager.ergo import ErgoNodes
 from src.utils import logger as log
 from src.utils.zeroconf import Zeroconf
 from src.utils.env import LOCAL_NETWORK, DOCKER_NETWORK, EnvManager
@@ -26,6 +31,18 @@ COST_AVERAGE_VARIATION = env_manager.get_env("COST_AVERAGE_VARIATION")
 GAS_COST_FACTOR = env_manager.get_env("GAS_COST_FACTOR")
 MODIFY_SERVICE_SYSTEM_RESOURCES_COST = env_manager.get_env("MODIFY_SERVICE_SYSTEM_RESOURCES_COST")
 EXTERNAL_COST_TIMEOUT = env_manager.get_env("EXTERNAL_COST_TIMEOUT")
+GATEWAY_AIO = env_manager.get_env("GATEWAY_AIO")
+
+
+async def __serve_aio():
+    server = grpc.aio.server(interceptors=[AsyncAdmissionInterceptor()])
+    gateway_pb2_grpc.add_GatewayServicer_to_server(
+        AsyncGateway(), server=server
+    )
+    server.add_insecure_port('[::]:' + str(GATEWAY_PORT))
+    await server.start()
+    await server.wait_for_termination()
+
 
 def serve():
     # Zeroconf for connect to the network (one per network).
@@ -39,18 +56,16 @@ def serve():
         daemon=True
     ).start()
 
-    # create a gRPC server
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=30))
-    gateway_pb2_grpc.add_GatewayServicer_to_server(
-        Gateway(), server=server
-    )
+    # Start sampling the usage of the containers.
+    UsageCollector()
+
+    # Start probing the Ergo nodes.
+    ErgoNodes()
 
     SERVICE_NAMES = (
         gateway_pb2.DESCRIPTOR.services_by_name['Gateway'].full_name,
     )
 
-    server.add_insecure_port('[::]:' + str(GATEWAY_PORT))
-
     log.LOGGER('COMPUTE POWER RATE -> ' + str(COMPUTE_POWER_RATE))
     log.LOGGER('COST OF BUILD -> ' + str(COST_OF_BUILD))
     log.LOGGER('EXECUTION BENEFIT -> ' + str(EXECUTION_BENEFIT))
@@ -63,8 +78,25 @@ def serve():
     log.LOGGER('MODIFY_SERVICE_SYSTEM_RESOURCES_COST_FACTOR-> ' + str(MODIFY_SERVICE_SYSTEM_RESOURCES_COST))
     log.LOGGER('EXTERNAL_COST_TIMEOUT -> ' + str(EXTERNAL_COST_TIMEOUT))
 
+    log.LOGGER('ASYNCIO GATEWAY -> ' + str(GATEWAY_AIO))
+
     log.LOGGER('Starting gateway at port' + str(GATEWAY_PORT))
     log.LOGGER(f"Available tunnels: {json.dumps(TunnelSystem().get_gateway_urls(), indent=4)}")
 
+    if GATEWAY_AIO:
+        asyncio.run(__serve_aio())
+        return
+
+    # create a gRPC server, the admission control keeps each method class within its share of the threads
+    #  and sheds the requests over it.
+    server = grpc.server(
+        futures.ThreadPoolExecutor(max_workers=MAX_SERVER_THREADS),
+        interceptors=[AdmissionInterceptor()]
+    )
+    gateway_pb2_grpc.add_GatewayServicer_to_server(
+        Gateway(), server=server
+    )
+    server.add_insecure_port('[::]:' + str(GATEWAY_PORT))
+
     server.start()
     server.wait_for_termination()
@@ -0,0 +1,79 @@
+import socket
+import threading
+from typing import Optional, Tuple
+
+from src.utils.logger import LOGGER as log
+from src.utils.env import EnvManager
+
+env_manager = EnvManager()
+
+TUNNEL_BUFFER_SIZE = int(env_manager.get_env("TUNNEL_BUFFER_SIZE"))
+
+
+def _pipe(source: socket.socket, destination: socket.socket):
+    buffer = bytearray(TUNNEL_BUFFER_SIZE)
+    view = memoryview(buffer)
+    try:
+        while True:
+            read = source.recv_into(buffer)
+            if not read:
+                break
+            destination.sendall(view[:read])
+        destination.shutdown(socket.SHUT_WR)  # Half-close, the other direction could continue.
+    except OSError:
+        for s in (source, destination):
+            try:
+                s.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+class ProxyEndpoint:
+    """
+    In-process TCP reverse proxy listening on a local port.
+
+    The endpoint can be created before knowing its target (to keep a pool of ready endpoints),
+    connections accepted without target are closed.
+    """
+
+    def __init__(self, host: str):
+        self.listener = socket.create_server((host, 0))
+        self.address: Tuple[str, int] = (host, self.listener.getsockname()[1])
+        self.target: Optional[Tuple[str, int]] = None
+        self.closed = threading.Event()
+        threading.Thread(target=self.__accept, daemon=True).start()
+
+    def assign(self, ip: str, port: int):
+        self.target = (ip, port)
+
+    def __accept(self):
+        while not self.closed.is_set():
+            try:
+                client, _ = self.listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=self.__serve, args=(client,), daemon=True).start()
+
+    def __serve(self, client: socket.socket):
+        with client:
+            if not self.target:
+                return
+            try:
+                upstream = socket.create_connection(self.target)
+            except OSError as e:
+                log(f"Local tunnel {self.address}: can't connect to {self.target}: {e}")
+                return
+            with upstream:
+                for s in (client, upstream):
+                    s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                reverse = threading.Thread(target=_pipe, args=(upstream, client), daemon=True)
+                reverse.start()
+                _pipe(client, upstream)
+                reverse.join()
+
+    def close(self):
+        self.closed.set()
+        try:
+            self.listener.close()
+        except OSError:
+            pass
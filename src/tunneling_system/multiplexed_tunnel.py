@@ -0,0 +1,298 @@
+import queue
+import socket
+import struct
+import threading
+from typing import Dict, Generator, Iterator, Optional
+
+from src.utils.logger import LOGGER as log
+from src.utils.env import EnvManager
+
+env_manager = EnvManager()
+
+TUNNEL_BUFFER_SIZE = int(env_manager.get_env("TUNNEL_BUFFER_SIZE"))
+TUNNEL_QUEUE_SIZE = int(env_manager.get_env("TUNNEL_QUEUE_SIZE"))
+TUNNEL_MUX_WINDOW = int(env_manager.get_env("TUNNEL_MUX_WINDOW"))
+TUNNEL_CONNECT_TIMEOUT = float(env_manager.get_env("TUNNEL_CONNECT_TIMEOUT"))
+
+"""
+Multiplexed service tunnel.
+
+Many logical connections (channels) to the container are framed over the bytes chunks of a single
+ServiceTunnel stream. Each chunk is one frame: channel id (uint32), frame type (uint8) and the payload.
+
+    OPEN    client -> node    payload: the container port (ascii).
+    DATA    both directions   payload: the data.
+    CLOSE   both directions   the sender will not send more data on the channel (half-close).
+    RESET   both directions   the channel is aborted.
+    WINDOW  both directions   payload: uint32, bytes the receiver accepts after the ones already granted.
+
+Each direction of a channel starts with TUNNEL_MUX_WINDOW bytes of credit, so a slow channel never
+blocks the others. The connection of a channel to the container is opened on its own thread, the data
+received meanwhile is queued.
+
+When the client finishes its stream (half-close) every open channel is half-closed to its container, and the
+channels are no longer bounded by the window (the client can't grant more). The response stream ends once
+every channel sent its CLOSE or RESET.
+"""
+
+MUX_SLOT = "mux"
+
+OPEN, DATA, CLOSE, RESET, WINDOW = range(5)
+
+_HEADER = struct.Struct("!IB")
+_CREDIT = struct.Struct("!I")
+
+
+def encode_frame(channel: int, frame_type: int, payload: bytes = b'') -> bytes:
+    return _HEADER.pack(channel, frame_type) + payload
+
+
+def decode_frame(frame: bytes):
+    channel, frame_type = _HEADER.unpack_from(frame)
+    return channel, frame_type, memoryview(frame)[_HEADER.size:]
+
+
+class _Channel:
+
+    def __init__(self, tunnel: 'MultiplexedTunnel', channel: int, port: str):
+        self.tunnel = tunnel
+        self.channel = channel
+        self.port = port
+        self.conn: Optional[socket.socket] = None
+        self.closed = threading.Event()
+
+        # Data the client is allowed to receive, granted with WINDOW frames.
+        self.send_window = TUNNEL_MUX_WINDOW
+        self.unbounded = False  # The client half-closed the stream.
+        self.window = threading.Condition()
+
+        # Bounded by the window granted to the client.
+        self.incoming: queue.Queue = queue.Queue()
+        self.receive_window = TUNNEL_MUX_WINDOW
+        self.receive_lock = threading.Lock()
+
+        self.__pending = 2  # Directions still open.
+        self.__pending_lock = threading.Lock()
+
+    def start(self):
+        threading.Thread(target=self.__connect, daemon=True).start()
+
+    def __connect(self):
+        try:
+            self.conn = socket.create_connection(
+                (self.tunnel.container_ip, int(self.port)), timeout=TUNNEL_CONNECT_TIMEOUT
+            )
+            self.conn.settimeout(None)
+            self.conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except (OSError, ValueError) as e:
+            log(f"Multiplexed tunnel: can't open the channel {self.channel} to "
+                f"{self.tunnel.container_ip}:{self.port}: {e}")
+            self.closed.set()
+            self.tunnel.send(encode_frame(self.channel, RESET))
+            self.tunnel.remove(self.channel, self)
+            return
+
+        if self.closed.is_set():  # Reset by the client while connecting.
+            self.conn.close()
+            self.tunnel.remove(self.channel, self)
+            return
+        threading.Thread(target=self.__read, daemon=True).start()
+        self.__write()
+
+    def __read(self):
+        # Container -> client.
+        buffer = bytearray(min(TUNNEL_BUFFER_SIZE, TUNNEL_MUX_WINDOW))
+        view = memoryview(buffer)
+        try:
+            while True:
+                with self.window:
+                    while self.send_window <= 0 and not self.unbounded and not self.closed.is_set():
+                        self.window.wait()
+                    if self.closed.is_set():
+                        return
+                    size = len(buffer) if self.unbounded else min(len(buffer), self.send_window)
+
+                read = self.conn.recv_into(buffer, size)
+                if not read:
+                    if not self.closed.is_set():
+                        self.tunnel.send(encode_frame(self.channel, CLOSE))
+                    return
+
+                with self.window:
+                    self.send_window -= read
+                self.tunnel.send(encode_frame(self.channel, DATA, bytes(view[:read])))
+        except OSError:
+            if not self.closed.is_set():
+                self.tunnel.send(encode_frame(self.channel, RESET))
+                self.close()
+        finally:
+            self.__done()
+
+    def __write(self):
+        # Client -> container.
+        try:
+            while True:
+                data = self.incoming.get()
+                if data is None:
+                    if not self.closed.is_set():
+                        self.conn.shutdown(socket.SHUT_WR)
+                    return
+                self.conn.sendall(data)
+                with self.receive_lock:
+                    self.receive_window += len(data)
+                self.tunnel.send(encode_frame(self.channel, WINDOW, _CREDIT.pack(len(data))))
+        except OSError:
+            if not self.closed.is_set():
+                self.tunnel.send(encode_frame(self.channel, RESET))
+                self.close()
+        finally:
+            self.__done()
+
+    def __done(self):
+        with self.__pending_lock:
+            self.__pending -= 1
+            if self.__pending:
+                return
+        self.conn.close()
+        self.tunnel.remove(self.channel, self)
+
+    def receive(self, data: bytes):
+        with self.receive_lock:
+            self.receive_window -= len(data)
+            exceeded = self.receive_window < 0
+        if exceeded:
+            log(f"Multiplexed tunnel: the client exceeded the window of the channel {self.channel}.")
+            self.tunnel.send(encode_frame(self.channel, RESET))
+            self.close()
+        else:
+            self.incoming.put(data)
+
+    def grant(self, amount: int):
+        with self.window:
+            self.send_window += amount
+            self.window.notify()
+
+    def half_close(self):
+        self.incoming.put(None)
+        with self.window:
+            self.unbounded = True
+            self.window.notify()
+
+    def close(self):
+        self.closed.set()
+        try:
+            if self.conn:
+                self.conn.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.incoming.put(None)
+        with self.window:
+            self.window.notify()
+
+
+class MultiplexedTunnel:
+
+    def __init__(self, container_ip: str, iterator: Iterator):
+        self.container_ip = container_ip
+        self.iterator = iterator
+        self.output: queue.Queue = queue.Queue(maxsize=TUNNEL_QUEUE_SIZE)
+        self.channels: Dict[int, _Channel] = {}
+        self.channels_lock = threading.Lock()
+        self.closed = threading.Event()
+        self.half_closed = False  # The client finished its stream.
+        self.ended = False  # The end of the response stream was sent.
+
+    def send(self, frame: Optional[bytes]):
+        while not self.closed.is_set():
+            try:
+                self.output.put(frame, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def remove(self, channel: int, _channel: _Channel):
+        with self.channels_lock:
+            if self.channels.get(channel) is _channel:
+                del self.channels[channel]
+            end = self.__end()
+        if end:
+            self.send(None)
+
+    def __end(self) -> bool:
+        # With the channels lock. If the response stream has to end, once.
+        if self.half_closed and not self.channels and not self.ended:
+            self.ended = True
+            return True
+        return False
+
+    def __get(self, channel: int) -> Optional[_Channel]:
+        with self.channels_lock:
+            return self.channels.get(channel)
+
+    def __open(self, channel: int, port: str):
+        _channel = _Channel(tunnel=self, channel=channel, port=port)
+        with self.channels_lock:
+            existing = self.channels.pop(channel, None)
+            if not existing:
+                self.channels[channel] = _channel
+
+        if existing:
+            log(f"Multiplexed tunnel: the channel {channel} was already open, resetting it.")
+            existing.close()
+            self.send(encode_frame(channel, RESET))
+            return
+        _channel.start()
+
+    def __demux(self):
+        try:
+            for data in self.iterator:
+                if not isinstance(data, bytes) or len(data) < _HEADER.size:
+                    continue
+                channel, frame_type, payload = decode_frame(data)
+
+                if frame_type == OPEN:
+                    self.__open(channel=channel, port=bytes(payload).decode())
+                    continue
+
+                _channel = self.__get(channel)
+                if not _channel:
+                    # Late window or close frames of a finished channel are expected.
+                    if frame_type == DATA:
+                        self.send(encode_frame(channel, RESET))
+                elif frame_type == DATA:
+                    _channel.receive(bytes(payload))
+                elif frame_type == CLOSE:
+                    _channel.incoming.put(None)
+                elif frame_type == RESET:
+                    _channel.close()
+                elif frame_type == WINDOW:
+                    _channel.grant(_CREDIT.unpack_from(payload)[0])
+        except Exception as e:
+            log(f"Multiplexed tunnel: error reading the client stream: {e}")
+            self.send(None)
+            return
+
+        # Half-close, the responses of the open channels continue.
+        with self.channels_lock:
+            self.half_closed = True
+            channels = list(self.channels.values())
+            end = self.__end()
+        for _channel in channels:
+            _channel.half_close()
+        if end:
+            self.send(None)
+
+    def frames(self) -> Generator[bytes, None, None]:
+        threading.Thread(target=self.__demux, daemon=True).start()
+        try:
+            while True:
+                frame = self.output.get()
+                if frame is None:  # The client closed the stream and every channel finished.
+                    break
+                yield frame
+        finally:
+            self.closed.set()
+            with self.channels_lock:
+                channels = list(self.channels.values())
+            for _channel in channels:
+                _channel.close()
@@ -1,12 +1,133 @@
+import queue
 import socket
-from typing import Generator, Optional
+import threading
+from time import time
+from typing import Dict, Generator, Optional, Iterator, Tuple
 
 from src.database.sql_connection import SQLConnection
+from src.tunneling_system.multiplexed_tunnel import MUX_SLOT, MultiplexedTunnel
 from src.utils.logger import LOGGER as log
+from src.utils.env import EnvManager
 from protos.gateway_pb2 import TokenMessage
 
+env_manager = EnvManager()
+
+TUNNEL_BUFFER_SIZE = int(env_manager.get_env("TUNNEL_BUFFER_SIZE"))
+TUNNEL_QUEUE_SIZE = int(env_manager.get_env("TUNNEL_QUEUE_SIZE"))
+TUNNEL_IP_CACHE_TTL = int(env_manager.get_env("TUNNEL_IP_CACHE_TTL"))
+TUNNEL_CONNECT_TIMEOUT = float(env_manager.get_env("TUNNEL_CONNECT_TIMEOUT"))
+
 sc = SQLConnection()
 
+__container_ips: Dict[str, Tuple[str, float]] = {}  # token -> (ip, resolved at)
+__container_ips_lock = threading.Lock()
+
+_EOF = None  # Queue sentinel, the container closed its side (or the connection failed).
+
+
+def get_container_ip(token: str) -> Optional[str]:
+    with __container_ips_lock:
+        cached = __container_ips.get(token)
+    if cached and time() - cached[1] < TUNNEL_IP_CACHE_TTL:
+        return cached[0]
+
+    ip = sc.get_internal_ip(id=token)
+    with __container_ips_lock:
+        if ip:
+            __container_ips[token] = (ip, time())
+        else:
+            __container_ips.pop(token, None)
+    return ip
+
+
+def invalidate_container_ip(token: str):
+    # On tunnel errors and when the container is pruned.
+    with __container_ips_lock:
+        __container_ips.pop(token, None)
+
+
+def __configure_socket(conn: socket.socket):
+    conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    conn.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, TUNNEL_BUFFER_SIZE)
+    conn.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, TUNNEL_BUFFER_SIZE)
+
+
+def __upstream(iterator: Iterator, conn: socket.socket, closed: threading.Event):
+    # Client -> container. The gRPC iterator only yields the next chunk once the previous one was sent.
+    try:
+        for data in iterator:
+            if closed.is_set():
+                return
+            if isinstance(data, bytes):
+                conn.sendall(memoryview(data))
+    except Exception as e:  # Socket errors, and the client stream errors (as a cancelled call).
+        if not closed.is_set():
+            log(f"Tunnel upstream error: {e}")
+    finally:
+        # Half-close: the client finished sending, but the response could continue.
+        try:
+            conn.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+
+
+def __put(chunks: queue.Queue, chunk: Optional[bytes], closed: threading.Event) -> bool:
+    # Blocks while the queue is full, until the chunk is queued or the client went away.
+    while not closed.is_set():
+        try:
+            chunks.put(chunk, timeout=1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def __downstream(conn: socket.socket, chunks: queue.Queue, closed: threading.Event):
+    # Container -> client. The bounded queue blocks the reader while the gRPC stream is slower.
+    buffer = bytearray(TUNNEL_BUFFER_SIZE)
+    view = memoryview(buffer)
+    try:
+        while not closed.is_set():
+            read = conn.recv_into(buffer)
+            if not read:
+                break
+            if not __put(chunks, bytes(view[:read]), closed):
+                break
+    except OSError as e:
+        if not closed.is_set():
+            log(f"Tunnel downstream error: {e}")
+    finally:
+        __put(chunks, _EOF, closed)
+
+
+def relay(iterator: Iterator, conn: socket.socket) -> Generator[bytes, None, None]:
+    """
+    Full-duplex relay between a gRPC stream and a connected socket.
+
+    Each direction runs independently, so the container can send data without waiting for the client.
+    Ends when the container closes its side of the connection.
+    """
+    __configure_socket(conn)
+    closed = threading.Event()
+    chunks: queue.Queue = queue.Queue(maxsize=TUNNEL_QUEUE_SIZE)
+
+    threading.Thread(target=__upstream, args=(iterator, conn, closed), daemon=True).start()
+    threading.Thread(target=__downstream, args=(conn, chunks, closed), daemon=True).start()
+
+    try:
+        while True:
+            chunk = chunks.get()
+            if chunk is _EOF:
+                break
+            yield chunk
+    finally:
+        closed.set()
+        try:
+            conn.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
 def service_tunnel(iterator) -> Generator[bytes, None, None]:
     token_id: Optional[str] = None
     slot_id: Optional[str] = None
@@ -29,7 +150,7 @@ def service_tunnel(iterator) -> Generator[bytes, None, None]:
 
     # Get the internal IP address of the container
     log(f"Fetching internal IP for token_id: {token_id}")
-    container_ip = sc.get_internal_ip(id=token_id)
+    container_ip = get_container_ip(token=token_id)
 
     if not container_ip:
         log(f"No internal IP found for token_id: {token_id}")
@@ -37,6 +158,11 @@ def service_tunnel(iterator) -> Generator[bytes, None, None]:
 
     log(f"Internal IP resolved: {container_ip}")
 
+    if slot_id == MUX_SLOT:
+        log(f"Multiplexed tunnel to {container_ip}")
+        yield from MultiplexedTunnel(container_ip=container_ip, iterator=iterator).frames()
+        return None
+
     try:
         port = int(slot_id)
         log(f"Resolved port: {port}")
@@ -46,34 +172,13 @@ def service_tunnel(iterator) -> Generator[bytes, None, None]:
 
     try:
         log(f"Attempting connection to {container_ip}:{port}")
-        with socket.create_connection((container_ip, port)) as conn:
+        with socket.create_connection((container_ip, port), timeout=TUNNEL_CONNECT_TIMEOUT) as conn:
+            conn.settimeout(None)
             log(f"Connection established to {container_ip}:{port}")
-            conn.setblocking(False)  # Use non-blocking mode for bidirectional communication
-
-            while True:
-                # Send data from the iterator to the container
-                try:
-                    data = next(iterator, None)
-                    if data is None:  # End of iterator
-                        log("End of iterator, closing connection")
-                        break
-                    if isinstance(data, bytes):
-                        log(f"Sending data: {len(data)} bytes")
-                        conn.sendall(data)
-                except StopIteration:
-                    log("Iterator exhausted, stopping transmission")
-                    break  # Iterator is exhausted
-
-                # Receive data from the container
-                try:
-                    response = conn.recv(4096)  # 4 KB buffer
-                    if response:
-                        log(f"Received response: {len(response)} bytes")
-                        yield response
-                except socket.error:
-                    log("No data received yet, continuing loop")
-                    pass  # No data to read yet, continue the loop
+            yield from relay(iterator=iterator, conn=conn)
+            log(f"Connection closed to {container_ip}:{port}")
 
     except (socket.error, ValueError) as e:
         log(f"Error during socket operation: {e}")
+        invalidate_container_ip(token=token_id)
         return None
@@ -1,9 +1,12 @@
+import threading
+from abc import ABC, abstractmethod
 from typing import Any, Tuple, Optional, Dict, List
 from pyngrok import ngrok
 import urllib.parse
 import socket
 
 from src.gateway.utils import generate_gateway_instance
+from src.tunneling_system.local_proxy import ProxyEndpoint
 from src.utils.logger import LOGGER
 from src.utils.singleton import Singleton
 from protos import celaut_pb2 as celaut
@@ -14,27 +17,41 @@ env_manager = EnvManager()
 
 GATEWAY_PORT = env_manager.get_env("GATEWAY_PORT")
 NGROK_TUNNELS_KEY = env_manager.get_env("NGROK_TUNNELS_KEY")
+LOCAL_TUNNELS_HOST = env_manager.get_env("LOCAL_TUNNELS_HOST")
+LOCAL_TUNNELS_MAX_INSTANCES = int(env_manager.get_env("LOCAL_TUNNELS_MAX_INSTANCES"))
+TUNNEL_POOL_SIZE = int(env_manager.get_env("TUNNEL_POOL_SIZE"))
+TUNNEL_HEALTH_CHECK_INTERVAL = int(env_manager.get_env("TUNNEL_HEALTH_CHECK_INTERVAL"))
 NUM_GATEWAY_TUNNELS = 1
 
 """
 This module provides functionality for managing tunnel connections using various providers, 
-currently supporting NGROK. The implementation allows exposing the node and easily testing 
-the tunnel system, but it is important to consider the centralized nature of the provider.
+currently supporting NGROK and a local in-process reverse proxy (useful to test the tunnel system offline).
+The implementation allows exposing the node and easily testing the tunnel system, but it is important
+to consider the centralized nature of the NGROK provider.
+
+Each provider keeps a pool of tunnels ready to be assigned, so the launch path doesn't wait for the provider.
+The pool is filled once the node launched its first service, nodes that never do don't keep idle tunnels.
+The pooled ngrok tunnels point to a local reverse proxy endpoint that forwards to the service slot once
+assigned. The tunnels are checked on the background, and the launch path only reads the cached status.
 
 Some solutions to investigate for a decentralized approach:
 - https://github.com/cmars/onionpipe   using Tor network and Onion services
 - https://github.com/fatedier/frp
 """
 
-class Provider:
-    def __init__(self, name: str, auth_token: str, max_instances: int):
+
+class Provider(ABC):
+    pooled = False  # The provider can open tunnels before knowing their target.
+
+    def __init__(self, name: str, max_instances: int):
         self.name = name
-        self.auth_token = auth_token
         self.max_instances = max_instances
         self.current_tunnels: List[Tuple[str, int]] = []
+        self.reserved = 0  # Tunnels being opened.
+        self.health: Dict[Tuple[str, int], bool] = {}  # Status of the last health check of each tunnel.
 
     def can_add_tunnel(self) -> bool:
-        return len(self.current_tunnels) < self.max_instances
+        return len(self.current_tunnels) + self.reserved < self.max_instances
 
     def add_tunnel(self, tunnel: Tuple[str, int]) -> None:
         self.current_tunnels.append(tunnel)
@@ -42,21 +59,115 @@ class Provider:
     def remove_tunnel(self, tunnel: Tuple[str, int]) -> None:
         if tunnel in self.current_tunnels:
             self.current_tunnels.remove(tunnel)
+        self.health.pop(tunnel, None)
+
+    @abstractmethod
+    def open(self, ip: Optional[str], port: Optional[int]) -> Optional[Tuple[str, int]]:
+        """
+        Opens a tunnel to ip:port, or an unassigned one (ip and port None) if the provider is pooled.
+        """
+
+    @abstractmethod
+    def assign(self, tunnel: Tuple[str, int], ip: str, port: int) -> None:
+        """
+        Points an unassigned tunnel to ip:port.
+        """
 
-    def is_tunnel_active(self, tunnel: Tuple[str, int]) -> bool:
+    def close(self, tunnel: Tuple[str, int]) -> None:
+        pass
+
+    def is_tunnel_active(self, tunnel: Tuple[str, int]) -> Optional[bool]:
+        # Cached by the health checks, None if the tunnel was not checked yet.
+        return self.health.get(tunnel)
+
+    def check_tunnel(self, tunnel: Tuple[str, int]) -> bool:
         try:
             ip, port = tunnel
             with socket.create_connection((ip, port), timeout=5):
-                return True
+                active = True
         except OSError:
-            return False
+            active = False
+        self.health[tunnel] = active
+        return active
+
+
+class NgrokProvider(Provider):
+    pooled = True
+
+    def __init__(self, name: str, auth_token: str, max_instances: int):
+        super().__init__(name=name, max_instances=max_instances)
+        self.auth_token = auth_token
+        self.public_urls: Dict[Tuple[str, int], str] = {}
+        self.endpoints: Dict[Tuple[str, int], ProxyEndpoint] = {}  # Of the tunnels opened without target.
+
+    def open(self, ip: Optional[str], port: Optional[int]) -> Optional[Tuple[str, int]]:
+        endpoint = None
+        if not ip or not port:
+            endpoint = ProxyEndpoint(host="127.0.0.1")
+            ip, port = endpoint.address
+        ngrok.set_auth_token(self.auth_token)
+        try:
+            listener = ngrok.connect(f"{ip}:{port}", proto="tcp")
+        except Exception:
+            if endpoint:
+                endpoint.close()
+            raise
+        LOGGER(f"""Ingress established at: {listener.public_url} for the
+            service slot at uri: {ip}:{port} using provider {self.name}""")
+        _ip = listener.public_url.split("://")[1].split(":")[0]
+        _port = int(listener.public_url.split("://")[1].split(":")[1], base=10)  # typed: ignore
+        self.public_urls[(_ip, _port)] = listener.public_url
+        if endpoint:
+            self.endpoints[(_ip, _port)] = endpoint
+        return _ip, _port
+
+    def assign(self, tunnel: Tuple[str, int], ip: str, port: int) -> None:
+        self.endpoints[tunnel].assign(ip=ip, port=port)
+
+    def close(self, tunnel: Tuple[str, int]) -> None:
+        public_url = self.public_urls.pop(tunnel, None)
+        if public_url:
+            ngrok.disconnect(public_url)
+        endpoint = self.endpoints.pop(tunnel, None)
+        if endpoint:
+            endpoint.close()
+
+
+class LocalProvider(Provider):
+    pooled = True
+
+    def __init__(self, name: str, host: str, max_instances: int):
+        super().__init__(name=name, max_instances=max_instances)
+        self.host = host
+        self.endpoints: Dict[Tuple[str, int], ProxyEndpoint] = {}
+
+    def open(self, ip: Optional[str], port: Optional[int]) -> Optional[Tuple[str, int]]:
+        endpoint = ProxyEndpoint(host=self.host)
+        if ip and port:
+            endpoint.assign(ip=ip, port=port)
+        self.endpoints[endpoint.address] = endpoint
+        return endpoint.address
+
+    def assign(self, tunnel: Tuple[str, int], ip: str, port: int) -> None:
+        self.endpoints[tunnel].assign(ip=ip, port=port)
+
+    def close(self, tunnel: Tuple[str, int]) -> None:
+        endpoint = self.endpoints.pop(tunnel, None)
+        if endpoint:
+            endpoint.close()
+
 
 class TunnelSystem(metaclass=Singleton):
     def __init__(self) -> None:
         self.providers: Dict[str, Provider] = {}
         self.gateway_tunnels: List[Tuple[str, int]] = []
         self.db = SQLConnection()
+        self.lock = threading.Lock()
+        self.pool: List[Tuple[str, Tuple[str, int]]] = []  # (provider, tunnel) opened without target.
+        self.pooling = False  # Set on the first service launch.
+        self.refill = threading.Event()
         self.__initialize_providers()
+        threading.Thread(target=self.__maintain, daemon=True).start()
 
     def __initialize_providers(self) -> None:
         ngrok_key = NGROK_TUNNELS_KEY
@@ -68,43 +179,125 @@ class TunnelSystem(metaclass=Singleton):
                 token = token.strip()
                 if token:
                     provider_name = f"ngrok_{i+1}"
-                    self.providers[provider_name] = Provider(
+                    self.providers[provider_name] = NgrokProvider(
                         name=provider_name,
                         auth_token=token,
                         max_instances=max_i
                     )
                     LOGGER(f"Added provider: {provider_name}")
 
+        if LOCAL_TUNNELS_HOST:
+            self.providers["local"] = LocalProvider(
+                name="local",
+                host=LOCAL_TUNNELS_HOST,
+                max_instances=LOCAL_TUNNELS_MAX_INSTANCES
+            )
+            LOGGER(f"Added provider: local on {LOCAL_TUNNELS_HOST}")
+
+    def __reserve(self, provider: str) -> bool:
+        # Takes an instance of the provider for a tunnel that will be opened out of the lock.
+        with self.lock:
+            if not self.providers[provider].can_add_tunnel():
+                return False
+            self.providers[provider].reserved += 1
+            return True
+
     def __select_provider(self) -> Optional[str]:
-        for name, provider in self.providers.items():
-            if provider.can_add_tunnel():
-                ngrok.set_auth_token(provider.auth_token)
+        # Reserves the instance on the selected provider.
+        for name in self.providers:
+            if self.__reserve(provider=name):
                 return name
         return None
 
-    def generate_tunnel(self, ip: str, port: int) -> Optional[Tuple[str, int]]:
-        provider = self.__select_provider()
-        if not provider:
-            return None
-        
+    def __open(self, provider: str, ip: Optional[str], port: Optional[int]) -> Optional[Tuple[str, int]]:
+        # On a reserved instance of the provider.
         try:
-            listener = ngrok.connect(f"{ip}:{port}", proto="tcp")
-            LOGGER(f"""Ingress established at: {listener.public_url} for the
-                service slot at uri: {ip}:{port} using provider {provider}""")
-            _ip = listener.public_url.split("://")[1].split(":")[0]
-            _port = int(listener.public_url.split("://")[1].split(":")[1], base=10)  # typed: ignore
-            self.providers[provider].add_tunnel((_ip, _port))
+            tunnel = self.providers[provider].open(ip=ip, port=port)
+        except Exception as e:
+            LOGGER(f"Exception in {provider} tunnel provider: {str(e)}.")
+            tunnel = None
 
+        with self.lock:
+            self.providers[provider].reserved -= 1
+            if tunnel:
+                self.providers[provider].add_tunnel(tunnel)
+        if tunnel:
             # Store tunnel in the database
-            self.db.add_tunnel(f"{_ip}:{_port}", provider, True)
+            self.db.add_tunnel(f"{tunnel[0]}:{tunnel[1]}", provider, True)
+        return tunnel
 
-            return _ip, _port
-        except Exception as e:
-            LOGGER(f"Exception in Ngrok module: {str(e)}.")
+    def __fill_pool(self):
+        for name, provider in self.providers.items():
+            if not provider.pooled:
+                continue
+            while len([p for p, _ in self.pool if p == name]) < TUNNEL_POOL_SIZE:
+                if not self.__reserve(provider=name):
+                    break
+                tunnel = self.__open(provider=name, ip=None, port=None)
+                if not tunnel:
+                    break
+                # Only checked tunnels go to the pool.
+                if not provider.check_tunnel(tunnel):
+                    LOGGER(f"Tunnel {tunnel} of {name} is not active.")
+                    self.close_tunnel(provider=name, tunnel=tunnel)
+                    break
+                with self.lock:
+                    self.pool.append((name, tunnel))
+
+    def __check_tunnels(self):
+        for provider in list(self.providers.values()):
+            for tunnel in list(provider.current_tunnels):
+                if not provider.check_tunnel(tunnel):
+                    LOGGER(f"Tunnel {tunnel} of {provider.name} is not active.")
+
+    def __maintain(self):
+        # Refills the pool when a tunnel is taken, and checks the tunnels periodically.
+        while True:
+            if self.pooling:
+                self.__fill_pool()
+            self.__check_tunnels()
+            self.refill.wait(timeout=TUNNEL_HEALTH_CHECK_INTERVAL)
+            self.refill.clear()
+
+    def __take_from_pool(self, ip: str, port: int) -> Optional[Tuple[str, int]]:
+        taken: Optional[Tuple[str, Tuple[str, int]]] = None
+        inactive: List[Tuple[str, Tuple[str, int]]] = []
+        with self.lock:
+            while self.pool and not taken:
+                provider, tunnel = self.pool.pop(0)
+                if self.providers[provider].is_tunnel_active(tunnel):
+                    taken = provider, tunnel
+                else:
+                    inactive.append((provider, tunnel))
+
+        for provider, tunnel in inactive:
+            self.close_tunnel(provider=provider, tunnel=tunnel)
+        if not taken:
             return None
+        provider, tunnel = taken
+        self.providers[provider].assign(tunnel=tunnel, ip=ip, port=port)
+        return tunnel
+
+    def generate_tunnel(self, ip: str, port: int) -> Optional[Tuple[str, int]]:
+        # For the service slots, starts keeping the pool.
+        self.pooling = True
+        return self.__generate_tunnel(ip=ip, port=port)
+
+    def __generate_tunnel(self, ip: str, port: int) -> Optional[Tuple[str, int]]:
+        tunnel = self.__take_from_pool(ip=ip, port=port)
+        self.refill.set()
+        if tunnel:
+            LOGGER(f"Tunnel {tunnel} taken from the pool for the service slot at uri: {ip}:{port}")
+            return tunnel
+
+        provider = self.__select_provider()
+        if not provider:
+            return None
+        return self.__open(provider=provider, ip=ip, port=port)
 
     def close_tunnel(self, provider: str, tunnel: Tuple[str, int]):
         if provider in self.providers:
+            self.providers[provider].close(tunnel)
             self.providers[provider].remove_tunnel(tunnel)
             LOGGER(f"Closed tunnel: {tunnel}")
 
@@ -120,12 +313,21 @@ class TunnelSystem(metaclass=Singleton):
     def from_tunnel(self, ip: str) -> bool:
         return urllib.parse.unquote(ip) in ['127.0.0.1', '[::1]']
 
+    def __is_tunnel_active(self, tunnel: Tuple[str, int]) -> Optional[bool]:
+        # None if it was not checked yet, False if it was closed.
+        for provider in self.providers.values():
+            if tunnel in provider.current_tunnels:
+                return provider.is_tunnel_active(tunnel)
+        return False
+
     def __generate_gateway_tunnel(self):
+        # The gateway tunnels not checked yet are kept, the background checks will report them.
+        self.gateway_tunnels = [t for t in self.gateway_tunnels if self.__is_tunnel_active(t) is not False]
         _r = NUM_GATEWAY_TUNNELS - len(self.gateway_tunnels)
         if _r:
             LOGGER("Generate gateway tunnels.")
             for _ in range(_r):
-                tunnel = self.generate_tunnel("localhost", GATEWAY_PORT)
+                tunnel = self.__generate_tunnel("localhost", GATEWAY_PORT)
                 if tunnel:
                     self.gateway_tunnels.append(tunnel)
 
@@ -138,8 +340,7 @@ class TunnelSystem(metaclass=Singleton):
         _gi = generate_gateway_instance(network='localhost')
         _gi.instance.uri_slot[0].uri.pop()
 
-        if not self.gateway_tunnels:
-            self.__generate_gateway_tunnel()
+        self.__generate_gateway_tunnel()
 
         for gat_ip, gat_port in self.gateway_tunnels:
             _gi.instance.uri_slot[0].uri.append(
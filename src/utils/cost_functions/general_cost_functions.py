@@ -1,8 +1,15 @@
+from docker.errors import DockerException, ImageNotFound
+from requests.exceptions import RequestException
+
+from typing import Optional
+
 from protos import celaut_pb2 as celaut, gateway_pb2
+from src.manager.usage_collector import UsageCollector, ServiceUsage
 from src.virtualizers.docker import build
 from src.virtualizers.docker.architecture import check_supported_architecture, UnsupportedArchitectureException
 from src.utils import logger as log
 from src.utils.env import DOCKER_CLIENT, EnvManager
+from src.utils.utils import to_gas_amount
 from src.utils.verify import get_service_hex_main_hash
 
 env_manager = EnvManager()
@@ -15,24 +22,15 @@ GAS_COST_FACTOR = env_manager.get_env("GAS_COST_FACTOR")
 
 
 def __is_service_built(service_hash: str) -> bool:
-    """Check if the service is built by comparing the service hash with existing Docker images."""
+    """Check if the service is built, looking up the image the builder tags with the service hash."""
     try:
-        # Get the list of images
-        images = DOCKER_CLIENT().images.list()
-        
-        # Check if images exist and process tags safely
-        for img in images:
-            try:
-                if img.tags and isinstance(img.tags[0], str):  # Validate tag structure
-                    # Extract the hash from the tag and check if it matches the service_hash
-                    if service_hash == img.tags[0].split('.')[0]:
-                        return True
-            except:
-                continue
-    except (IndexError, AttributeError) as e:
-        # Log the error, handle exceptions for missing attributes or invalid indexing
-        print(f"An error occurred while checking if service is built: {e}")
-    return False
+        DOCKER_CLIENT().images.get(service_hash + '.docker')
+        return True
+    except ImageNotFound:
+        return False
+    except (DockerException, RequestException) as e:
+        log.LOGGER(f"Can't check if the service {service_hash} is built, taken as not built: {e}")
+        return False
 
 
 def __build_cost(metadata: celaut.Metadata) -> int:
@@ -76,23 +74,100 @@ def __execution_cost(metadata: celaut.Metadata) -> int:
         raise e
 
 
+class CostModel:
+    """
+    Costs of a service on this node. The parts that don't depend on the resource clause (build state,
+    architecture support, execution load and the observed usage of the service) are computed once,
+    and every clause is evaluated against them.
+    """
+
+    def __init__(self, execution_cost: int, usage: Optional[ServiceUsage] = None):
+        self.execution_cost = execution_cost
+        self.usage = usage
+
+    def __observed_maintenance(self, resource: gateway_pb2.CombinationResources.Clause):
+        # The memory the service usually uses (one deviation around the mean), up to the limit of the clause.
+        limit: int = resource.max_sysreq.mem_limit if resource.HasField('max_sysreq') else 0
+        cost = lambda deviations: to_gas_amount(compute_maintenance_cost(
+            system_resources=celaut.Sysresources(mem_limit=_usage_memory(self.usage, limit, deviations))
+        ))
+        mean, std = self.usage.memory.mean, self.usage.memory.std
+        return cost(-1), cost(1), std / mean if mean else 0
+
+    def start_service_cost(self, initial_gas_amount: int, resource: gateway_pb2.CombinationResources.Clause) -> int:
+        return int(sum([
+            self.execution_cost * GAS_COST_FACTOR,
+            initial_gas_amount,
+            compute_maintenance_cost(system_resources=resource.min_sysreq)
+        ]))
+
+    def estimated_cost(
+            self,
+            initial_gas_amount: int,
+            resource: gateway_pb2.CombinationResources.Clause,
+            maintenance_seconds_loop: int,
+            clause_id: int
+    ) -> gateway_pb2.EstimatedCost:
+        if self.usage:
+            min_maintenance_cost, max_maintenance_cost, variance = self.__observed_maintenance(resource=resource)
+            return gateway_pb2.EstimatedCost(
+                cost=to_gas_amount(self.start_service_cost(initial_gas_amount=initial_gas_amount, resource=resource)),
+                min_maintenance_cost=min_maintenance_cost,
+                max_maintenance_cost=max_maintenance_cost,
+                maintenance_seconds_loop=maintenance_seconds_loop,
+                variance=variance,
+                comb_resource_selected=clause_id
+            )
+
+        # Without observations, the maintenance is estimated from the resources of the clause.
+        return gateway_pb2.EstimatedCost(
+            cost=to_gas_amount(self.start_service_cost(initial_gas_amount=initial_gas_amount, resource=resource)),
+            min_maintenance_cost=to_gas_amount(compute_maintenance_cost(
+                system_resources=resource.min_sysreq
+            )) if resource.HasField('min_sysreq') else to_gas_amount(gas_amount=0),
+            max_maintenance_cost=to_gas_amount(compute_maintenance_cost(
+                system_resources=resource.max_sysreq
+            )) if resource.HasField('max_sysreq') else to_gas_amount(gas_amount=0),
+            maintenance_seconds_loop=maintenance_seconds_loop,
+            variance=0,
+            comb_resource_selected=clause_id
+        )
+
+
+def cost_model(metadata: celaut.Metadata) -> CostModel:
+    # Raises UnsupportedArchitectureException if the service can't be built here.
+    return CostModel(
+        execution_cost=__execution_cost(metadata=metadata),
+        usage=UsageCollector().get(service_hash=get_service_hex_main_hash(metadata=metadata))
+    )
+
+
 def compute_start_service_cost(
         metadata: celaut.Metadata,
         initial_gas_amount: int,
         resource: gateway_pb2.CombinationResources.Clause
 ) -> int:
-    return int(sum([
-        __execution_cost(
-            metadata=metadata
-        ) * GAS_COST_FACTOR,
-        initial_gas_amount,
-        compute_maintenance_cost(system_resources=resource.min_sysreq)
-    ]))
+    return cost_model(metadata=metadata).start_service_cost(initial_gas_amount=initial_gas_amount, resource=resource)
 
 
 def compute_maintenance_cost(system_resources: celaut.Sysresources) -> int:
     return int(MEMORY_LIMIT_COST_FACTOR * system_resources.mem_limit)
 
 
+def _usage_memory(usage: ServiceUsage, limit: int, deviations: int = 0) -> int:
+    memory = max(usage.memory.mean + deviations * usage.memory.std, 0)
+    return int(min(memory, limit) if limit else memory)
+
+
+def compute_service_maintenance_cost(mem_limit: int, usage: Optional[ServiceUsage]) -> int:
+    """
+    Maintenance cost of a running service. Once its usage was observed, of the memory it usually uses up to
+    its limit (the figure its estimated cost is centered on), of its limit before.
+    """
+    return compute_maintenance_cost(system_resources=celaut.Sysresources(
+        mem_limit=_usage_memory(usage, mem_limit) if usage else mem_limit
+    ))
+
+
 def normalized_maintain_cost(cost, timelapse) -> int:
     return cost * timelapse
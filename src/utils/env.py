@@ -90,7 +90,8 @@ class EnvManager(metaclass=Singleton):
             "get_env", "PACKER_SUPPORTED_ARCHITECTURES", "SUPPORTED_ARCHITECTURES",
             "SHAKE_256_ID", "SHA3_256_ID", "SHAKE_256", "SHA3_256", "HASH_FUNCTIONS",
             "DOCKER_CLIENT", "DEFAULT_SYSTEM_RESOURCES", "DOCKER_COMMAND",
-            "STORAGE", "CACHE", "REGISTRY", "METADATA_REGISTRY", "BLOCKDIR",
+            "STORAGE", "CACHE", "REGISTRY", "METADATA_REGISTRY", "BLOCKDIR", "PACK_MANIFESTS",
+            "REGISTRY_STAGING",
             "DATABASE_FILE", "REPUTATION_DB"
         }
 
@@ -117,11 +118,26 @@ env_manager.get_env("CACHE", f"{env_manager.env_vars['STORAGE']}/__cache__/")
 env_manager.get_env("REGISTRY", f"{env_manager.env_vars['STORAGE']}/__registry__/")
 env_manager.get_env("METADATA_REGISTRY", f"{env_manager.env_vars['STORAGE']}/__metadata__/")
 env_manager.get_env("BLOCKDIR", f"{env_manager.env_vars['STORAGE']}/__block__/")
+env_manager.get_env("PACK_MANIFESTS", f"{env_manager.env_vars['STORAGE']}/__pack_manifests__/")
+env_manager.get_env("REGISTRY_STAGING", f"{env_manager.env_vars['STORAGE']}/__staging__/")
 env_manager.get_env("DATABASE_FILE", f'{env_manager.env_vars["STORAGE"]}/database.sqlite')
 
+# Block Store Settings
+env_manager.get_env("BLOCK_GC_GRACE_PERIOD", 3600)  # Seconds an unreferenced block is kept (in-flight downloads).
+env_manager.get_env("BLOCK_GC_BATCH_SIZE", 100)  # Block directory entries checked on each manager iteration.
+
+# Registry Cache Settings
+env_manager.get_env("METADATA_CACHE_SIZE", 256)  # Parsed metadata entries kept in memory.
+env_manager.get_env("SERVICE_HEADER_CACHE_SIZE", 16 * 1024 * 1024)  # Bytes of service headers kept in memory.
+env_manager.get_env("MMAP_CACHE_SIZE", 32)  # Registry and block files kept memory mapped.
+env_manager.get_env("GET_SERVICE_MMAP", False)  # Serve services from the memory mapped registry files.
+env_manager.get_env("GRPC_MAX_MESSAGE_LENGTH", 4 * 1024 * 1024)  # Max message length accepted by the peers.
+
 # Packer Settings
 env_manager.get_env("SAVE_ALL", False)
 env_manager.get_env("PACKER_MEMORY_SIZE_FACTOR", 2.0)
+env_manager.get_env("PACKER_WORKERS", os.cpu_count() or 1)  # Processes used to create the blocks.
+env_manager.get_env("INCREMENTAL_PACK", False)  # Use the docker build cache and reuse the blocks of the last pack.
 env_manager.get_env("ARM_PACKER_SUPPORT", True)
 env_manager.get_env("X86_PACKER_SUPPORT", True)
 PACKER_SUPPORTED_ARCHITECTURES = [
@@ -151,16 +167,55 @@ DOCKER_CLIENT = lambda: docker_lib.from_env(
 env_manager.get_env("CONCURRENT_CONTAINER_CREATIONS", 10)
 env_manager.get_env("REMOVE_CONTAINERS", True)
 env_manager.get_env("IGNORE_FATHER_NETWORK_ON_SERVICE_BALANCER", True)
+env_manager.get_env("PEER_PERFORMANCE_ALPHA", 0.2)  # Weight of each call on the peer latency and success averages.
+env_manager.get_env("PEER_PERFORMANCE_PERSIST_INTERVAL", 60)
+env_manager.get_env("PEER_MIN_SUCCESS_RATE", 0.5)  # Below it, the balancer skips the peer until the retry interval.
+env_manager.get_env("PEER_RETRY_INTERVAL", 300)
+env_manager.get_env("SERVICE_BALANCER_SAMPLE_SIZE", 5)  # Best ranked peers asked first, 0 to ask all the peers.
+env_manager.get_env("SERVICE_BALANCER_EXPLORATION", 2)  # Random peers asked along with the sample.
+env_manager.get_env("SERVICE_BALANCER_MIN_CANDIDATES", 3)  # Peers are asked until there are this many costs.
 
 # Network and Port Settings
 env_manager.get_env("GATEWAY_PORT", get_free_port())
 env_manager.get_env("NGROK_TUNNELS_KEY", "")
+env_manager.get_env("TUNNEL_BUFFER_SIZE", 256 * 1024)  # Socket buffers and maximum chunk of the service tunnel.
+env_manager.get_env("TUNNEL_QUEUE_SIZE", 16)  # Chunks read from the container waiting to be sent.
+env_manager.get_env("TUNNEL_MUX_WINDOW", 1024 * 1024)  # Flow control window of each multiplexed tunnel channel.
+env_manager.get_env("TUNNEL_IP_CACHE_TTL", 60)  # Seconds the container IP of a token is cached.
+env_manager.get_env("TUNNEL_CONNECT_TIMEOUT", 10)  # Seconds to connect a tunnel to the container.
+env_manager.get_env("LOCAL_TUNNELS_HOST", "")  # Host of the local reverse proxy tunnel provider, disabled if empty.
+env_manager.get_env("LOCAL_TUNNELS_MAX_INSTANCES", 100)
+env_manager.get_env("TUNNEL_POOL_SIZE", 2)  # Tunnels opened in advance by each provider.
+env_manager.get_env("TUNNEL_HEALTH_CHECK_INTERVAL", 60)
+env_manager.get_env("HTTP_CLIENT_TIMEOUT", 10)  # Seconds of each request to the ledger APIs.
+env_manager.get_env("HTTP_CLIENT_RETRIES", 2)  # Retries on each url, with exponential backoff.
+env_manager.get_env("HTTP_CLIENT_BACKOFF", 0.5)  # Seconds before the first retry.
+env_manager.get_env("HTTP_CLIENT_POOL_SIZE", 10)  # Connections kept alive per host.
+
+# Gateway Settings
+env_manager.get_env("GATEWAY_AIO", False)  # Serve the gateway with grpc.aio.
+env_manager.get_env("GATEWAY_CONTROL_WORKERS", 10)
+env_manager.get_env("GATEWAY_METERING_WORKERS", 10)
+env_manager.get_env("GATEWAY_HEAVY_WORKERS", 4)
+env_manager.get_env("GATEWAY_STREAMING_WORKERS", 500)  # Maximum concurrent streams of the aio gateway, a thread each.
+env_manager.get_env("GATEWAY_AIO_STREAM_BUFFER", 16)  # Messages buffered on each direction of an aio stream.
+env_manager.get_env("GATEWAY_ADMISSION_QUEUE", 50)  # Requests of each method class queued on the aio gateway executors.
+env_manager.get_env("GATEWAY_CLIENT_RATE", 20)  # Requests per second of each client.
+env_manager.get_env("GATEWAY_CLIENT_BURST", 100)
+env_manager.get_env("GATEWAY_SERVER_THREADS", 30)  # Threads of the (sync) gateway server, shared by the method classes.
+env_manager.get_env("DUPLICATE_GRABBER_TIMEOUT", 600)  # Seconds a request waits for the same work of another one, builds wait until they end.
+env_manager.get_env("DUPLICATE_GRABBER_MAX_SESSIONS", 1000)
 DOCKER_NETWORK = 'docker0'
 LOCAL_NETWORK = 'lo'
 
 # Ledger Settings
 env_manager.get_env("ERGO_NODE_URL", "https://node.sigmaspace.io")
 env_manager.get_env("ERGO_HTTP_PEERS", f'{env_manager.env_vars["STORAGE"]}/ergo_http_peers.json')
+env_manager.get_env("ERGO_HTTP_CACHE_TTL", 10)  # Seconds the balance and box queries are cached.
+env_manager.get_env("ERGO_PROBE_INTERVAL", 3600)  # Seconds between the probes of the Ergo nodes.
+env_manager.get_env("ERGO_PROBE_PARALLELISM", 10)  # Ergo nodes probed at the same time.
+env_manager.get_env("ERGO_PROBE_TIMEOUT", 5)
+env_manager.get_env("ERGO_PROBE_MAX_NODES", 200)  # Ergo nodes probed on each round.
 env_manager.get_env("ERGO_GENESIS_BLOCK_ID", "b0244dfc267baca974a4caee06120321562784303a8a688976ae56170e4d175b")
 env_manager.get_env("ERGO_WALLET_MNEMONIC", Mnemonic("english").generate(strength=128))
 env_manager.get_env("ERGO_AUXILIAR_MNEMONIC", Mnemonic("english").generate(strength=128))
@@ -175,16 +230,24 @@ env_manager.get_env("ERGO_DONATION_WALLET", "9gGZp7HRAFxgGWSwvS4hCbxM2RpkYr6pHvw
 env_manager.get_env("ERGO_DONATION_PERCENTAGE", "0.00")
 env_manager.get_env("SUBMIT_REPUTATION_AT_INIT", False)
 env_manager.get_env("SUBMIT_NETWORK_ADDRESS_TO_REPUTATION_PROOF", True)
+env_manager.get_env("REPUTATION_FLUSH_INTERVAL", 5)  # Seconds between the writes of the reputation events.
+env_manager.get_env("REPUTATION_BATCH_SIZE", 100)  # Pending reputation events that force a write.
+env_manager.get_env("REPUTATION_EVENTS_RETENTION", 7 * 24 * 3600)  # Seconds before the events are compacted.
+env_manager.get_env("REPUTATION_COMPACTION_INTERVAL", 3600)
 
 # Logging and Memory Settings
 env_manager.get_env("MEMORY_LOGS", False)
 env_manager.get_env("MEMORY_LIMIT_COST_FACTOR", 1 / pow(10, 6))
+env_manager.get_env("USAGE_SAMPLE_INTERVAL", 30)  # Seconds between the usage samples of the containers.
+env_manager.get_env("USAGE_STATS_ALPHA", 0.1)  # Weight of each new sample on the rolling usage statistics.
+env_manager.get_env("USAGE_MIN_SAMPLES", 5)  # Samples of a service before its usage drives the cost estimation.
 
 # Cost and Deposit Settings
 env_manager.get_env("DEFAULT_INITIAL_GAS_AMOUNT_FACTOR", 1 / pow(10, 6))
 env_manager.get_env("USE_DEFAULT_INITIAL_GAS_AMOUNT_FACTOR", False)
 env_manager.get_env("DEFAULT_INTIAL_GAS_AMOUNT", pow(10, 9))
 env_manager.get_env("TOTAL_REFILLED_DEPOSIT", pow(10, 65))
+env_manager.get_env("PEER_DEPOSIT_WORKERS", 10)  # Peer deposits paid at the same time.
 env_manager.get_env("MIN_DEPOSIT_PEER", pow(10, 64))
 env_manager.get_env("FREE_TRIAL_GAS_AMOUNT",  pow(10, 66))
 env_manager.get_env("INITIAL_PEER_DEPOSIT_FACTOR", 0.5)
@@ -0,0 +1,111 @@
+import threading
+from time import sleep, time
+from typing import Dict, Iterable, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from src.utils.logger import LOGGER as log
+from src.utils.singleton import Singleton
+from src.utils.env import EnvManager
+
+env_manager = EnvManager()
+
+HTTP_CLIENT_TIMEOUT = float(env_manager.get_env("HTTP_CLIENT_TIMEOUT"))
+HTTP_CLIENT_RETRIES = int(env_manager.get_env("HTTP_CLIENT_RETRIES"))
+HTTP_CLIENT_BACKOFF = float(env_manager.get_env("HTTP_CLIENT_BACKOFF"))
+HTTP_CLIENT_POOL_SIZE = int(env_manager.get_env("HTTP_CLIENT_POOL_SIZE"))
+
+"""
+Shared HTTP client for the ledger APIs (Ergo nodes and explorer).
+
+A single pooled session keeps the connections alive between calls. Every request has a timeout and is retried,
+with exponential backoff, on connection errors and server errors. When several base urls are given (the Ergo node
+and its known peers) the request fails over to the next one once the retries on the previous are exhausted.
+Successful responses can be cached for a few seconds (balance and box queries).
+"""
+
+
+def _retryable(response: requests.Response) -> bool:
+    return response.status_code >= 500 or response.status_code == 429
+
+
+class HttpClient(metaclass=Singleton):
+
+    def __init__(self):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=HTTP_CLIENT_POOL_SIZE, pool_maxsize=HTTP_CLIENT_POOL_SIZE)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.lock = threading.Lock()
+        # (path, params, base urls) -> (expires at, response)
+        self.cache: Dict[Tuple[str, Tuple, Tuple], Tuple[float, requests.Response]] = {}
+
+    def __cached(self, key: Tuple[str, Tuple, Tuple]) -> Optional[requests.Response]:
+        with self.lock:
+            entry = self.cache.get(key)
+            if entry and entry[0] > time():
+                return entry[1]
+            self.cache.pop(key, None)
+            return None
+
+    def __store(self, key: Tuple[str, Tuple, Tuple], response: requests.Response, cache_ttl: float):
+        with self.lock:
+            now = time()
+            for _key in [_key for _key, (expires, _) in self.cache.items() if expires <= now]:
+                del self.cache[_key]
+            self.cache[key] = (now + cache_ttl, response)
+
+    def get(
+            self,
+            path: str,
+            base_urls: Iterable[str] = ("",),
+            params: Optional[Dict] = None,
+            timeout: float = HTTP_CLIENT_TIMEOUT,
+            cache_ttl: float = 0,
+            retries: int = HTTP_CLIENT_RETRIES
+    ) -> requests.Response:
+        """
+        GET base_url + path, on each base url in order until one answers without a server error.
+        Each base url is retried up to retries times, with exponential backoff.
+
+        Returns the response of the first base url that answered (the last one if all of them failed
+        with a server error). Raises the last requests.RequestException if none of them could be reached.
+        """
+        base_urls = tuple(base_urls)
+        key = (path, tuple(sorted(params.items())) if params else (), base_urls)
+        if cache_ttl:
+            cached = self.__cached(key=key)
+            if cached is not None:
+                return cached
+
+        response: Optional[requests.Response] = None
+        error: Optional[requests.RequestException] = None
+        for base_url in base_urls:
+            url = base_url.rstrip('/') + path if base_url else path
+            for attempt in range(retries + 1):
+                if attempt:
+                    sleep(HTTP_CLIENT_BACKOFF * pow(2, attempt - 1))
+                try:
+                    response = self.session.get(url, params=params, timeout=timeout)
+                except requests.RequestException as e:
+                    error = e
+                    continue
+                if not _retryable(response):
+                    if cache_ttl and response.status_code == 200:
+                        self.__store(key=key, response=response, cache_ttl=cache_ttl)
+                    return response
+            log(f"HTTP client: {url} failed after {retries + 1} attempts, "
+                f"{error if response is None else response.status_code}.")
+
+        if response is not None:
+            return response
+        raise error or requests.RequestException(f"No url to request {path}")
+
+    def invalidate(self, path: str):
+        """
+        Drops the cached responses of the path, for any params and base urls.
+        """
+        with self.lock:
+            for key in [key for key in self.cache if key[0] == path]:
+                del self.cache[key]
@@ -1,81 +1,128 @@
-import codecs
+from collections import OrderedDict
 from time import time
-from typing import Any, Dict, Generator, List, Tuple, Union
-from uuid import uuid4
+from typing import Any, Callable, Dict, Generator, Iterable, List, Optional, Tuple
 from threading import Event, Lock
 
 from src.utils.singleton import Singleton
 from src.utils import logger as log
+from src.utils.env import EnvManager
 
 from protos import celaut_pb2 as celaut
 
+env_manager = EnvManager()
+
+DUPLICATE_GRABBER_TIMEOUT = int(env_manager.get_env("DUPLICATE_GRABBER_TIMEOUT"))
+DUPLICATE_GRABBER_MAX_SESSIONS = int(env_manager.get_env("DUPLICATE_GRABBER_MAX_SESSIONS"))
+
+"""
+Single flight of the work done for a service (fetch, store, build, cost ...).
+
+The first request for some keys runs the work, the concurrent requests for any of those keys wait for it
+and get its result, or its exception. Sessions are removed from the index once they end, so only the
+in-flight work is kept in memory, and new requests after that run the work again.
+
+Work with a timeout is forgotten once it's in flight for longer, and its waiters fail with TimeoutError.
+Work without it (builds, that can take long on large images) is waited for until it ends.
+"""
+
 
 class Session:
 
-    def __init__(self) -> None:
+    def __init__(self, keys: List[str], timeout: Optional[float]) -> None:
+        self.keys: List[str] = keys
+        self.timeout: Optional[float] = timeout
         self.event: Event = Event()
-        self.value: List = []
-        self.end_time = None
+        self.value: Any = None
+        self.error: Optional[BaseException] = None
+        self.start_time: float = time()
+        self.end_time: Optional[float] = None
 
-    def wait(self):
-        self.event.wait()
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self.event.wait(timeout)
 
-    def set(self):
-        self.event.set()
+    def set(self, value: Any = None, error: Optional[BaseException] = None):
+        self.value, self.error = value, error
         self.end_time = time()
+        self.event.set()
+
+    def result(self) -> Any:
+        if self.error:
+            raise self.error
+        return self.value
+
+
+def hash_keys(hashes: Iterable[celaut.Metadata.HashTag.Hash]) -> List[str]:
+    return [hash_element.type.hex() + ':' + hash_element.value.hex() for hash_element in hashes]
 
 
 class DuplicateGrabber(metaclass=Singleton):
 
     def __init__(self):
-        self.hashes: Dict[str, str] = {}  # HASH : SESSION
-        self.sessions: Dict[str: Session] = {}
+        self.hashes: Dict[str, Session] = {}  # KEY : SESSION
+        self.sessions: OrderedDict = OrderedDict()  # SESSION : None, in flight, by start time.
         self.lock = Lock()
 
-    def manager(self, completion_time: float = 1):
-        for session, session_obj in list(self.sessions.items()):
-            end_time: float = session_obj.end_time
-            if end_time and time() - end_time > completion_time:
-                del self.sessions[session]
-                for _hash, value in list(self.hashes.items()):
-                    if value == session:
-                        del self.hashes[_hash]
+    def manager(self):
+        """
+        Forgets the sessions in flight for longer than their timeout, the next requests run the work again.
+        """
+        with self.lock:
+            now = time()
+            for session in [s for s in self.sessions if s.timeout is not None and now - s.start_time >= s.timeout]:
+                log.LOGGER(f"Duplicate grabber: session {session.keys[0]} expired.")
+                self.__remove(session)
+
+    def __remove(self, session: Session):
+        self.sessions.pop(session, None)
+        for key in session.keys:
+            if self.hashes.get(key) is session:
+                del self.hashes[key]
+
+    def run(self,
+            keys: List[str],
+            function: Callable[[], Any],
+            scope: str = '',
+            timeout: Optional[float] = DUPLICATE_GRABBER_TIMEOUT
+            ) -> Tuple[Any, bool]:
+        """
+        Runs the function once for all the concurrent requests that share any of the keys on the scope.
+
+        Returns the result and if this request was the one that ran it.
+        Raises the exception of the function, or TimeoutError if it doesn't end on time (None waits until it ends).
+        """
+        keys = [scope + ':' + key for key in keys]
+        with self.lock:
+            session: Optional[Session] = next((self.hashes[key] for key in keys if key in self.hashes), None)
+            owner: bool = session is None and len(self.sessions) < DUPLICATE_GRABBER_MAX_SESSIONS
+            if owner and keys:
+                session = Session(keys=keys, timeout=timeout)
+                self.sessions[session] = None
+                for key in keys:
+                    self.hashes[key] = session
+
+        if not session:
+            if keys:
+                log.LOGGER(f"Duplicate grabber: too many sessions, {keys[0]} runs without coalescing.")
+            return function(), True
+
+        if not owner:
+            log.LOGGER(f"Duplicate grabber: {keys[0]} is already in flight, waiting for it to end.")
+            if not session.wait(timeout):
+                raise TimeoutError(f"{keys[0]} didn't end in {timeout} seconds.")
+            return session.result(), False
+
+        try:
+            session.set(value=function())
+        except BaseException as e:
+            session.set(error=e)
+            raise e
+        finally:
+            with self.lock:
+                self.__remove(session)
+        return session.value, True
 
     def next(self,
              hashes: List[celaut.Metadata.HashTag.Hash],
              generator: Generator
-             ) -> Tuple[Union[Any, str], bool]:
-
-        # hash.type.decode('utf-8')+':'+hash.value.decode('utf-8')  
-        #  UnicodeDecodeError: 'utf-8' codec can't decode byte 0xa7 in position 0: invalid start byte
-        def decode(element: bytes) -> str: return codecs.encode(element, 'hex').decode('utf-8')
-        hashes: List[str] = [decode(hash_element.type) + ':' + decode(hash_element.value) for hash_element in hashes]
-        wait: bool = False
-
-        with self.lock:
-            for hash_element in hashes:
-                if hash_element in self.hashes.keys():
-                    session = self.hashes[hash_element]
-                    if session not in self.sessions:
-                        log.LOGGER(f"The session {session} is not in the registry, maybe was once time.")
-                    wait = True
-                    break
-
-            if not wait:
-                session = uuid4().hex
-                for hash_element in hashes:
-                    self.hashes[hash_element] = session
-                self.sessions[session] = Session()
-
-        if wait:
-            if self.sessions[session].end_time:
-                return self.sessions[session].value, False
-            log.LOGGER('It is already downloading. waiting for it to end. ' + session)
-            self.sessions[session].wait()
-            return self.sessions[session].value, False
-
-        else:
-            log.LOGGER('Start download ' + session)
-            self.sessions[session].value = next(generator)
-            self.sessions[session].set()
-            return self.sessions[session].value, True
+             ) -> Tuple[Any, bool]:
+        return self.run(keys=hash_keys(hashes), function=lambda: next(generator))
@@ -0,0 +1,78 @@
+import mmap
+import os
+from collections import OrderedDict
+from threading import Lock
+from typing import Generator, Tuple
+
+from src.utils.singleton import Singleton
+from src.utils.env import EnvManager
+
+env_manager = EnvManager()
+
+MMAP_CACHE_SIZE = int(env_manager.get_env("MMAP_CACHE_SIZE"))
+
+"""
+LRU of read only memory maps of registry and block files.
+
+The maps are shared, so the same pages serve every reader without copying them into Python bytes.
+Entries are validated against the inode, size and modification time of the file.
+"""
+
+
+class MappedFiles(metaclass=Singleton):
+
+    def __init__(self):
+        self.lock = Lock()
+        self.maps: OrderedDict = OrderedDict()  # path -> (version, mmap)
+
+    @staticmethod
+    def __version(stat: os.stat_result) -> Tuple[int, int, int]:
+        return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+    def get(self, path: str) -> memoryview:
+        """
+        Returns a read only view of the whole file.
+        """
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            if not stat.st_size:
+                return memoryview(b'')  # Empty files can't be mapped.
+
+            version = self.__version(stat)
+            with self.lock:
+                entry = self.maps.get(path)
+                if entry and entry[0] == version:
+                    self.maps.move_to_end(path)
+                    return memoryview(entry[1])
+
+            _map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        with self.lock:
+            self.__remove(path)
+            self.maps[path] = (version, _map)
+            while len(self.maps) > MMAP_CACHE_SIZE:
+                self.__remove(next(iter(self.maps)))
+        return memoryview(_map)
+
+    def chunks(self, path: str, chunk_size: int) -> Generator[memoryview, None, None]:
+        """
+        Slices of the mapped file, without reading it.
+        """
+        view = self.get(path)
+        try:
+            for position in range(0, len(view), chunk_size):
+                yield view[position:position + chunk_size]
+        finally:
+            view.release()
+
+    def invalidate(self, path: str):
+        with self.lock:
+            self.__remove(path)
+
+    def __remove(self, path: str):
+        entry = self.maps.pop(path, None)
+        if entry:
+            try:
+                entry[1].close()
+            except BufferError:
+                pass  # Still used by some reader, it's closed once the last view is released.
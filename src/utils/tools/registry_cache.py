@@ -0,0 +1,131 @@
+import os
+from collections import OrderedDict
+from threading import Lock
+from typing import Callable, Optional, Tuple
+
+from bee_rpc.block_driver import WITHOUT_BLOCK_POINTERS_FILE_NAME
+
+from protos import celaut_pb2 as celaut
+from src.utils import logger as log
+from src.utils.singleton import Singleton
+from src.utils.env import EnvManager
+
+env_manager = EnvManager()
+
+REGISTRY = env_manager.get_env("REGISTRY")
+METADATA_REGISTRY = env_manager.get_env("METADATA_REGISTRY")
+METADATA_CACHE_SIZE = int(env_manager.get_env("METADATA_CACHE_SIZE"))
+SERVICE_HEADER_CACHE_SIZE = int(env_manager.get_env("SERVICE_HEADER_CACHE_SIZE"))
+
+"""
+In memory cache of the parsed registry messages.
+
+The metadata and the service headers (the service without its container filesystem) are parsed once
+and kept on an LRU, validated against the modification time and size of the file on disk.
+
+Cached messages are shared between requests, so they must be treated as read only
+(merge or copy them into a new message before modifying).
+"""
+
+
+def _file_version(filename: str) -> Optional[Tuple[int, int]]:
+    try:
+        stat = os.stat(filename)
+        return stat.st_mtime_ns, stat.st_size
+    except FileNotFoundError:
+        return None
+
+
+def _service_filename(service_hash: str) -> str:
+    filename: str = os.path.join(REGISTRY, service_hash)
+    if os.path.isdir(filename):
+        filename = os.path.join(filename, WITHOUT_BLOCK_POINTERS_FILE_NAME)
+    return filename
+
+
+class _LRU:
+
+    def __init__(self, max_size: int, sizeof: Callable[[object], int]):
+        self.max_size = max_size
+        self.sizeof = sizeof
+        self.size = 0
+        self.lock = Lock()
+        self.entries: OrderedDict = OrderedDict()  # key -> (version, value, size)
+
+    def get(self, key: str, version: Tuple[int, int]):
+        with self.lock:
+            entry = self.entries.get(key)
+            if not entry:
+                return None
+            if entry[0] != version:
+                self.__remove(key)
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key: str, version: Tuple[int, int], value):
+        size = self.sizeof(value)
+        if size > self.max_size:
+            return
+        with self.lock:
+            self.__remove(key)
+            self.entries[key] = (version, value, size)
+            self.size += size
+            while self.size > self.max_size:
+                self.__remove(next(iter(self.entries)))
+
+    def remove(self, key: str):
+        with self.lock:
+            self.__remove(key)
+
+    def __remove(self, key: str):
+        entry = self.entries.pop(key, None)
+        if entry:
+            self.size -= entry[2]
+
+
+class RegistryCache(metaclass=Singleton):
+
+    def __init__(self):
+        # The metadata cache is bounded by number of entries, the headers by their serialized size.
+        self.metadata = _LRU(max_size=METADATA_CACHE_SIZE, sizeof=lambda _: 1)
+        self.service_headers = _LRU(max_size=SERVICE_HEADER_CACHE_SIZE, sizeof=lambda s: s.ByteSize())
+
+    def get_metadata(self, service_hash: str) -> Optional[celaut.Metadata]:
+        filename: str = os.path.join(METADATA_REGISTRY, service_hash)
+        version = _file_version(filename)
+        if not version:
+            self.metadata.remove(service_hash)
+            return None
+
+        metadata = self.metadata.get(service_hash, version)
+        if metadata is None:
+            metadata = celaut.Metadata()
+            with open(filename, 'rb') as f:
+                metadata.ParseFromString(f.read())
+            self.metadata.put(service_hash, version, metadata)
+        return metadata
+
+    def get_service_header(self, service_hash: str) -> Optional[celaut.Service]:
+        return self.service_headers.get(service_hash, _file_version(_service_filename(service_hash)))
+
+    def put_service(self, service_hash: str, service: celaut.Service):
+        """
+        Keeps the header of a service already loaded from the registry.
+        """
+        version = _file_version(_service_filename(service_hash))
+        if not version:
+            return
+        # Copy every field but the filesystem, the only one that could be big.
+        header = celaut.Service(prose=service.prose, api=service.api, network=service.network)
+        header.container.architecture.CopyFrom(service.container.architecture)
+        header.container.enviroment_variables.MergeFrom(service.container.enviroment_variables)
+        header.container.entrypoint.extend(service.container.entrypoint)
+        header.container.config.CopyFrom(service.container.config)
+        header.container.node_protocol_stack.extend(service.container.node_protocol_stack)
+        self.service_headers.put(service_hash, version, header)
+
+    def invalidate(self, service_hash: str):
+        log.LOGGER(f"Registry cache: invalidate {service_hash}.")
+        self.metadata.remove(service_hash)
+        self.service_headers.remove(service_hash)
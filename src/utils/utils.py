@@ -10,8 +10,10 @@ from bee_rpc.client import Dir
 from protos import celaut_pb2 as celaut
 from protos import gateway_pb2
 from src.database.access_functions.peers import get_peer_ids, get_peer_directions
-from src.manager.resources_manager import mem_manager
+from src.manager.resources_manager import mem_manager, MemoryRequestTooBig
 from src.utils import logger as log
+from src.utils.tools.mapped_files import MappedFiles
+from src.utils.tools.registry_cache import RegistryCache
 from src.utils.verify import get_service_hex_main_hash
 from src.utils.env import EnvManager
 
@@ -55,27 +57,38 @@ def read_service_from_disk(service_hash: str) -> Optional[celaut.Service]:
     if os.path.isdir(filename):
         filename = filename + '/' + WITHOUT_BLOCK_POINTERS_FILE_NAME
     try:
+        # The file is memory mapped, but the parser copies the mapped buffer into bytes and the parsed
+        #  service copies its fields again, so the peak is still twice the file.
         mem_size = 2 * os.path.getsize(filename)
         log.LOGGER(f"Wait to unlock memory {mem_size}")
-        with mem_manager(2 * os.path.getsize(filename)) as iolock:
+        with mem_manager(mem_size) as iolock:
             service = celaut.Service()
-            service.ParseFromString(read_file(filename=filename))
+            service.ParseFromString(MappedFiles().get(path=filename))
             log.LOGGER(f"Service {service_hash} loaded.")
+            RegistryCache().put_service(service_hash=service_hash, service=service)
             return service
     except (IOError, FileNotFoundError):
         log.LOGGER('The service was not on registry.')
         return None
+    except MemoryRequestTooBig as e:
+        log.LOGGER(f'The service {service_hash} can not be loaded. {e}')
+        return None
 
 
-def read_metadata_from_disk(service_hash: str) -> Optional[celaut.Metadata]:
-    filename: str = os.path.join(METADATA_REGISTRY, service_hash)
-    if not os.path.exists(filename):
-        return None
+def read_service_header_from_disk(service_hash: str) -> Optional[celaut.Service]:
+    # The service without the container filesystem, read only (shared by the registry cache).
+    header = RegistryCache().get_service_header(service_hash=service_hash)
+    if header is not None:
+        return header
 
+    service = read_service_from_disk(service_hash=service_hash)
+    return RegistryCache().get_service_header(service_hash=service_hash) if service else None
+
+
+def read_metadata_from_disk(service_hash: str) -> Optional[celaut.Metadata]:
+    # Read only, the parsed metadata is shared by the registry cache.
     try:
-        metadata = celaut.Metadata()
-        metadata.ParseFromString(read_file(filename=filename))
-        return metadata
+        return RegistryCache().get_metadata(service_hash=service_hash)
     except (IOError, FileNotFoundError):
         log.LOGGER('The metadata was not on registry.')
         return None
@@ -219,11 +232,14 @@ def from_gas_amount(gas_amount: gateway_pb2.GasAmount) -> int:
     return int(gas_amount.n)
 
 
-def peers_id_iterator(ignore_network: str = None) -> Generator[str, None, None]:
+def peers_id_iterator(
+        ignore_network: str = None,
+        peer_ids: Optional[typing.Iterable[str]] = None  # All the peers, if not given.
+) -> Generator[str, None, None]:
     if ignore_network == "localhost":
         ignore_network = None
     yield from (
-        peer_id for peer_id in get_peer_ids()
+        peer_id for peer_id in (get_peer_ids() if peer_ids is None else peer_ids)
         if not ignore_network or all(
         not __address_in_network(
             ip_or_uri=uri,
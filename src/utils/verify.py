@@ -1,27 +1,45 @@
 import hashlib
-from typing import Generator, List
+from typing import Generator, Iterable, List
 
 from src.utils.env import SHA3_256_ID, SHA3_256, SHAKE_256_ID, SHAKE_256
 from protos.celaut_pb2 import Metadata
 
 
+class StreamHasher:
+    # Computes all the supported hashes at once, while the data is being received or written.
+
+    def __init__(self):
+        self.sha3_256 = hashlib.sha3_256()
+        self.shake_256 = hashlib.shake_256()
+
+    def update(self, chunk):
+        self.sha3_256.update(chunk)
+        self.shake_256.update(chunk)
+
+    def hashes(self) -> List[Metadata.HashTag.Hash]:
+        return [
+            Metadata.HashTag.Hash(
+                type=SHA3_256_ID,
+                value=self.sha3_256.digest()
+            ),
+            Metadata.HashTag.Hash(
+                type=SHAKE_256_ID,
+                value=self.shake_256.digest(32)
+            )
+        ]
+
+
 def calculate_hashes_by_stream(value: Generator[bytes, None, None]) -> List[Metadata.HashTag.Hash]:
-    sha3_256 = hashlib.sha3_256()
-    shake_256 = hashlib.shake_256()
+    hasher = StreamHasher()
     for chunk in value:
-        sha3_256.update(chunk)
-        shake_256.update(chunk)
+        hasher.update(chunk)
+    return hasher.hashes()
 
-    return [
-        Metadata.HashTag.Hash(
-            type=SHA3_256_ID,
-            value=sha3_256.digest()
-        ),
-        Metadata.HashTag.Hash(
-            type=SHAKE_256_ID,
-            value=shake_256.digest(32)
-        )
-    ]
+
+def hashes_match(computed: Iterable[Metadata.HashTag.Hash], expected: Iterable[Metadata.HashTag.Hash]) -> bool:
+    # Only the hash types that were computed can be checked.
+    computed = {h.type: h.value for h in computed}
+    return all(computed[h.type] == h.value for h in expected if h.type in computed)
 
 
 def calculate_hashes(value: bytes) -> List[Metadata.HashTag.Hash]:
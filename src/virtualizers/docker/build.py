@@ -4,24 +4,24 @@ import os
 from pathlib import Path
 
 import src.manager.resources_manager as resources_manager
-import threading
 from shutil import rmtree
 from subprocess import check_output, CalledProcessError
-from time import sleep, time
-from typing import Tuple, Optional, Set
+from time import time
+from typing import Tuple, Optional
 
 from bee_rpc.client import copy_block_if_exists
 
 import src.utils.logger as l
 from protos import celaut_pb2, gateway_pb2
 from src.utils.env import DOCKER_COMMAND, EnvManager
+from src.utils.tools.duplicate_grabber import DuplicateGrabber
+from src.utils.utils import read_service_from_disk
 from src.utils.verify import get_service_hex_main_hash
 from src.virtualizers.docker.architecture import UnsupportedArchitectureException, get_arch_tag, check_supported_architecture
 
 env_manager = EnvManager()
 
 BUILD_CONTAINER_MEMORY_SIZE_FACTOR = env_manager.get_env("BUILD_CONTAINER_MEMORY_SIZE_FACTOR")
-WAIT_FOR_CONTAINER = int(env_manager.get_env("WAIT_FOR_CONTAINER"))
 BLOCKDIR = env_manager.get_env("BLOCKDIR")
 CACHE = env_manager.get_env("CACHE")
 REGISTRY = env_manager.get_env("REGISTRY")
@@ -36,8 +36,6 @@ class WaitBuildException(Exception):
         return "Getting the container, the process will've time"
 
 
-actual_building_processes_lock = threading.Lock()
-actual_building_processes: Set[str] = set()  # list of hexadecimal string sha256 value hashes.
 
 
 def build_container_from_definition(service: celaut_pb2.Service,
@@ -93,7 +91,6 @@ def build_container_from_definition(service: celaut_pb2.Service,
                 biggest_block_size
             ]) * BUILD_CONTAINER_MEMORY_SIZE_FACTOR
     ):
-        # TODO si el coste es mayor a la cantidad total se quedará esperando indefinidamente.
         l.LOGGER('Build process of ' + service_id + ': go to load all the buffer.')
         l.LOGGER('Build process of ' + service_id + ': filesystem load in memory.')
 
@@ -156,9 +153,6 @@ def build_container_from_definition(service: celaut_pb2.Service,
         check_output(F'{DOCKER_COMMAND} rmi ' + cache_id, shell=True)
         l.LOGGER('Build process of ' + service_id + ': finished.')
 
-        with actual_building_processes_lock:
-            actual_building_processes.remove(service_id)
-
 
 def build(
         service: celaut_pb2.Service,
@@ -182,15 +176,15 @@ def build(
             return service_id
 
         except CalledProcessError:
-            if service_id in actual_building_processes:
-                sleep(WAIT_FOR_CONTAINER)
-                continue
-
-            with actual_building_processes_lock:
-                actual_building_processes.add(service_id)
+            def __build():
+                # Only the service header could have been provided, load the filesystem from the registry.
+                build_container_from_definition(
+                    service=service if service.container.filesystem
+                        else read_service_from_disk(service_hash=service_id) or service,
+                    metadata=metadata,
+                    service_id=service_id
+                )
 
-            build_container_from_definition(
-                service=service,
-                metadata=metadata,
-                service_id=service_id
-            )
+            # Concurrent requests of the same service wait for a single build, and get its exception if it fails.
+            #  Builds of large images can take long, so they wait without a timeout.
+            DuplicateGrabber().run(keys=[service_id], function=__build, scope='build', timeout=None)
@@ -0,0 +1,240 @@
+import os
+import socket
+import sys
+import threading
+from concurrent import futures
+from time import perf_counter
+from typing import Callable, Dict, Generator, List
+
+import grpc
+from bee_rpc.client import client_grpc
+
+from protos import celaut_pb2, gateway_pb2, gateway_pb2_grpc, gateway_pb2_bee
+from src.gateway.admission import AdmissionInterceptor, MAX_SERVER_THREADS
+from src.gateway.gateway import Gateway
+from src.tunneling_system import rpc_tunnel
+from src.utils.env import SHA3_256_ID, EnvManager
+
+env_manager = EnvManager()
+
+REGISTRY = env_manager.get_env("REGISTRY")
+METADATA_REGISTRY = env_manager.get_env("METADATA_REGISTRY")
+
+"""
+Throughput benchmark of the streaming paths.
+
+Starts the gateway in-process on a loopback port and a TCP echo server standing in for a container, and drives
+ServiceTunnel, GetMetrics and GetServiceEstimatedCost from concurrent clients. The tunnel token resolves to the
+echo server.
+
+    python nodo.py test test_benchmark concurrency=8 requests=100 size=65536 service=<service hash>
+
+The estimated cost benchmark needs a service on the registry (the first one is used if not given).
+The admission limits of the gateway (GATEWAY_CLIENT_RATE ...) apply, rejected requests are counted as errors.
+"""
+
+ECHO_TOKEN = "benchmark-echo"
+
+
+class _Result:
+
+    def __init__(self, name: str):
+        self.name = name
+        self.latencies: List[float] = []
+        self.bytes = 0
+        self.errors = 0
+        self.elapsed = 0.0
+        self.lock = threading.Lock()
+
+    def add(self, latency: float, _bytes: int = 0):
+        with self.lock:
+            self.latencies.append(latency)
+            self.bytes += _bytes
+
+    def error(self):
+        with self.lock:
+            self.errors += 1
+
+    def __percentile(self, p: float) -> float:
+        latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000 if latencies else 0
+
+    def __str__(self):
+        return f"{self.name:<24}{len(self.latencies):>8}{self.errors:>8}" \
+               f"{len(self.latencies) / self.elapsed:>10.1f}{self.bytes / self.elapsed / pow(2, 20):>10.2f}" \
+               f"{self.__percentile(0.5):>10.2f}{self.__percentile(0.9):>10.2f}" \
+               f"{self.__percentile(0.99):>10.2f}{self.__percentile(1):>10.2f}"
+
+
+def __echo_server() -> int:
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(("127.0.0.1", 0))
+    server.listen(128)
+
+    def echo(conn: socket.socket):
+        with conn:
+            buffer = bytearray(256 * 1024)
+            while True:
+                read = conn.recv_into(buffer)
+                if not read:
+                    return
+                conn.sendall(memoryview(buffer)[:read])
+
+    def accept():
+        while True:
+            conn, _ = server.accept()
+            threading.Thread(target=echo, args=(conn,), daemon=True).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+    return server.getsockname()[1]
+
+
+def __gateway() -> str:
+    server = grpc.server(
+        futures.ThreadPoolExecutor(max_workers=MAX_SERVER_THREADS),
+        interceptors=[AdmissionInterceptor()]
+    )
+    gateway_pb2_grpc.add_GatewayServicer_to_server(Gateway(), server=server)
+    port = server.add_insecure_port("127.0.0.1:0")
+    server.start()
+    return f"127.0.0.1:{port}"
+
+
+def __run(name: str, concurrency: int, requests: int, request: Callable[[_Result], None]) -> _Result:
+    result = _Result(name=name)
+
+    def client():
+        for _ in range(requests):
+            try:
+                request(result)
+            except Exception as e:
+                print(f"{name}: {e}")
+                result.error()
+
+    start = perf_counter()
+    with futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for _ in range(concurrency):
+            executor.submit(client)
+    result.elapsed = perf_counter() - start
+    return result
+
+
+def __resolve_echo_token():
+    get_container_ip = rpc_tunnel.get_container_ip
+    rpc_tunnel.get_container_ip = lambda token: "127.0.0.1" if token == ECHO_TOKEN else get_container_ip(token)
+
+
+def __tunnel(gateway: str, echo_port: int, size: int, messages: int) -> Callable[[_Result], None]:
+    stub = gateway_pb2_grpc.GatewayStub(grpc.insecure_channel(gateway))
+    payload = os.urandom(size)
+
+    def request(result: _Result):
+        # Each message is sent once the echo of the previous one arrived, to measure the round trip.
+        echoed = threading.Event()
+        sent_at: List[float] = []
+
+        def stream() -> Generator:
+            yield gateway_pb2.TokenMessage(token=ECHO_TOKEN, slot=str(echo_port))
+            for _ in range(messages):
+                echoed.clear()
+                sent_at.append(perf_counter())
+                yield payload
+                echoed.wait()
+
+        received = 0
+        for chunk in client_grpc(
+            method=stub.ServiceTunnel,
+            input=stream(),
+            indices_serializer={0: bytes, 1: gateway_pb2.TokenMessage},
+            indices_parser={0: bytes},
+            partitions_message_mode_parser={0: True}
+        ):
+            received += len(chunk)
+            if received >= size:
+                received -= size
+                result.add(latency=perf_counter() - sent_at[-1], _bytes=2 * size)
+                echoed.set()
+
+    return request
+
+
+def __metrics(gateway: str) -> Callable[[_Result], None]:
+    stub = gateway_pb2_grpc.GatewayStub(grpc.insecure_channel(gateway))
+
+    def request(result: _Result):
+        start = perf_counter()
+        next(client_grpc(
+            method=stub.GetMetrics,
+            input=gateway_pb2.TokenMessage(token="dev"),
+            indices_parser=gateway_pb2.Metrics,
+            partitions_message_mode_parser=True,
+            indices_serializer=gateway_pb2.TokenMessage
+        ))
+        result.add(latency=perf_counter() - start)
+
+    return request
+
+
+def __estimated_cost(gateway: str, service: str) -> Callable[[_Result], None]:
+    stub = gateway_pb2_grpc.GatewayStub(grpc.insecure_channel(gateway))
+
+    def service_extended():
+        yield gateway_pb2.Client(client_id="dev")
+        yield gateway_pb2.Configuration(
+            config=celaut_pb2.Configuration(),
+            resources=gateway_pb2.CombinationResources(
+                clause={
+                    1: gateway_pb2.CombinationResources.Clause(
+                        cost_weight=1,
+                        min_sysreq=celaut_pb2.Sysresources(mem_limit=50 * pow(10, 6))
+                    )
+                }
+            )
+        )
+        yield celaut_pb2.Metadata.HashTag.Hash(type=SHA3_256_ID, value=bytes.fromhex(service))
+
+    def request(result: _Result):
+        start = perf_counter()
+        next(client_grpc(
+            method=stub.GetServiceEstimatedCost,
+            input=service_extended(),
+            indices_parser=gateway_pb2.EstimatedCost,
+            partitions_message_mode_parser=True,
+            indices_serializer=gateway_pb2_bee.StartService_input_indices
+        ))
+        result.add(latency=perf_counter() - start)
+
+    return request
+
+
+def test_benchmark():
+    params: Dict[str, str] = dict(arg.split("=", 1) for arg in sys.argv[3:] if "=" in arg)
+    concurrency = int(params.get("concurrency", 8))
+    requests = int(params.get("requests", 100))
+    size = int(params.get("size", 64 * 1024))
+    service = params.get("service") or next(
+        (s for s in sorted(os.listdir(REGISTRY)) if os.path.exists(METADATA_REGISTRY + s)), None
+    )
+
+    echo_port = __echo_server()
+    __resolve_echo_token()
+    gateway = __gateway()
+    print(f"Gateway on {gateway}, echo server on {echo_port}. "
+          f"{concurrency} clients, {requests} requests each, {size} bytes per tunnel message.\n")
+
+    results = [
+        __run(name="ServiceTunnel", concurrency=concurrency, requests=1,
+              request=__tunnel(gateway=gateway, echo_port=echo_port, size=size, messages=requests)),
+        __run(name="GetMetrics", concurrency=concurrency, requests=requests, request=__metrics(gateway=gateway)),
+    ]
+    if service:
+        results.append(__run(name="GetServiceEstimatedCost", concurrency=concurrency, requests=requests,
+                             request=__estimated_cost(gateway=gateway, service=service)))
+    else:
+        print("No service on the registry, GetServiceEstimatedCost is not measured.")
+
+    print(f"{'':<24}{'reqs':>8}{'errors':>8}{'req/s':>10}{'MB/s':>10}"
+          f"{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for result in results:
+        print(result)
@@ -0,0 +1,68 @@
+import json
+import os
+import shutil
+from hashlib import sha3_256
+
+from src.manager.block_store import collect_unused_blocks, register_service_blocks, unregister_service_blocks
+from src.database.sql_connection import SQLConnection
+from src.utils.env import EnvManager
+
+env_manager = EnvManager()
+
+REGISTRY = env_manager.get_env("REGISTRY")
+BLOCKDIR = env_manager.get_env("BLOCKDIR")
+
+"""
+Checks that the block garbage collector keeps the blocks of the services on the registry, both the ones
+stored before the block references existed and the registered ones, and collects them once unreferenced.
+
+    python nodo.py test test_block_store
+"""
+
+
+def __fake_service() -> (str, str):
+    block = os.urandom(1024)
+    block_hash = sha3_256(block).hexdigest()
+    service_hash = sha3_256(block_hash.encode()).hexdigest()
+
+    with open(os.path.join(BLOCKDIR, block_hash), "wb") as f:
+        f.write(block)
+    os.utime(os.path.join(BLOCKDIR, block_hash), (0, 0))  # Older than any grace period.
+
+    os.makedirs(os.path.join(REGISTRY, service_hash))
+    with open(os.path.join(REGISTRY, service_hash, "_.json"), "w") as f:
+        json.dump([[block_hash, 0]], f)
+    return service_hash, block_hash
+
+
+def test_block_store():
+    sc = SQLConnection()
+    sc._execute('DELETE FROM block_store_state')  # As a node upgraded from before the block store.
+
+    # A service stored without references, as the ones on the registry before an upgrade.
+    legacy_service, legacy_block = __fake_service()
+    # A service registered on store.
+    service, block = __fake_service()
+    register_service_blocks(service_hash=service)
+
+    try:
+        collect_unused_blocks(batch_size=None, grace_period=0)
+        assert os.path.exists(os.path.join(BLOCKDIR, legacy_block)), "Block of a legacy service collected."
+        assert os.path.exists(os.path.join(BLOCKDIR, block)), "Block of a registered service collected."
+        assert sc.get_block(block_hash=legacy_block)['refs'] == 1, "Legacy service blocks not referenced."
+        print("The blocks of the services on the registry are kept: ok")
+
+        shutil.rmtree(os.path.join(REGISTRY, service))
+        unregister_service_blocks(service_hash=service)
+        collect_unused_blocks(batch_size=None, grace_period=0)
+        assert not os.path.exists(os.path.join(BLOCKDIR, block)), "Unreferenced block not collected."
+        assert os.path.exists(os.path.join(BLOCKDIR, legacy_block))
+        print("Unreferenced blocks are collected: ok")
+
+    finally:
+        for _service, _block in ((legacy_service, legacy_block), (service, block)):
+            shutil.rmtree(os.path.join(REGISTRY, _service), ignore_errors=True)
+            unregister_service_blocks(service_hash=_service)
+            if os.path.exists(os.path.join(BLOCKDIR, _block)):
+                os.remove(os.path.join(BLOCKDIR, _block))
+            sc.delete_block(block_hash=_block)
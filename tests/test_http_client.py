@@ -0,0 +1,94 @@
+import json
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict
+
+from src.utils.http_client import HttpClient, HTTP_CLIENT_RETRIES
+
+"""
+Checks the shared HTTP client against a local stub of the ledger API: retries on server errors,
+failover to the next base url and the response cache.
+
+    python nodo.py test test_http_client
+"""
+
+hits: Dict[str, int] = {}
+
+
+class _StubApi(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        hits[self.path] = hits.get(self.path, 0) + 1
+        if self.path == "/flaky" and hits[self.path] <= HTTP_CLIENT_RETRIES:
+            self.send_response(503)
+            self.end_headers()
+            return
+        if self.path == "/missing":
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = json.dumps({"path": self.path, "hits": hits[self.path]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def __closed_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def test_http_client():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StubApi)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    stub = f"http://127.0.0.1:{server.server_address[1]}"
+    down = f"http://127.0.0.1:{__closed_port()}"
+    client = HttpClient()
+
+    response = client.get(path="/flaky", base_urls=[stub])
+    assert response.status_code == 200 and hits["/flaky"] == HTTP_CLIENT_RETRIES + 1, hits
+    print("Retries on server errors: ok")
+
+    hits.clear()
+    response = client.get(path="/flaky", base_urls=[stub], retries=0)
+    assert response.status_code == 503 and hits["/flaky"] == 1, hits
+    print("Single attempt without retries: ok")
+
+    response = client.get(path="/info", base_urls=[down, stub])
+    assert response.status_code == 200 and response.json()["path"] == "/info"
+    print("Failover to the next base url: ok")
+
+    response = client.get(path="/missing", base_urls=[stub, down])
+    assert response.status_code == 404 and hits["/missing"] == 1
+    print("Client errors are returned without retries: ok")
+
+    first = client.get(path="/balance", base_urls=[stub], cache_ttl=10).json()
+    second = client.get(path="/balance", base_urls=[stub], cache_ttl=10).json()
+    assert first == second and hits["/balance"] == 1
+    client.invalidate(path="/balance")
+    assert client.get(path="/balance", base_urls=[stub], cache_ttl=10).json()["hits"] == 2
+    print("Response cache: ok")
+
+    other = ThreadingHTTPServer(("127.0.0.1", 0), _StubApi)
+    threading.Thread(target=other.serve_forever, daemon=True).start()
+    client.get(path="/balance", base_urls=[f"http://127.0.0.1:{other.server_address[1]}"], cache_ttl=10)
+    assert hits["/balance"] == 3, hits
+    other.shutdown()
+    print("Response cache by base url: ok")
+
+    try:
+        client.get(path="/info", base_urls=[down])
+        raise AssertionError("An unreachable url must raise.")
+    except AssertionError:
+        raise
+    except Exception as e:
+        print(f"Unreachable url raises {type(e).__name__}: ok")
+
+    server.shutdown()
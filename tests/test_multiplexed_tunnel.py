@@ -0,0 +1,131 @@
+import queue
+import socket
+import threading
+from typing import Dict, Iterator, List, Tuple
+
+from src.tunneling_system.multiplexed_tunnel import (
+    MultiplexedTunnel, encode_frame, decode_frame, OPEN, DATA, CLOSE, RESET, WINDOW, TUNNEL_MUX_WINDOW, _CREDIT
+)
+
+"""
+Checks the multiplexed tunnel framing against a local echo server, with the client stream in memory:
+the channels, the flow control windows and the half-close of the client stream.
+
+    python nodo.py test test_multiplexed_tunnel
+"""
+
+
+def __echo_server() -> int:
+    server = socket.create_server(("127.0.0.1", 0))
+
+    def echo(conn: socket.socket):
+        with conn:
+            while True:
+                data = conn.recv(65536)
+                if not data:
+                    break
+                conn.sendall(data)
+
+    def accept():
+        while True:
+            conn, _ = server.accept()
+            threading.Thread(target=echo, args=(conn,), daemon=True).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+    return server.getsockname()[1]
+
+
+def __client(requests: queue.Queue) -> Iterator[bytes]:
+    # The client stream, until a None is queued.
+    while True:
+        frame = requests.get()
+        if frame is None:
+            return
+        yield frame
+
+
+def __tunnel(requests: queue.Queue) -> queue.Queue:
+    # The response frames of the tunnel, a None once the response stream ended.
+    responses: queue.Queue = queue.Queue()
+
+    def read():
+        for frame in MultiplexedTunnel(container_ip="127.0.0.1", iterator=__client(requests)).frames():
+            responses.put(frame)
+        responses.put(None)
+
+    threading.Thread(target=read, daemon=True).start()
+    return responses
+
+
+def __read(responses: queue.Queue, data: Dict[int, bytes], control: List[Tuple[int, int]], timeout: float = 5) -> bool:
+    # Reads a response frame, False once the response stream ended.
+    frame = responses.get(timeout=timeout)
+    if frame is None:
+        return False
+    channel, frame_type, payload = decode_frame(frame)
+    if frame_type == DATA:
+        data[channel] = data.get(channel, b'') + bytes(payload)
+    elif frame_type != WINDOW:
+        control.append((channel, frame_type))
+    return True
+
+
+def test_multiplexed_tunnel():
+    port = str(__echo_server()).encode()
+
+    # Two channels, and the client half-closes the stream right after its requests.
+    requests: queue.Queue = queue.Queue()
+    for channel in (1, 2):
+        requests.put(encode_frame(channel, OPEN, port))
+        requests.put(encode_frame(channel, DATA, b"channel %d" % channel))
+        requests.put(encode_frame(channel, CLOSE))
+    requests.put(None)
+    responses = __tunnel(requests)
+    data: Dict[int, bytes] = {}
+    control: List[Tuple[int, int]] = []
+    while __read(responses, data, control):
+        pass
+    assert data == {1: b"channel 1", 2: b"channel 2"}, data
+    assert sorted(control) == [(1, CLOSE), (2, CLOSE)], control
+    print("Channels answer after the client half-close, then the stream ends: ok")
+
+    # The node sends up to the window granted by the client.
+    requests = queue.Queue()
+    requests.put(encode_frame(3, OPEN, port))
+    requests.put(encode_frame(3, DATA, b"x" * TUNNEL_MUX_WINDOW))
+    responses = __tunnel(requests)
+    data, control = {}, []
+    while len(data.get(3, b'')) < TUNNEL_MUX_WINDOW:
+        assert __read(responses, data, control)
+    requests.put(encode_frame(3, DATA, b"y" * 1024))  # Echoed, the node window is used up.
+    try:
+        while __read(responses, data, control, timeout=0.5):
+            assert len(data[3]) == TUNNEL_MUX_WINDOW, f"Data sent over the window: {len(data[3])} bytes."
+    except queue.Empty:
+        pass
+    requests.put(encode_frame(3, WINDOW, _CREDIT.pack(1024)))
+    while len(data[3]) < TUNNEL_MUX_WINDOW + 1024:
+        assert __read(responses, data, control)
+    assert data[3] == b"x" * TUNNEL_MUX_WINDOW + b"y" * 1024
+    print("Node to client window: ok")
+
+    # The client sends over the window granted by the node.
+    requests.put(encode_frame(4, OPEN, port))
+    requests.put(encode_frame(4, DATA, b"z" * (2 * TUNNEL_MUX_WINDOW + 1)))
+    while (4, RESET) not in control:
+        assert __read(responses, data, control)
+    print("Client to node window exceeded resets the channel: ok")
+
+    # A channel to a closed port is reset, and the stream ends after the client half-close.
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        closed_port = str(s.getsockname()[1]).encode()
+    requests.put(encode_frame(5, OPEN, closed_port))
+    while (5, RESET) not in control:
+        assert __read(responses, data, control)
+    requests.put(encode_frame(3, CLOSE))
+    requests.put(None)
+    while __read(responses, data, control):
+        pass
+    assert (3, CLOSE) in control, control
+    print("Refused channels are reset, and the stream ends once the channels finished: ok")
@@ -0,0 +1,63 @@
+from protos import gateway_pb2, celaut_pb2
+from src.manager.usage_collector import RollingStats, ServiceUsage, container_service_hash, USAGE_STATS_ALPHA
+from src.utils.cost_functions.general_cost_functions import (
+    CostModel, compute_maintenance_cost, compute_service_maintenance_cost
+)
+from src.utils.utils import from_gas_amount
+
+"""
+Checks the rolling usage statistics and that the maintenance billed to a running service is the one
+its cost was estimated with.
+
+    python nodo.py test test_usage_collector
+"""
+
+MB = pow(2, 20)
+
+
+class _Container:
+
+    def __init__(self, image: str):
+        self.attrs = {"Config": {"Image": image}}
+
+
+def __usage(samples) -> ServiceUsage:
+    usage = ServiceUsage()
+    for sample in samples:
+        usage.memory.add(sample)
+    return usage
+
+
+def test_usage_collector():
+    stats = RollingStats()
+    for _ in range(100):
+        stats.add(100 * MB)
+    assert stats.mean == 100 * MB and stats.std == 0, (stats.mean, stats.std)
+    stats.add(200 * MB)
+    assert abs(stats.mean - (100 + USAGE_STATS_ALPHA * 100) * MB) < 1 and stats.std > 0
+    print("Rolling statistics: ok")
+
+    assert container_service_hash(_Container("ab12.docker")) == "ab12"
+    assert container_service_hash(_Container("python:3.11")) is None
+    print("Service hash of a container: ok")
+
+    usage = __usage([80 * MB, 120 * MB] * 50)
+    limit = 512 * MB
+    billed = compute_service_maintenance_cost(mem_limit=limit, usage=usage)
+    assert billed < compute_maintenance_cost(system_resources=celaut_pb2.Sysresources(mem_limit=limit))
+
+    estimated = CostModel(execution_cost=0, usage=usage).estimated_cost(
+        initial_gas_amount=0,
+        resource=gateway_pb2.CombinationResources.Clause(max_sysreq=celaut_pb2.Sysresources(mem_limit=limit)),
+        maintenance_seconds_loop=1,
+        clause_id=1
+    )
+    assert from_gas_amount(estimated.min_maintenance_cost) <= billed <= from_gas_amount(estimated.max_maintenance_cost), \
+        (estimated, billed)
+    print("Billed within the estimated maintenance: ok")
+
+    assert compute_service_maintenance_cost(mem_limit=64 * MB, usage=usage) == \
+           compute_maintenance_cost(system_resources=celaut_pb2.Sysresources(mem_limit=64 * MB))
+    assert compute_service_maintenance_cost(mem_limit=limit, usage=None) == \
+           compute_maintenance_cost(system_resources=celaut_pb2.Sysresources(mem_limit=limit))
+    print("Billed up to the limit, and from it before any observation: ok")
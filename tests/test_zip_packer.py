@@ -0,0 +1,150 @@
+import io
+import json
+import os
+import shutil
+import tarfile
+from typing import List, Optional, Tuple
+
+import src.packers.zip_with_dockerfile as zip_packer
+from src.packers.zip_with_dockerfile import ZipContainerPacker, _Entry
+from src.utils.env import EnvManager
+
+env_manager = EnvManager()
+
+CACHE = env_manager.get_env("CACHE")
+BLOCKDIR = env_manager.get_env("BLOCKDIR")
+
+"""
+Checks the zip packer on hand made images: the merge of the layers read from the image (whiteouts, links
+and hard links), and the incremental pack, where the blocks of the files with the same content as on
+the last pack are reused and the ones whose content changed are created again.
+
+    python nodo.py test test_zip_packer
+"""
+
+BLOCK_SIZE = 1024
+
+
+def __member(path: str, content: bytes = b"", mtime: int = 1, kind: bytes = tarfile.REGTYPE, linkname: str = "") \
+        -> Tuple[tarfile.TarInfo, bytes]:
+    member = tarfile.TarInfo(path)
+    member.type, member.linkname, member.mtime = kind, linkname, mtime
+    member.size = len(content)
+    return member, content
+
+
+def __image(aux_id: str, layers: List[List[Tuple[tarfile.TarInfo, bytes]]]):
+    # Writes the image as docker save does, with a tar of each layer.
+    os.makedirs(CACHE + aux_id + "/building", exist_ok=True)
+    with tarfile.open(CACHE + aux_id + "/building/container.tar", "w") as image:
+        names = []
+        for index, files in enumerate(layers):
+            layer = io.BytesIO()
+            with tarfile.open(fileobj=layer, mode="w") as layer_tar:
+                for member, content in files:
+                    layer_tar.addfile(member, io.BytesIO(content))
+            names.append(f"{index}/layer.tar")
+            member = tarfile.TarInfo(names[-1])
+            member.size = len(layer.getvalue())
+            image.addfile(member, io.BytesIO(layer.getvalue()))
+        manifest = json.dumps([{"Layers": names}]).encode()
+        member = tarfile.TarInfo("manifest.json")
+        member.size = len(manifest)
+        image.addfile(member, io.BytesIO(manifest))
+
+
+def __packer(aux_id: str) -> ZipContainerPacker:
+    # The packer of an already built image.
+    packer = ZipContainerPacker.__new__(ZipContainerPacker)
+    packer.aux_id = aux_id
+    packer.json = {"tag": "test_zip_packer", "architecture": "linux/amd64"}
+    packer.layers = []
+    return packer
+
+
+def __pack(packer: ZipContainerPacker) -> Tuple[_Entry, int]:
+    # Reads the image as ZipContainerPacker.parseContainer does.
+    packer.blocks = []
+    packer._ZipContainerPacker__blocks_set = set()
+    root = packer._ZipContainerPacker__merge_layers()
+    return root, packer._ZipContainerPacker__read_files(root=root)
+
+
+def __entry(root: _Entry, path: str) -> Optional[_Entry]:
+    entry = root
+    for part in path.split("/"):
+        entry = entry.children.get(part) if entry else None
+    return entry
+
+
+def test_zip_packer():
+    aux_id = os.urandom(8).hex()
+    zip_packer.INCREMENTAL_PACK = True
+    zip_packer.MIN_BUFFER_BLOCK_SIZE = BLOCK_SIZE
+    base, app = os.urandom(4 * BLOCK_SIZE), os.urandom(4 * BLOCK_SIZE)
+    packer = __packer(aux_id)
+    blocks = set()
+
+    try:
+        __image(aux_id, [[__member("lib/base", base, 1)], [__member("app/main", app, 1), __member("app/small", b"small", 1)]])
+        _, reused = __pack(packer)
+        assert reused == 0 and len(packer.blocks) == 2, (reused, packer.blocks)
+        first = set(packer.blocks)
+        blocks.update(packer.blocks)
+        print("First pack creates the blocks: ok")
+
+        # Rebuilt without the build cache: same content, newer mtimes.
+        __image(aux_id, [[__member("lib/base", base, 2)], [__member("app/main", app, 2), __member("app/small", b"small", 2)]])
+        _, reused = __pack(packer)
+        assert reused == 2 and set(packer.blocks) == first, (reused, packer.blocks)
+        print("Blocks of the unchanged files are reused: ok")
+
+        # Same size and mtime, different content.
+        changed = os.urandom(4 * BLOCK_SIZE)
+        __image(aux_id, [[__member("lib/base", base, 2)], [__member("app/main", changed, 2), __member("app/small", b"small", 2)]])
+        _, reused = __pack(packer)
+        assert reused == 1 and len(packer.blocks) == 2 and set(packer.blocks) != first, (reused, packer.blocks)
+        blocks.update(packer.blocks)
+        print("Blocks of the changed files are created again: ok")
+
+        __image(aux_id, [
+            [
+                __member("etc", kind=tarfile.DIRTYPE),
+                __member("etc/hosts", b"hosts"),
+                __member("etc/old", b"old"),
+                __member("opt/lib/lower", b"lower"),
+                __member("opt/lib/sub/lower", b"lower"),
+                __member("opt/current", kind=tarfile.SYMTYPE, linkname="lib"),
+                __member("loop", kind=tarfile.SYMTYPE, linkname="/loop/x"),
+            ],
+            [
+                __member("etc/.wh.old"),
+                __member("opt/lib/sub", kind=tarfile.DIRTYPE),
+                __member("opt/lib/.wh..wh..opq"),
+                __member("opt/current/upper", b"upper"),
+                __member("etc/hosts.link", kind=tarfile.LNKTYPE, linkname="etc/hosts"),
+                __member("etc/missing.link", kind=tarfile.LNKTYPE, linkname="etc/old"),
+                __member("loop/file", b"file"),
+            ]
+        ])
+        root, _ = __pack(packer)
+        assert __entry(root, "etc/hosts").content == b"hosts" and not __entry(root, "etc/old")
+        assert sorted(__entry(root, "opt/lib").children) == ["sub", "upper"], __entry(root, "opt/lib").children
+        assert not __entry(root, "opt/lib/sub").children, __entry(root, "opt/lib/sub").children
+        print("Whiteouts: ok")
+        assert __entry(root, "opt/current").kind == _Entry.LINK and __entry(root, "opt/current").src == "/opt/lib"
+        assert __entry(root, "opt/lib/upper").content == b"upper"
+        print("Members under a link to a directory go to its target: ok")
+        assert __entry(root, "etc/hosts.link") is __entry(root, "etc/hosts")
+        assert not __entry(root, "etc/missing.link")
+        print("Hard links share the target entry, and are ignored without it: ok")
+        assert __entry(root, "loop/file").content == b"file"
+        print("Link loops: ok")
+
+    finally:
+        shutil.rmtree(CACHE + aux_id, ignore_errors=True)
+        if os.path.exists(packer._ZipContainerPacker__manifest_file()):
+            os.remove(packer._ZipContainerPacker__manifest_file())
+        for block in blocks:
+            if os.path.exists(BLOCKDIR + block.hex()):
+                os.remove(BLOCKDIR + block.hex())